@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+"""Micro-benchmark for chat metadata extraction.
+
+Compares the old path, which ran json.loads twice per record (once for the
+date and once for the title), with the single-pass extract_metadata() and its
+incremental streaming mode, on synthetic composer records from 10 KB to 50 MB.
+Each is timed, and its peak memory use while extracting is traced, not
+counting the record itself.
+
+    python benchmarks/bench_metadata.py [--sizes 10K,1M,50M] [--json]
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import tracemalloc
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from cursor_chat_core import extract_metadata
+
+DEFAULT_SIZES = "10K,100K,1M,10M,50M"
+
+def parse_size(text):
+    units = {"K": 1024, "M": 1024 * 1024}
+    text = text.strip().upper()
+    if text[-1] in units:
+        return int(float(text[:-1]) * units[text[-1]])
+    return int(text)
+
+def make_record(target_size):
+    """Build a composer-style record of roughly target_size bytes. As in
+    Cursor's own data, createdAt and name come after the conversation."""
+    conversation = []
+    size = 0
+    i = 0
+    while size < target_size:
+        text = f"Message {i}: " + "lorem ipsum dolor sit amet " * 40
+        bubble = {"type": 1 + i % 2, "bubbleId": f"bubble-{i}", "text": text}
+        if i % 2:
+            bubble["codeBlocks"] = [{"uri": {"path": f"/src/module_{i}.py"}, "code": "print('hello')\n" * 30}]
+        conversation.append(bubble)
+        size += len(json.dumps(bubble))
+        i += 1
+    record = {"_v": 3, "composerId": "benchmark", "conversation": conversation,
+              "createdAt": 1700000000000, "name": "Benchmark chat"}
+    return json.dumps(record).encode('utf-8')
+
+# The extraction path before single-pass metadata, kept here for comparison
+def legacy_extract_date_from_json(json_str):
+    try:
+        data = json.loads(json_str)
+        if isinstance(data, dict):
+            for key in ['createdAt', 'timestamp', 'date', 'time']:
+                if key in data and data[key]:
+                    try:
+                        timestamp = int(data[key])
+                        if timestamp > 1000000000000:
+                            timestamp /= 1000
+                        return datetime.fromtimestamp(timestamp).strftime("%Y-%m-%d %H:%M")
+                    except:
+                        if isinstance(data[key], str) and len(data[key]) > 5:
+                            return data[key]
+    except:
+        pass
+    return "Unknown"
+
+def legacy_extract_title_from_json(json_str):
+    try:
+        data = json.loads(json_str)
+        if isinstance(data, dict):
+            for key in ['title', 'name', 'subject']:
+                if key in data and data[key] and isinstance(data[key], str):
+                    return data[key][:40]
+    except:
+        pass
+    return ""
+
+def legacy_path(value):
+    json_str = value.decode('utf-8', errors='ignore')
+    return legacy_extract_date_from_json(json_str), legacy_extract_title_from_json(json_str)
+
+def time_call(func, value, min_time=0.5):
+    """Return the best per-call time in seconds over at least min_time."""
+    best = float("inf")
+    spent = 0.0
+    runs = 0
+    while spent < min_time or runs < 3:
+        start = time.perf_counter()
+        func(value)
+        elapsed = time.perf_counter() - start
+        best = min(best, elapsed)
+        spent += elapsed
+        runs += 1
+    return best
+
+def peak_memory(func, value):
+    """Return the most memory in bytes that func(value) allocated at once."""
+    tracemalloc.start()
+    try:
+        func(value)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", default=DEFAULT_SIZES, help="comma separated record sizes (default: %(default)s)")
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    args = parser.parse_args()
+
+    paths = [
+        ("legacy", legacy_path),
+        ("single_pass", lambda value: extract_metadata(value, streaming=False)),
+        ("streaming", lambda value: extract_metadata(value, streaming=True)),
+    ]
+    results = []
+    for size_text in args.sizes.split(","):
+        value = make_record(parse_size(size_text))
+        row = {"size": len(value)}
+        for name, func in paths:
+            row[name] = time_call(func, value)
+            row[name + "_peak_bytes"] = peak_memory(func, value)
+        results.append(row)
+        if not args.json:
+            print(f"{len(value) / 1024:>10.0f} KB  " +
+                  "  ".join(f"{name} {row[name] * 1000:9.2f} ms {row[name + '_peak_bytes'] / (1024 * 1024):7.1f} MB"
+                            for name, _ in paths) +
+                  f"  speedup {row['legacy'] / row['single_pass']:.2f}x")
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,288 @@
+#!/usr/bin/env python3
+"""Benchmark suite for the viewer's hot paths, run headless on a synthetic database.
+
+Each phase runs in a fresh Python process against a database from
+make_state_db.py (or one given with --db), so its peak RSS is its own:
+
+    list         listing chats without the metadata cache, as a first load does
+    index        listing with an empty cache, building it and the search index
+    list_cached  listing again with the cache filled
+    metadata     extract_metadata() on every chat value
+    transcript   parse_conversation() and a full transcript of every chat
+    search       full-text queries against the index
+    analyze      analyze_prefixes() over every key
+    export       export_chats() of every chat to JSON Lines
+
+Results are throughput and memory per phase: how far the phase raised the
+peak RSS above the process's own at its start, and the peak of its largest
+worker process. They come as JSON with --json or --output, and --compare
+reports changes against an earlier results file:
+
+    python benchmarks/bench_suite.py [--keys 10000] [--output results.json] [--compare baseline.json]
+
+Only the headless core is imported, so no display or tkinter is needed.
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import platform
+import argparse
+import tempfile
+import multiprocessing
+import subprocess
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+from cursor_chat_core import (
+    DEFAULT_KEY_PREFIX, database_pool, scan_chats, iter_prefixed_rows, decompress_value, extract_metadata,
+    parse_conversation, iter_chat_text, find_chats, analyze_prefixes, open_export_writer, export_chats, peak_rss,
+)
+from make_state_db import generate_database, add_arguments
+
+PHASES = ("list", "index", "list_cached", "metadata", "transcript", "search", "analyze", "export")
+
+SEARCH_QUERIES = ("python", "sorting threads", '"export archives"', "regress*", "title:composer", "nomatchatall")
+
+# A phase counts as a regression in --compare when it is this much slower or bigger
+DEFAULT_TOLERANCE = 0.10
+
+def _chat_values(db_path, prefix):
+    with database_pool.connection(db_path) as conn:
+        for _, value in iter_prefixed_rows(conn, prefix):
+            yield decompress_value(value)
+
+def phase_list(args):
+    chats = list(scan_chats(args.db, args.prefix, use_cache=False, workers=args.workers))
+    return len(chats), sum(chat.size for chat in chats)
+
+def phase_index(args):
+    chats = list(scan_chats(args.db, args.prefix, use_cache=True, workers=args.workers))
+    return len(chats), sum(chat.size for chat in chats)
+
+def phase_metadata(args):
+    count = size = 0
+    elapsed = 0.0
+    for value in _chat_values(args.db, args.prefix):
+        start = time.perf_counter()
+        extract_metadata(value)
+        elapsed += time.perf_counter() - start
+        count += 1
+        size += len(value)
+    # Only extraction is timed, not reading the values
+    return count, size, elapsed
+
+def phase_transcript(args):
+    count = size = 0
+    elapsed = 0.0
+    for value in _chat_values(args.db, args.prefix):
+        start = time.perf_counter()
+        try:
+            conversation = parse_conversation(value)
+        except UnicodeDecodeError:
+            conversation = None
+        if conversation is not None:
+            for _ in iter_chat_text(conversation):
+                pass
+        elapsed += time.perf_counter() - start
+        count += 1
+        size += len(value)
+    return count, size, elapsed
+
+def phase_search(args):
+    # The index is filled by the index phase; listing again only checks it is current
+    chats = list(scan_chats(args.db, args.prefix, use_cache=True, workers=args.workers))
+    start = time.perf_counter()
+    matches = 0
+    for query in SEARCH_QUERIES:
+        matches += len(find_chats(args.db, args.prefix, query, chats))
+    return len(SEARCH_QUERIES), matches, time.perf_counter() - start
+
+def phase_analyze(args):
+    analysis = analyze_prefixes(args.db)
+    return analysis.total, analysis.total_bytes
+
+def phase_export(args):
+    chats = list(scan_chats(args.db, args.prefix, use_cache=True, workers=args.workers))
+    path = os.path.join(args.work_dir, "export.jsonl")
+    start = time.perf_counter()
+    writer = open_export_writer(path, "jsonl")
+    try:
+        count = export_chats(chats, writer, workers=args.workers)
+    finally:
+        writer.close()
+    elapsed = time.perf_counter() - start
+    size = os.path.getsize(path)
+    os.remove(path)
+    return count, size, elapsed
+
+PHASE_FUNCTIONS = {
+    "list": phase_list,
+    "index": phase_index,
+    "list_cached": phase_index,
+    "metadata": phase_metadata,
+    "transcript": phase_transcript,
+    "search": phase_search,
+    "analyze": phase_analyze,
+    "export": phase_export,
+}
+
+def run_phase(args):
+    """Child process entry point: run one phase and print its result as JSON.
+
+    Phase functions return (items, bytes) and are timed whole, or return
+    (items, bytes, seconds) when only part of their work is the benchmark.
+    For search, bytes is the number of matches.
+    """
+    baseline_rss = peak_rss()
+    start = time.perf_counter()
+    result = PHASE_FUNCTIONS[args.run_phase](args)
+    elapsed = time.perf_counter() - start
+    if len(result) == 3:
+        items, size, elapsed = result
+    else:
+        items, size = result
+    # Pools shut down without waiting, and workers only count towards the children's peak once reaped
+    for child in multiprocessing.active_children():
+        child.join()
+    rss, children_rss = peak_rss(), peak_rss(children=True)
+    json.dump({
+        "seconds": elapsed,
+        "items": items,
+        "bytes": size,
+        "items_per_second": items / elapsed if elapsed else None,
+        "mb_per_second": size / elapsed / (1024 * 1024) if elapsed and args.run_phase != "search" else None,
+        "peak_rss_bytes": rss,
+        "baseline_rss_bytes": baseline_rss,
+        "children_peak_rss_bytes": children_rss,
+    }, sys.stdout)
+
+def measure(phase, args, env):
+    command = [sys.executable, os.path.abspath(__file__), "--run-phase", phase, "--db", args.db,
+               "--prefix", args.prefix, "--work-dir", args.work_dir]
+    if args.workers is not None:
+        command += ["--workers", str(args.workers)]
+    output = subprocess.run(command, env=env, check=True, stdout=subprocess.PIPE).stdout
+    return json.loads(output)
+
+def repo_version():
+    try:
+        output = subprocess.run(["git", "describe", "--always", "--dirty"], cwd=os.path.dirname(BENCH_DIR),
+                                stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, check=True).stdout
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return output.decode().strip() or None
+
+def phase_rss(row):
+    """The memory a phase itself took: its peak RSS less the interpreter's and
+    imports' at its start, or None for results without both."""
+    if not row.get("peak_rss_bytes") or row.get("baseline_rss_bytes") is None:
+        return None
+    return row["peak_rss_bytes"] - row["baseline_rss_bytes"]
+
+def _ratio(new, old):
+    return new / old if new is not None and old else None
+
+def compare(results, baseline, tolerance):
+    """Print how each phase changed against baseline and return the
+    regressed phases: slower, or using more memory in the phase itself or in
+    its worker processes, beyond tolerance."""
+    regressions = []
+    for phase, row in results["results"].items():
+        old = baseline.get("results", {}).get(phase)
+        if not old:
+            continue
+        time_ratio = _ratio(row["seconds"], old["seconds"])
+        rss_ratio = _ratio(phase_rss(row), phase_rss(old))
+        workers_ratio = _ratio(row.get("children_peak_rss_bytes"), old.get("children_peak_rss_bytes"))
+        flags = []
+        if time_ratio and time_ratio > 1 + tolerance:
+            flags.append("slower")
+        if rss_ratio and rss_ratio > 1 + tolerance:
+            flags.append("more memory")
+        if workers_ratio and workers_ratio > 1 + tolerance:
+            flags.append("more worker memory")
+        if flags:
+            regressions.append(phase)
+        print(f"{phase:<12} time {time_ratio or 0:6.2f}x  rss {rss_ratio or 0:6.2f}x  workers {workers_ratio or 0:6.2f}x"
+              f"  {', '.join(flags)}", file=sys.stderr)
+    return regressions
+
+def print_table(results):
+    for phase, row in results["results"].items():
+        rss = phase_rss(row)
+        workers = row.get("children_peak_rss_bytes")
+        rate = f"{row['mb_per_second']:8.1f} MB/s" if row["mb_per_second"] is not None else " " * 13
+        print(f"{phase:<12} {row['seconds']:8.3f} s  {row['items']:>8} items  {row['items_per_second'] or 0:10.0f}/s"
+              f"  {rate}  rss +{(rss or 0) / (1024 * 1024):7.1f} MB  workers {(workers or 0) / (1024 * 1024):7.1f} MB",
+              file=sys.stderr)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--db", help="benchmark this database instead of generating one")
+    parser.add_argument("--prefix", default=DEFAULT_KEY_PREFIX, help="key prefix of chat records (default: %(default)s)")
+    parser.add_argument("--workers", type=int, help="decode worker processes (default: CPU count)")
+    parser.add_argument("--phases", default=",".join(PHASES), help="comma separated phases to run (default: all)")
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    parser.add_argument("--output", help="also write results as JSON to this file")
+    parser.add_argument("--compare", metavar="RESULTS", help="report changes against an earlier results file")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE,
+                        help="slowdown or memory growth that --compare reports as a regression (default: %(default)s)")
+    add_arguments(parser)
+    parser.add_argument("--run-phase", choices=PHASES, help=argparse.SUPPRESS)
+    parser.add_argument("--work-dir", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_phase:
+        run_phase(args)
+        return 0
+
+    phases = [phase.strip() for phase in args.phases.split(",")]
+    unknown = set(phases) - set(PHASES)
+    if unknown:
+        parser.error(f"unknown phases: {', '.join(sorted(unknown))}")
+
+    args.work_dir = tempfile.mkdtemp(prefix="cursor-chat-bench-")
+    try:
+        if args.db:
+            database = {"path": args.db, "file_bytes": os.path.getsize(args.db)}
+        else:
+            args.db = os.path.join(args.work_dir, "state.vscdb")
+            database = generate_database(args.db, args.keys, args.mix, args.sizes, args.compressed, args.seed)
+            del database["path"]
+        # Every run starts from an empty metadata cache of its own
+        env = dict(os.environ, CURSOR_CHAT_VIEWER_CACHE=os.path.join(args.work_dir, "cache"))
+        results = {
+            "version": repo_version(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "workers": args.workers,
+            "database": database,
+            "results": {},
+        }
+        for phase in phases:
+            if phase in ("list_cached", "search", "export") and "index" not in results["results"]:
+                # These expect a filled cache; build it without reporting it
+                measure("index", args, env)
+            results["results"][phase] = measure(phase, args, env)
+            if not args.json:
+                print_table({"results": {phase: results["results"][phase]}})
+    finally:
+        shutil.rmtree(args.work_dir, ignore_errors=True)
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if compare(results, baseline, args.tolerance):
+            return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+"""Generate a synthetic Cursor state.vscdb for benchmarks.
+
+The cursorDiskKV table is filled with keys drawn from a weighted prefix mix.
+Chat prefixes (composerData: and the legacy chat:) get chat records with
+bubbles, dates and titles; other prefixes get bubble-like JSON. Value sizes
+are spread log-uniformly over a range, and a share of values is stored
+zlib-compressed the way Cursor does.
+
+    python benchmarks/make_state_db.py out.vscdb [--keys 10000] [--mix composerData:=1,bubbleId:=4]
+                                       [--sizes 1K:256K] [--compressed 0.3] [--seed 1]
+"""
+import os
+import sys
+import json
+import math
+import zlib
+import random
+import sqlite3
+import argparse
+
+DEFAULT_MIX = "composerData:=2,bubbleId:=6,chat:=1,checkpointId:=1"
+DEFAULT_SIZES = "1K:256K"
+
+# Prefixes whose records are whole chats rather than single bubbles or other state
+CHAT_PREFIXES = ("composerData:", "chat:")
+
+WORDS = ("the cursor chat viewer reads sqlite records and decodes json values quickly while "
+         "search finds messages about python sorting threads caching export archives and "
+         "regressions in the listing of large databases").split()
+
+def parse_size(text):
+    units = {"K": 1024, "M": 1024 * 1024, "G": 1024 * 1024 * 1024}
+    text = text.strip().upper()
+    if text[-1] in units:
+        return int(float(text[:-1]) * units[text[-1]])
+    return int(text)
+
+def parse_mix(text):
+    """Parse "prefix=weight,..." into [(prefix, weight), ...]."""
+    mix = []
+    for part in text.split(","):
+        prefix, _, weight = part.rpartition("=")
+        mix.append((prefix, float(weight)))
+    return mix
+
+# Message text is cut from one block of random words, which is much faster than
+# drawing every word on its own and compresses about as well as real chats. Words
+# follow Zipf's law over WORDS and VOCABULARY_SIZE made-up ones, so that, as in real
+# text, a few words are in every chat and most are rare.
+CORPUS_SIZE = 1024 * 1024
+VOCABULARY_SIZE = 20000
+
+def _corpus(rng):
+    letters = "abcdefghijklmnopqrstuvwxyz"
+    vocabulary = list(WORDS) + ["".join(rng.choice(letters) for _ in range(rng.randint(3, 10)))
+                                for _ in range(VOCABULARY_SIZE)]
+    weights = [1 / rank for rank in range(1, len(vocabulary) + 1)]
+    return " ".join(rng.choices(vocabulary, weights, k=CORPUS_SIZE // 6))[:CORPUS_SIZE]
+
+def _text(rng, corpus, size):
+    start = rng.randrange(len(corpus) - min(size, len(corpus)) + 1)
+    text = corpus[start:start + size]
+    return text * (size // len(text)) + text[:size % len(text)] if len(text) < size else text
+
+def _bubble(rng, corpus, index, text_size):
+    bubble = {"type": 1 + index % 2, "bubbleId": f"bubble-{index}", "text": _text(rng, corpus, max(1, text_size))}
+    if index % 2:
+        bubble["codeBlocks"] = [{"uri": {"path": f"/src/module_{index}.py"}, "languageId": "python",
+                                 "code": "def handler(event):\n    return event\n" * max(1, text_size // 400)}]
+    return bubble
+
+def make_chat(rng, corpus, prefix, index, target_size):
+    """Return a chat record of about target_size bytes for prefix."""
+    created = 1700000000000 + index * 60000
+    if prefix == "chat:":
+        messages = []
+        size = 0
+        while size < target_size or not messages:
+            message = {"role": ("user", "assistant")[len(messages) % 2],
+                       "content": _text(rng, corpus, rng.randint(100, 1200)), "timestamp": created // 1000}
+            messages.append(message)
+            size += len(json.dumps(message))
+        return {"title": f"Chat {index} {_text(rng, corpus, 20).strip()}", "timestamp": created, "messages": messages}
+
+    conversation = []
+    size = 0
+    text_size = min(4000, max(40, target_size // 8))
+    while size < target_size or not conversation:
+        bubble = _bubble(rng, corpus, len(conversation), text_size)
+        conversation.append(bubble)
+        size += len(json.dumps(bubble))
+    return {"_v": 3, "composerId": f"composer-{index}", "conversation": conversation,
+            "createdAt": created, "name": f"Composer {index} {_text(rng, corpus, 20).strip()}"}
+
+def make_value(rng, corpus, prefix, index, target_size):
+    if prefix in CHAT_PREFIXES:
+        record = make_chat(rng, corpus, prefix, index, target_size)
+    else:
+        record = _bubble(rng, corpus, index, target_size)
+    return json.dumps(record, ensure_ascii=False).encode("utf-8")
+
+def generate_database(path, keys=10000, mix=DEFAULT_MIX, sizes=DEFAULT_SIZES, compressed=0.3, seed=1):
+    """Write a synthetic database to path, replacing any file there, and
+    return a dict describing what was generated."""
+    if os.path.exists(path):
+        os.remove(path)
+    rng = random.Random(seed)
+    corpus = _corpus(rng)
+    prefixes, weights = zip(*parse_mix(mix))
+    low, _, high = sizes.partition(":")
+    low = parse_size(low)
+    high = parse_size(high or low)
+
+    counts = dict.fromkeys(prefixes, 0)
+    total_bytes = 0
+    conn = sqlite3.connect(path)
+    try:
+        conn.execute("CREATE TABLE ItemTable (key TEXT UNIQUE ON CONFLICT REPLACE, value BLOB)")
+        conn.execute("CREATE TABLE cursorDiskKV (key TEXT UNIQUE ON CONFLICT REPLACE, value BLOB)")
+        rows = []
+        for index in range(keys):
+            prefix = rng.choices(prefixes, weights)[0]
+            # Log-uniform sizes give many small records and a few large ones, as in real databases
+            target_size = int(math.exp(rng.uniform(math.log(low), math.log(high))))
+            value = make_value(rng, corpus, prefix, index, target_size)
+            if rng.random() < compressed:
+                value = zlib.compress(value)
+            rows.append((f"{prefix}{index:08d}", value))
+            counts[prefix] += 1
+            total_bytes += len(value)
+            if len(rows) >= 500:
+                conn.executemany("INSERT INTO cursorDiskKV VALUES (?, ?)", rows)
+                rows = []
+        conn.executemany("INSERT INTO cursorDiskKV VALUES (?, ?)", rows)
+        conn.commit()
+    finally:
+        conn.close()
+    return {"path": path, "keys": keys, "prefixes": counts, "value_bytes": total_bytes,
+            "file_bytes": os.path.getsize(path), "sizes": sizes, "compressed": compressed, "seed": seed}
+
+def add_arguments(parser):
+    parser.add_argument("--keys", type=int, default=10000, help="number of records (default: %(default)s)")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="prefix=weight list of key prefixes (default: %(default)s)")
+    parser.add_argument("--sizes", default=DEFAULT_SIZES, help="range of value sizes, low:high (default: %(default)s)")
+    parser.add_argument("--compressed", type=float, default=0.3,
+                        help="share of values stored zlib-compressed (default: %(default)s)")
+    parser.add_argument("--seed", type=int, default=1, help="random seed (default: %(default)s)")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("path", help="database file to write")
+    add_arguments(parser)
+    args = parser.parse_args()
+    info = generate_database(args.path, args.keys, args.mix, args.sizes, args.compressed, args.seed)
+    json.dump(info, sys.stdout, indent=2)
+    sys.stdout.write("\n")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,275 @@
+#!/usr/bin/env python3
+"""Command line interface to Cursor chat databases, for scripts and servers.
+
+Every subcommand writes JSON Lines to stdout, one object per chat or prefix,
+as results are produced:
+
+    python cursor_chat_cli.py --db state.vscdb list [--since 7d] [--title fix] [--min-size 10000] [--sort size]
+    python cursor_chat_cli.py --db state.vscdb show <chat id or key> [--text]
+    python cursor_chat_cli.py --db state.vscdb search "exact phrase"
+    python cursor_chat_cli.py --db state.vscdb export [--output chats.jsonl|chats.zip|chats.tar.gz|dir/]
+    python cursor_chat_cli.py --db state.vscdb analyze [--sample N] [--largest N]
+    python cursor_chat_cli.py --db ~/.config/Cursor/User archive history.ccarchive
+
+show is the exception and prints the chat itself, pretty-printed, as is export
+when it writes to a directory or archive. archive adds the chats, and the
+bubbles of newer chats, to a deduplicated archive that --db can read later,
+and prints what it added. list can keep just the chats from a date range,
+with a title prefix or within a size range, and sort them by any column. --stats and --trace write where the
+time went, and counts of rows and bytes read, as JSON or as a trace. --db may be given several times and
+may name directories, which are searched for databases; chats found in more
+than one database are listed once. Only the headless core is imported, so no
+display or tkinter is needed.
+
+    python cursor_chat_cli.py --db ~/.config/Cursor/User --db backups/ list
+"""
+import os
+import sys
+import json
+import sqlite3
+import argparse
+
+from cursor_chat_core import (
+    DEFAULT_DB_PATH, DEFAULT_KEY_PREFIX, SEARCH_LIMIT, EXPORT_FORMATS, scan_chats, fetch_value,
+    decompress_value, analyze_prefixes, find_chats, iter_formatted_value, format_chat_text,
+    chat_record, open_export_writer, export_chats, discover_databases, scan_sources, merge_chats,
+    database_pool, record_fetcher, Stats, NO_STATS, write_stats_json, write_stats_trace,
+    ARCHIVE_PREFIXES, archive_chats, SORT_COLUMNS, SortIndex, parse_time,
+)
+
+def write_line(out, record):
+    out.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+def time_argument(text):
+    try:
+        return parse_time(text)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e))
+
+def count_argument(text):
+    try:
+        value = int(text)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"not a number: {text!r}")
+    if value < 1:
+        raise argparse.ArgumentTypeError("must be at least 1")
+    return value
+
+def scan(args):
+    """Yield the chats of every database in args.sources."""
+    if len(args.sources) == 1:
+        # Stream a single database's chats as they are decoded
+        yield from scan_chats(args.sources[0], args.prefix, use_cache=not args.no_cache, workers=args.workers,
+                              stats=args.stats)
+        return
+    listings = dict(scan_sources(args.sources, args.prefix, use_cache=not args.no_cache, workers=args.workers,
+                                 stats=args.stats))
+    yield from merge_chats(listings[path] for path in args.sources if path in listings)
+
+def cmd_list(args, out):
+    filters = dict(since=args.since, until=args.until, title=args.title, min_size=args.min_size, max_size=args.max_size)
+    unfiltered = all(value is None for value in filters.values())
+    if args.sort is None and args.order is None and args.limit is None and unfiltered:
+        for chat in scan(args):
+            write_line(out, chat_record(chat))
+        return
+    # Filtered and sorted lists need every chat first
+    chats = list(scan(args))
+    sort = args.sort or "date"
+    order = args.order or ("desc" if sort == "date" else "asc")
+    with args.stats.timer("query"):
+        positions = SortIndex(chats).query(sort, order == "desc", limit=args.limit, **filters)
+    for position in positions:
+        write_line(out, chat_record(chats[position]))
+
+def cmd_show(args, out):
+    value = None
+    for path in args.sources:
+        try:
+            with database_pool.connection(path) as conn:
+                # Accept a chat id as well as a full key
+                for key in (args.key, args.prefix + args.key):
+                    try:
+                        value = fetch_value(conn, key)
+                        break
+                    except KeyError:
+                        pass
+        except sqlite3.DatabaseError as e:
+            if len(args.sources) == 1:
+                raise
+            args.stats.warn(f"Skipping {path}: {str(e)}")
+        if value is not None:
+            break
+    else:
+        raise KeyError(args.key)
+    value = decompress_value(value)
+    if args.text:
+        # Newer chats keep their messages in records of their own in the same database
+        out.write(format_chat_text(value, record_fetcher(path)))
+    else:
+        for piece in iter_formatted_value(value):
+            out.write(piece)
+    out.write("\n")
+
+def cmd_search(args, out):
+    # Listing first brings the full-text index up to date
+    chats = {chat.key: chat for chat in scan(args)}
+    for key, snippet in find_chats(args.sources, args.prefix, args.query, chats.values(), limit=args.limit,
+                                   stats=args.stats):
+        record = chat_record(chats[key]) if key in chats else {"key": key}
+        record["snippet"] = snippet
+        write_line(out, record)
+
+def cmd_export(args, out):
+    chats = list(scan(args))
+    if args.query:
+        matches = find_chats(args.sources, args.prefix, args.query, chats, limit=len(chats), stats=args.stats)
+        by_key = {chat.key: chat for chat in chats}
+        chats = [by_key[key] for key, _ in matches if key in by_key]
+    
+    if args.output:
+        writer = open_export_writer(args.output, args.format)
+    elif args.format in (None, "jsonl"):
+        writer = open_export_writer(out.buffer)
+    else:
+        raise ValueError(f"--format {args.format} needs --output")
+    try:
+        count = export_chats(chats, writer, args.content, workers=args.workers, stats=args.stats)
+    finally:
+        writer.close()
+    if args.output:
+        print(f"Exported {count} chats to {args.output}", file=sys.stderr)
+
+def cmd_analyze(args, out):
+    analysis = analyze_prefixes(args.sources, sample_every=args.sample, largest=args.largest or 0, stats=args.stats)
+    if args.largest:
+        for key, size, path in analysis.largest:
+            write_line(out, {"key": key, "size": size, "source": path})
+        return
+    for stats in analysis.prefixes:
+        write_line(out, {
+            "prefix": stats.prefix,
+            "count": stats.count,
+            "total_bytes": stats.total_bytes,
+            "average_bytes": stats.total_bytes // stats.count if stats.count else 0,
+            "compressed_share": stats.compressed_share,
+            "sample_every": analysis.sample_every,
+        })
+
+def cmd_archive(args, out):
+    prefixes = tuple(dict.fromkeys(ARCHIVE_PREFIXES + (args.prefix,) + tuple(args.include or ())))
+    summary = archive_chats(args.sources, args.output, prefixes, stats=args.stats)
+    record = {"archive": args.output}
+    record.update(summary._asdict())
+    record["file_bytes"] = os.path.getsize(args.output)
+    write_line(out, record)
+
+def add_database_arguments(parser):
+    """Add the options choosing the databases to read and how, shared with cursor_chat_server."""
+    parser.add_argument("--db", action="append",
+                        help="database file, or directory to search for databases; repeat for more "
+                             f"(default: {DEFAULT_DB_PATH})")
+    parser.add_argument("--prefix", default=DEFAULT_KEY_PREFIX, help="key prefix of chat records (default: %(default)s)")
+    parser.add_argument("--no-cache", action="store_true", help="do not read or update the metadata cache")
+    parser.add_argument("--immutable", action="store_true",
+                        help="open databases as unchanging snapshots, skipping all locking; only for copies nothing writes to")
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Read Cursor chat history without a GUI.")
+    add_database_arguments(parser)
+    parser.add_argument("--workers", type=int, help="decode worker processes (default: CPU count)")
+    parser.add_argument("--stats", metavar="FILE", dest="stats_path",
+                        help="write timings and counters of the command to FILE as JSON")
+    parser.add_argument("--trace", metavar="FILE", dest="trace_path",
+                        help="write a timeline of the command to FILE, for chrome://tracing or ui.perfetto.dev")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    listing = commands.add_parser("list", help="list chats with their metadata")
+    listing.add_argument("--since", type=time_argument, metavar="TIME",
+                         help="only chats from TIME on: a date such as 2024-05-01, or an age such as 12h, 7d or 2w")
+    listing.add_argument("--until", type=time_argument, metavar="TIME", help="only chats from before TIME")
+    listing.add_argument("--title", metavar="PREFIX", help="only chats whose title starts with PREFIX, ignoring case")
+    listing.add_argument("--min-size", type=int, metavar="BYTES", help="only chats of at least BYTES")
+    listing.add_argument("--max-size", type=int, metavar="BYTES", help="only chats of at most BYTES")
+    listing.add_argument("--sort", choices=SORT_COLUMNS, help="order by this column (default: date, when filtering)")
+    listing.add_argument("--order", choices=("asc", "desc"),
+                         help="sort direction (default: desc for date, newest first, asc otherwise)")
+    listing.add_argument("--limit", type=count_argument, help="list at most this many chats")
+    listing.set_defaults(func=cmd_list)
+
+    show = commands.add_parser("show", help="print one chat")
+    show.add_argument("key", help="record key or chat id")
+    show.add_argument("--text", action="store_true", help="print a readable transcript instead of JSON")
+    show.set_defaults(func=cmd_show)
+
+    search = commands.add_parser("search", help="full-text search, best match first")
+    search.add_argument("query")
+    search.add_argument("--limit", type=count_argument, default=SEARCH_LIMIT, help="most results (default: %(default)s)")
+    search.set_defaults(func=cmd_search)
+
+    export = commands.add_parser("export", help="write every chat with its content")
+    export.add_argument("--output", help="JSON Lines file, .zip or .tar[.gz] archive, or directory to write instead of stdout")
+    export.add_argument("--format", choices=EXPORT_FORMATS, help="override the format guessed from --output")
+    export.add_argument("--content", choices=("json", "text"), default="json",
+                        help="how each chat is written to a directory or archive (default: %(default)s)")
+    export.add_argument("--query", help="only export chats matching this search")
+    export.set_defaults(func=cmd_export)
+
+    analyze = commands.add_parser("analyze", help="count keys and value bytes per prefix, largest first")
+    analyze.add_argument("--sample", type=int, metavar="N",
+                         help="check only every Nth record for compression (default: 1, or 10 for databases over 1 GB)")
+    analyze.add_argument("--largest", type=int, metavar="N", help="list the N largest keys instead")
+    analyze.set_defaults(func=cmd_analyze)
+
+    archive = commands.add_parser("archive", help="add chats to a deduplicated, compressed archive that --db can open")
+    archive.add_argument("output", help="archive file to create or update, named *.ccarchive")
+    archive.add_argument("--include", action="append", metavar="PREFIX",
+                         help="also archive keys with this prefix; repeat for more")
+    archive.set_defaults(func=cmd_archive)
+    return parser
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    locations = args.db or [DEFAULT_DB_PATH]
+    missing = [path for path in locations if not os.path.exists(path)]
+    if missing:
+        print(f"No database at {', '.join(missing)}", file=sys.stderr)
+        return 1
+    args.sources = discover_databases(locations)
+    database_pool.immutable = args.immutable
+    if not args.sources:
+        print(f"No databases found in {', '.join(locations)}", file=sys.stderr)
+        return 1
+    # Measuring costs a little, so it is only done when the numbers are wanted
+    args.stats = Stats(args.command) if args.stats_path or args.trace_path else NO_STATS
+    try:
+        with args.stats.timer(args.command):
+            args.func(args, sys.stdout)
+        sys.stdout.flush()
+    except BrokenPipeError:
+        # The reader went away, as with `| head`; keep Python from complaining on exit
+        os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+    except KeyError as e:
+        print(f"No record with key {e.args[0]}", file=sys.stderr)
+        return 1
+    except (UnicodeDecodeError, ValueError, sqlite3.Error, OSError) as e:
+        print(f"Error: {str(e)}", file=sys.stderr)
+        return 1
+    finally:
+        write_stats(args)
+    return 0
+
+def write_stats(args):
+    if args.stats is NO_STATS:
+        return
+    args.stats.finish()
+    try:
+        if args.stats_path:
+            write_stats_json(args.stats_path, [args.stats])
+        if args.trace_path:
+            write_stats_trace(args.trace_path, [args.stats])
+    except OSError as e:
+        print(f"Could not write stats: {str(e)}", file=sys.stderr)
+
+if __name__ == "__main__":
+    sys.exit(main())
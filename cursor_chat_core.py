@@ -0,0 +1,2263 @@
+#!/usr/bin/env python3
+"""Headless core of Cursor Chat Viewer: reading Cursor's chat database,
+extracting chat metadata, caching and searching it, and formatting chats.
+
+Nothing here imports tkinter, so the command line tool (cursor_chat_cli.py)
+and scripts can use it on machines without a display.
+"""
+import os
+import sys
+import io
+import sqlite3
+import json
+import math
+import zlib
+import re
+import time
+import base64
+import hashlib
+import pathlib
+import threading
+from contextlib import contextmanager, nullcontext
+from datetime import datetime
+from bisect import bisect_left, bisect_right
+from collections import namedtuple, deque, Counter, OrderedDict
+
+# Key prefix of the records holding chats in current Cursor versions
+DEFAULT_KEY_PREFIX = "composerData:"
+
+# Connections to Cursor's databases memory-map up to READ_MMAP_SIZE bytes of the file, keep
+# a page cache of READ_CACHE_KIB, and wait up to BUSY_TIMEOUT seconds for a writer's lock.
+# Up to POOL_IDLE_CONNECTIONS unused connections per database are kept for reuse, and
+# POOL_IDLE_TOTAL across all databases, as each holds up to 3 file descriptors under WAL.
+READ_MMAP_SIZE = 256 * 1024 * 1024
+READ_CACHE_KIB = 16 * 1024
+BUSY_TIMEOUT = 10.0
+POOL_IDLE_CONNECTIONS = 4
+POOL_IDLE_TOTAL = 16
+
+# Number of rows pulled from the SQLite cursor at a time while scanning
+FETCH_BATCH_SIZE = 256
+
+# Records needing a decode are shipped to worker processes in batches of this size. The
+# pool is only worth starting when at least DECODE_PARALLEL_MIN_BYTES need decoding.
+DECODE_BATCH_SIZE = 64
+DECODE_PARALLEL_MIN_BYTES = 16 * 1024 * 1024
+
+# Newly decoded entries, including their search text, are written to the cache in groups of this size
+CACHE_FLUSH_SIZE = 256
+
+# Bulk exports are formatted in batches of at most this many records or bytes, and at
+# most EXPORT_IN_FLIGHT batches per worker are read ahead, which bounds memory use
+EXPORT_BATCH_SIZE = 64
+EXPORT_BATCH_BYTES = 8 * 1024 * 1024
+EXPORT_IN_FLIGHT = 2
+
+# Bulk export destinations, chosen from the file name unless given explicitly
+EXPORT_FORMATS = ("dir", "jsonl", "tar", "zip")
+
+# File names that discover_databases() treats as Cursor databases: state.vscdb and the
+# state.vscdb.backup copies Cursor keeps next to it
+DB_FILE_SUFFIXES = (".vscdb", ".vscdb.backup")
+
+# Chat archives written by archive_chats() are SQLite files with this suffix, which
+# discover_databases() also picks up. Values are split into chunks at every JSON string of
+# ARCHIVE_SPLIT_MIN bytes or more, such as message text and code, so text repeated across
+# chats and across versions of a chat is stored once; anything else is cut into chunks of
+# ARCHIVE_CHUNK_MAX bytes. Chunks are zlib-compressed with a dictionary of up to
+# ARCHIVE_DICT_SIZE bytes trained on the first ARCHIVE_DICT_SAMPLE records archived.
+ARCHIVE_SUFFIX = ".ccarchive"
+ARCHIVE_SPLIT_MIN = 256
+ARCHIVE_CHUNK_MAX = 64 * 1024
+ARCHIVE_DICT_SIZE = 32 * 1024
+ARCHIVE_DICT_SAMPLE = 200
+
+# Columns SortIndex orders chats by. A query walks the order of the column it sorts by unless
+# another filter matches SORT_INDEX_WALK_RATIO times fewer chats, whose range is then sorted instead.
+SORT_COLUMNS = ("date", "title", "size", "messages", "source", "key")
+SORT_INDEX_WALK_RATIO = 8
+
+# Most databases scanned at the same time when listing chats from several of them
+SOURCE_SCAN_THREADS = 8
+
+# Prefix analysis reads the start of every value to tell how much is zlib-compressed. On
+# databases larger than ANALYZE_SAMPLE_MIN_BYTES only every ANALYZE_SAMPLE_EVERY-th record
+# is checked unless asked otherwise; counts and sizes are always exact.
+ANALYZE_SAMPLE_MIN_BYTES = 1024 * 1024 * 1024
+ANALYZE_SAMPLE_EVERY = 10
+
+# Number of largest records reported by analyze_prefixes()
+ANALYZE_LARGEST_KEYS = 20
+
+# Most timed spans a Stats keeps for write_trace(); later ones are still added up
+STATS_TRACE_SPANS = 200000
+
+# Most full-text search results returned for one query
+SEARCH_LIMIT = 500
+
+# Formatted chats are produced as a first piece of about RENDER_FIRST_CHARS, so there
+# is something to show right away, followed by pieces of about RENDER_CHUNK_CHARS
+RENDER_FIRST_CHARS = 16 * 1024
+RENDER_CHUNK_CHARS = 64 * 1024
+
+# Decoded records larger than this are scanned member by member instead of parsed whole.
+# By benchmarks/bench_metadata.py, scanning allocates well under half the memory of
+# parsing (16 MB rather than 37 MB at peak for a 16 MB record) and is as fast from this
+# size on, while on smaller records it is up to a third slower for little memory saved.
+STREAMING_THRESHOLD = 16 * 1024 * 1024
+
+# Top-level fields that metadata is taken from, in order of preference
+DATE_FIELDS = ('createdAt', 'timestamp', 'date', 'time')
+TITLE_FIELDS = ('title', 'name', 'subject')
+MESSAGE_FIELDS = ('messages', 'conversation', 'fullConversationHeadersOnly')
+
+# Composer bubbles are user messages when their "type" is 1 and assistant replies when
+# it is 2. Newer records keep each bubble as its own record, keyed by BUBBLE_KEY_PREFIX
+# followed by "<composerId>:<bubbleId>".
+BUBBLE_ROLES = {1: "user", 2: "assistant"}
+BUBBLE_KEY_PREFIX = "bubbleId:"
+
+# Keys archive_chats() copies unless told otherwise: chats, and the bubbles newer chats keep apart
+ARCHIVE_PREFIXES = (DEFAULT_KEY_PREFIX, BUBBLE_KEY_PREFIX)
+
+# Listing entry for a chat; the value itself is fetched by key from the source database
+# when needed. The version is the record's rowid, which changes whenever Cursor rewrites it;
+# while the search index is kept, chats with bubble records of their own get a version
+# that also changes with those (see _bubble_versions).
+# timestamp is the chat's date in seconds since the epoch, or None when it has no readable date.
+ChatMeta = namedtuple("ChatMeta", ["chat_id", "date_str", "key", "title", "size", "compressed", "message_count", "version",
+                                   "source", "timestamp"])
+
+# Metadata extracted from a single record; size is the decoded length in bytes
+RecordMetadata = namedtuple("RecordMetadata", ["date_str", "title", "message_count", "size", "timestamp"])
+
+# Statistics for the records sharing a key prefix. compressed_share is the fraction stored
+# zlib-compressed, or None when sampling checked none of them.
+PrefixStats = namedtuple("PrefixStats", ["prefix", "count", "total_bytes", "compressed_share"])
+
+# Result of analyze_prefixes(): prefixes are PrefixStats, largest first, and largest
+# holds (key, size, db_path) for the biggest records
+DatabaseAnalysis = namedtuple("DatabaseAnalysis", ["total", "total_bytes", "prefixes", "largest", "sample_every"])
+
+# Result of archive_chats(): records whose content was new or changed and were added, records
+# already archived as they are, and the chunks and compressed bytes that were written
+ArchiveSummary = namedtuple("ArchiveSummary", ["added", "unchanged", "chunks", "stored_bytes"])
+
+# A block of code attached to a message; path is the file it belongs to, when known
+CodeBlock = namedtuple("CodeBlock", ["language", "path", "code"])
+
+# A tool the assistant ran in a message; params and result are JSON text as stored, or None
+ToolCall = namedtuple("ToolCall", ["name", "status", "params", "result"])
+
+def peak_rss(children=False):
+    """Return the peak resident set size in bytes of this process, or of its
+    finished child processes, or None where the resource module is missing."""
+    try:
+        import resource
+    except ImportError:
+        return None
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN if children else resource.RUSAGE_SELF)
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    return usage.ru_maxrss if sys.platform == "darwin" else usage.ru_maxrss * 1024
+
+class Stats:
+    """Counters, phase timers and warnings for one operation, such as a load.
+
+    Phases are timed with `with stats.timer("sqlite.read"):` and counts are
+    added with stats.add("rows_listed", n), from any thread. Phases run once
+    per record are cheaper to time with add_time(), which keeps no span for
+    the trace. warn() reports a
+    problem on stderr and keeps it for the stats report. Worker processes
+    fill Stats of their own and send them back as as_dict(spans=True) to be
+    combined with merge(). Every timed span is also kept, up to
+    STATS_TRACE_SPANS, for write_stats_trace(). finish() adds the peak
+    memory use of the process as bytes_peak_rss.
+    """
+    
+    def __init__(self, name=""):
+        self.name = name
+        self.started = time.time()
+        self.finished = None
+        self.counters = {}
+        self.timers = {}  # phase -> [seconds, calls]
+        self.spans = []  # (phase, perf_counter at start, seconds, pid, thread id)
+        self.warnings = []
+        self._lock = threading.Lock()
+    
+    def add(self, name, amount=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+    
+    @contextmanager
+    def timer(self, phase):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(phase, start, time.perf_counter() - start)
+    
+    def record(self, phase, start, seconds):
+        with self._lock:
+            timer = self.timers.setdefault(phase, [0.0, 0])
+            timer[0] += seconds
+            timer[1] += 1
+            if len(self.spans) < STATS_TRACE_SPANS:
+                self.spans.append((phase, start, seconds, os.getpid(), threading.get_ident()))
+    
+    def add_time(self, phase, seconds):
+        with self._lock:
+            timer = self.timers.setdefault(phase, [0.0, 0])
+            timer[0] += seconds
+            timer[1] += 1
+    
+    def warn(self, message):
+        print(message, file=sys.stderr)
+        with self._lock:
+            self.warnings.append(message)
+    
+    def finish(self):
+        """Mark the operation done, noting the process's peak memory use so far."""
+        self.finished = time.time()
+        rss = peak_rss()
+        if rss is not None:
+            with self._lock:
+                self.counters["bytes_peak_rss"] = rss
+    
+    @property
+    def seconds(self):
+        return (self.finished or time.time()) - self.started
+    
+    def merge(self, data):
+        """Add in the counters, timers and spans of another Stats' as_dict()."""
+        with self._lock:
+            for name, amount in data["counters"].items():
+                self.counters[name] = self.counters.get(name, 0) + amount
+            for phase, timer in data["timers"].items():
+                total = self.timers.setdefault(phase, [0.0, 0])
+                total[0] += timer["seconds"]
+                total[1] += timer["calls"]
+            room = max(0, STATS_TRACE_SPANS - len(self.spans))
+            self.spans.extend(tuple(span) for span in data.get("spans", ())[:room])
+            self.warnings.extend(data["warnings"])
+    
+    def as_dict(self, spans=False):
+        with self._lock:
+            data = {
+                "name": self.name,
+                "started": self.started,
+                "seconds": self.seconds,
+                "counters": dict(self.counters),
+                "timers": {phase: {"seconds": seconds, "calls": calls}
+                           for phase, (seconds, calls) in self.timers.items()},
+                "warnings": list(self.warnings),
+            }
+            if spans:
+                data["spans"] = list(self.spans)
+        return data
+    
+    def format(self):
+        """Return the stats as a plain text report."""
+        data = self.as_dict()
+        state = "" if self.finished else " (running)"
+        lines = [f"{self.name or 'Operation'}: {data['seconds']:.3f} s{state}"]
+        # Phases in worker processes and threads overlap, so they can add up to more than the total
+        for phase, timer in sorted(data["timers"].items(), key=lambda item: -item[1]["seconds"]):
+            lines.append(f"  {phase:<16} {timer['seconds']:10.3f} s  {timer['calls']:>9} calls")
+        for name, amount in sorted(data["counters"].items()):
+            value = format_size(amount) if name.startswith("bytes") else str(amount)
+            lines.append(f"  {name:<16} {value:>12}")
+        lines.extend(f"  ! {message}" for message in data["warnings"])
+        return "\n".join(lines)
+
+def write_stats_json(path, stats_list):
+    """Write a list of Stats to path as JSON."""
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump([stats.as_dict() for stats in stats_list], f, indent=2)
+
+def write_stats_trace(path, stats_list):
+    """Write the timed spans of a list of Stats in Chrome's trace event
+    format, which chrome://tracing and https://ui.perfetto.dev open as a
+    timeline. Spans are categorized by the name of their Stats."""
+    spans = [(stats.name, span) for stats in stats_list for span in stats.as_dict(spans=True)["spans"]]
+    # perf_counter is a system-wide clock, so spans from worker processes line up
+    origin = min((span[1] for _, span in spans), default=0.0)
+    events = [{"name": phase, "cat": name, "ph": "X", "ts": (start - origin) * 1e6, "dur": seconds * 1e6,
+               "pid": pid, "tid": thread} for name, (phase, start, seconds, pid, thread) in spans]
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
+
+class _NoStats:
+    """Stands in for Stats when nothing is being measured."""
+    
+    def add(self, name, amount=1):
+        pass
+    
+    def timer(self, phase):
+        return nullcontext()
+    
+    def add_time(self, phase, seconds):
+        pass
+    
+    def warn(self, message):
+        print(message, file=sys.stderr)
+    
+    def merge(self, data):
+        pass
+
+NO_STATS = _NoStats()
+
+# Set in the header of every chat archive, so an archive is never mistaken for another file
+_ARCHIVE_APPLICATION_ID = 0x43434841
+
+# Chunks are addressed by a BLAKE2b hash of their content of this many bytes
+_ARCHIVE_HASH_SIZE = 16
+
+# Chunks are stored as they are (codec 0), or zlib-compressed with the dictionary of that id
+# (codec 1). They are looked up by hash, but kept in rowid order, which is the order they
+# were added in, so the chunks of a record sit together in the file.
+_ARCHIVE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS dictionaries (id INTEGER PRIMARY KEY, data BLOB NOT NULL);
+CREATE TABLE IF NOT EXISTS chunks (
+    id INTEGER PRIMARY KEY, hash BLOB NOT NULL UNIQUE, codec INTEGER NOT NULL, dictionary INTEGER, data BLOB NOT NULL
+);
+CREATE TABLE IF NOT EXISTS records (
+    id INTEGER PRIMARY KEY, key TEXT NOT NULL, size INTEGER NOT NULL, compressed INTEGER NOT NULL,
+    chunks BLOB NOT NULL, archived_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS latest (key TEXT PRIMARY KEY, record INTEGER NOT NULL) WITHOUT ROWID;
+CREATE VIEW IF NOT EXISTS cursorDiskKV AS
+    SELECT records.id AS rowid, latest.key AS key, archive_value(records.chunks) AS value,
+           records.size AS size, records.compressed AS compressed
+    FROM latest JOIN records ON records.id = latest.record;
+"""
+
+# Most chunks looked up with a single query when rebuilding a value
+_ARCHIVE_LOOKUP_BATCH = 500
+
+def is_archive(db_path):
+    """Whether db_path is a chat archive (see ArchiveWriter) rather than a Cursor database."""
+    return db_path.endswith(ARCHIVE_SUFFIX)
+
+def _value_sql(db_path):
+    """Return SQL for the stored size of a record's value and for whether it is
+    zlib-compressed. Archives keep both in columns, so that listing an archive
+    never rebuilds values."""
+    if is_archive(db_path):
+        return "size", "compressed"
+    return "length(value)", "substr(value, 1, 2) = x'789c'"
+
+class _ArchiveReader:
+    """The archive_value() SQL function of a connection to a chat archive.
+    
+    It rebuilds a value from its list of chunk hashes, reading and
+    decompressing just those chunks, so opening one chat touches only the
+    pages holding its own content.
+    """
+    
+    def __init__(self, conn):
+        self.conn = conn
+        self._dictionaries = {}
+    
+    def _dictionary(self, dictionary_id):
+        data = self._dictionaries.get(dictionary_id)
+        if data is None:
+            row = self.conn.execute("SELECT data FROM dictionaries WHERE id = ?", (dictionary_id,)).fetchone()
+            data = self._dictionaries[dictionary_id] = row[0] if row else b""
+        return data
+    
+    def __call__(self, hashes):
+        if hashes is None:
+            return None
+        wanted = [hashes[i:i + _ARCHIVE_HASH_SIZE] for i in range(0, len(hashes), _ARCHIVE_HASH_SIZE)]
+        distinct = list(dict.fromkeys(wanted))
+        chunks = {}
+        for i in range(0, len(distinct), _ARCHIVE_LOOKUP_BATCH):
+            group = distinct[i:i + _ARCHIVE_LOOKUP_BATCH]
+            rows = self.conn.execute(
+                f"SELECT hash, codec, dictionary, data FROM chunks WHERE hash IN ({', '.join('?' * len(group))})", group)
+            for chunk_hash, codec, dictionary_id, data in rows:
+                if codec:
+                    if dictionary_id is None:
+                        data = zlib.decompress(data)
+                    else:
+                        data = zlib.decompressobj(zdict=self._dictionary(dictionary_id)).decompress(data)
+                chunks[chunk_hash] = data
+        return b"".join(chunks[chunk_hash] for chunk_hash in wanted)
+
+class ConnectionPool:
+    """Hands out reusable read-only connections to Cursor's databases.
+    
+    Databases are opened through file: URIs with mode=ro, so a connection can
+    neither write to a database nor create a missing one, and query_only is
+    set as a second guard. Reads are memory-mapped, so pages are used in place
+    rather than copied into SQLite's cache. While Cursor holds a write lock,
+    statements retry for up to BUSY_TIMEOUT rather than failing with
+    SQLITE_BUSY. With immutable set, databases are opened with immutable=1.
+    That skips locking and change detection altogether, so it is only safe
+    for snapshots that nothing writes to, such as backups. Chat archives
+    get the archive_value() function their cursorDiskKV view reads through.
+    
+    A connection serves one caller at a time: take it with acquire() and hand
+    it back with release(), or use connection() as a context manager.
+    Connections may move between threads in between. Once more than
+    POOL_IDLE_TOTAL are idle, those of the least recently used databases are
+    closed, so reading hundreds of databases doesn't run out of file handles.
+    """
+    
+    def __init__(self, immutable=False):
+        self.immutable = immutable
+        self._lock = threading.Lock()
+        # Idle connections per database, least recently released first
+        self._idle = OrderedDict()
+        self._idle_count = 0
+    
+    def _open(self, db_path):
+        uri = pathlib.Path(os.path.abspath(db_path)).as_uri() + "?mode=ro"
+        if self.immutable:
+            uri += "&immutable=1"
+        conn = sqlite3.connect(uri, uri=True, timeout=BUSY_TIMEOUT, check_same_thread=False)
+        try:
+            conn.execute(f"PRAGMA mmap_size = {READ_MMAP_SIZE}")
+            conn.execute(f"PRAGMA cache_size = -{READ_CACHE_KIB}")
+            conn.execute("PRAGMA query_only = 1")
+            if is_archive(db_path):
+                conn.create_function("archive_value", 1, _ArchiveReader(conn), deterministic=True)
+        except sqlite3.Error:
+            conn.close()
+            raise
+        return conn
+    
+    def acquire(self, db_path):
+        with self._lock:
+            idle = self._idle.get(db_path)
+            if idle:
+                self._idle_count -= 1
+                conn = idle.pop()
+                if not idle:
+                    del self._idle[db_path]
+                return conn
+        return self._open(db_path)
+    
+    def release(self, db_path, conn):
+        evicted = []
+        with self._lock:
+            idle = self._idle.setdefault(db_path, [])
+            self._idle.move_to_end(db_path)
+            if len(idle) >= POOL_IDLE_CONNECTIONS:
+                evicted.append(conn)
+            else:
+                idle.append(conn)
+                self._idle_count += 1
+                while self._idle_count > POOL_IDLE_TOTAL:
+                    oldest_path, oldest = next(iter(self._idle.items()))
+                    evicted.append(oldest.pop(0))
+                    self._idle_count -= 1
+                    if not oldest:
+                        del self._idle[oldest_path]
+        for conn in evicted:
+            conn.close()
+    
+    @contextmanager
+    def connection(self, db_path):
+        conn = self.acquire(db_path)
+        try:
+            yield conn
+        finally:
+            self.release(db_path, conn)
+    
+    def close_all(self):
+        with self._lock:
+            idle, self._idle = self._idle, OrderedDict()
+            self._idle_count = 0
+        for connections in idle.values():
+            for conn in connections:
+                conn.close()
+
+# Shared by everything that reads Cursor's databases
+database_pool = ConnectionPool()
+
+def prefix_range(prefix):
+    """Return (lower, upper) bounds so that lower <= key < upper matches exactly
+    the keys starting with prefix. This lets SQLite use the key index."""
+    upper = prefix
+    while upper and ord(upper[-1]) == sys.maxunicode:
+        upper = upper[:-1]
+    if not upper:
+        return prefix, None
+    return prefix, upper[:-1] + chr(ord(upper[-1]) + 1)
+
+def key_range_clause(key_prefix, column="key"):
+    """Return a WHERE clause fragment and its parameters matching keys that
+    start with key_prefix (an empty prefix matches every key)."""
+    if not key_prefix:
+        return "1", ()
+    lower, upper = prefix_range(key_prefix)
+    if upper is None:
+        return f"{column} >= ?", (lower,)
+    return f"{column} >= ? AND {column} < ?", (lower, upper)
+
+def iter_prefixed_rows(conn, key_prefix, columns="key, value", batch_size=FETCH_BATCH_SIZE):
+    """Yield rows from cursorDiskKV whose key starts with key_prefix.
+
+    The prefix is turned into a range predicate so the filtering happens inside
+    SQLite, and rows are fetched in bounded batches instead of all at once.
+    """
+    where, params = key_range_clause(key_prefix)
+    cursor = conn.cursor()
+    cursor.execute(f"SELECT {columns} FROM cursorDiskKV WHERE {where}", params)
+    try:
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            for row in rows:
+                yield row
+    finally:
+        cursor.close()
+
+def fetch_value(conn, key):
+    """Fetch the raw stored value for a single key."""
+    row = conn.execute("SELECT value FROM cursorDiskKV WHERE key = ?", (key,)).fetchone()
+    if row is None:
+        raise KeyError(key)
+    return row[0]
+
+def is_compressed(value):
+    return isinstance(value, bytes) and value[:2] == b'x\x9c'  # zlib magic number
+
+def decompress_value(value):
+    """Return the value with zlib compression removed, if it was compressed."""
+    if is_compressed(value):
+        try:
+            return zlib.decompress(value)
+        except zlib.error:
+            pass
+    return value
+
+def format_timestamp(value, fmt="%Y-%m-%d %H:%M"):
+    """Format a timestamp in seconds or milliseconds since the epoch."""
+    timestamp = int(value)
+    if timestamp > 1000000000000:  # milliseconds
+        timestamp /= 1000
+    return datetime.fromtimestamp(timestamp).strftime(fmt)
+
+def parse_timestamp(value):
+    """Return seconds since the epoch for a date as chat records store it: a
+    number of seconds or milliseconds, as a number or a string, or an ISO 8601
+    date, taken as local time unless it has an offset. Returns None for
+    anything else."""
+    if isinstance(value, str):
+        text = value.strip()
+        try:
+            value = float(text)
+        except ValueError:
+            try:
+                # Python before 3.11 does not read a Z suffix
+                return datetime.fromisoformat(text[:-1] + "+00:00" if text.endswith("Z") else text).timestamp()
+            except (ValueError, OverflowError, OSError):
+                return None
+    if isinstance(value, bool) or not isinstance(value, (int, float)) or not value or not math.isfinite(value):
+        return None
+    return value / 1000 if value > 1000000000000 else float(value)
+
+def _message_text(item):
+    message = message_from_item(item)
+    return message.search_text() if message is not None else None
+
+def _title_from_message(item):
+    message = message_from_item(item)
+    if message is not None and message.text:
+        # Extract first line or first N characters
+        first_line = message.text.split('\n')[0]
+        return first_line[:40] + ('...' if len(first_line) > 40 else '')
+    return None
+
+def _metadata_from_fields(fields, first_message, message_count, size):
+    """Build RecordMetadata from the top-level fields of a chat record.
+    
+    Dates are normalized to a timestamp and shown in one format, however the
+    record stores them. A date that can't be read is shown as it is.
+    """
+    timestamp = date_str = None
+    for field in DATE_FIELDS:
+        value = fields.get(field)
+        timestamp = parse_timestamp(value)
+        if timestamp is not None:
+            break
+        if date_str is None and isinstance(value, str) and len(value) > 5:
+            date_str = value
+    if timestamp is None and isinstance(first_message, dict):
+        timestamp = parse_timestamp(first_message.get('timestamp'))
+    if timestamp is not None:
+        try:
+            date_str = format_timestamp(timestamp)
+        except (ValueError, OverflowError, OSError):
+            timestamp = None
+    
+    title = None
+    for field in TITLE_FIELDS:
+        value = fields.get(field)
+        if value and isinstance(value, str):
+            title = value[:40]  # Truncate long titles
+            break
+    if title is None:
+        title = _title_from_message(first_message)
+    
+    return RecordMetadata(date_str or "Unknown", title or "", message_count, size, timestamp)
+
+_json_decoder = json.JSONDecoder()
+_json_whitespace = re.compile(r'[ \t\n\r]*')
+
+def _scan_json_list(json_str, pos, texts=None):
+    """Walk the JSON array starting at pos one element at a time and return
+    (first element, element count, end position). The text of each message is
+    appended to texts if it is given."""
+    decode = _json_decoder.raw_decode
+    skip = _json_whitespace.match
+    pos = skip(json_str, pos + 1).end()
+    first, count = None, 0
+    if json_str[pos] == ']':
+        return first, count, pos + 1
+    while True:
+        item, pos = decode(json_str, pos)
+        if count == 0:
+            first = item
+        count += 1
+        if texts is not None:
+            text = _message_text(item)
+            if text:
+                texts.append(text)
+        pos = skip(json_str, pos).end()
+        if json_str[pos] == ']':
+            return first, count, pos + 1
+        if json_str[pos] != ',':
+            raise ValueError(f"Expecting ',' delimiter at {pos}")
+        pos = skip(json_str, pos + 1).end()
+
+def _scan_metadata(json_str, size, texts=None):
+    """Incrementally scan the top-level members of a large JSON object.
+
+    Each member value is decoded on its own and dropped unless metadata needs
+    it, and the message list is walked one message at a time, so the whole
+    document is never materialized. Scanning stops once a date, a title and
+    the message list have all been seen.
+    """
+    decode = _json_decoder.raw_decode
+    skip = _json_whitespace.match
+    pos = skip(json_str, 0).end()
+    if json_str[pos:pos + 1] != '{':
+        return RecordMetadata("Unknown", "", 0, size, None)
+    
+    fields = {}
+    first_message, message_count, seen_messages = None, 0, False
+    pos = skip(json_str, pos + 1).end()
+    while json_str[pos] != '}':
+        name, pos = decode(json_str, pos)
+        pos = skip(json_str, pos).end()
+        if json_str[pos] != ':':
+            raise ValueError(f"Expecting ':' delimiter at {pos}")
+        pos = skip(json_str, pos + 1).end()
+        
+        if name in MESSAGE_FIELDS and json_str[pos] == '[' and not seen_messages:
+            first_message, message_count, pos = _scan_json_list(json_str, pos, texts)
+            seen_messages = True
+        else:
+            value, pos = decode(json_str, pos)
+            if name in DATE_FIELDS or name in TITLE_FIELDS:
+                fields.setdefault(name, value)
+        
+        if (seen_messages and any(fields.get(f) for f in DATE_FIELDS)
+                and any(fields.get(f) for f in TITLE_FIELDS)):
+            break
+        pos = skip(json_str, pos).end()
+        if json_str[pos] == ',':
+            pos = skip(json_str, pos + 1).end()
+        elif json_str[pos] != '}':
+            raise ValueError(f"Expecting ',' delimiter at {pos}")
+    
+    return _metadata_from_fields(fields, first_message, message_count, size)
+
+def extract_metadata(value, streaming=None, stats=NO_STATS):
+    """Decode a stored chat value once and return its RecordMetadata.
+
+    Records whose decoded size exceeds STREAMING_THRESHOLD are scanned
+    incrementally; pass streaming=True or False to force either mode.
+    Decompression, text decoding and parsing are timed in stats as "zlib",
+    "utf8" and "json", and bytes_decompressed and decode_failures counted.
+    """
+    return _extract(value, streaming, None, stats)
+
+def extract_record(value, streaming=None, stats=NO_STATS, fetch=None):
+    """Like extract_metadata, but also return the text to index for search.
+
+    The text is that of every message and its code blocks. Composer records
+    that keep their bubbles apart have only headers; with fetch(key), such
+    as record_fetcher() of the record's database, their bubbles are read for
+    the text. Records without message text are indexed as the whole
+    decoded value.
+    """
+    texts = []
+    metadata = _extract(value, streaming, texts, stats, fetch)
+    return metadata, '\n'.join(texts)
+
+def _bubble_texts(json_str, fetch, stats):
+    # Conversation reads each header's bubble with fetch as its message is built
+    texts = []
+    start = time.perf_counter()
+    try:
+        conversation = parse_conversation(json_str, fetch)
+    except (ValueError, sqlite3.Error):
+        conversation = None
+    if conversation is not None:
+        for message in conversation:
+            text = message.search_text() if message is not None else None
+            if text:
+                texts.append(text)
+        stats.add("bubbles_indexed", len(conversation))
+    stats.add_time("bubbles", time.perf_counter() - start)
+    return texts
+
+def _extract(value, streaming, texts, stats, fetch=None):
+    try:
+        # Check if value is a string already
+        if isinstance(value, str):
+            json_str = value
+            size = len(value.encode('utf-8', errors='ignore'))
+        else:
+            if is_compressed(value):
+                start = time.perf_counter()
+                value = decompress_value(value)
+                stats.add_time("zlib", time.perf_counter() - start)
+                stats.add("bytes_decompressed", len(value))
+            size = len(value)
+            start = time.perf_counter()
+            json_str = value.decode('utf-8', errors='ignore')
+            stats.add_time("utf8", time.perf_counter() - start)
+    except Exception:
+        stats.add("decode_failures")
+        return RecordMetadata("Unknown", "", 0, 0, None)
+    
+    if streaming is None:
+        streaming = size > STREAMING_THRESHOLD
+    metadata = RecordMetadata("Unknown", "", 0, size, None)
+    start = time.perf_counter()
+    try:
+        if streaming:
+            metadata = _scan_metadata(json_str, size, texts)
+        else:
+            data = json.loads(json_str)
+            if isinstance(data, dict):
+                messages = next((data[f] for f in MESSAGE_FIELDS if isinstance(data.get(f), list)), [])
+                metadata = _metadata_from_fields(data, messages[0] if messages else None, len(messages), size)
+                if texts is not None:
+                    texts.extend(text for text in map(_message_text, messages) if text)
+    except Exception:
+        stats.add("decode_failures")
+    stats.add_time("json", time.perf_counter() - start)
+    
+    if texts is not None and not texts and fetch is not None:
+        texts.extend(_bubble_texts(json_str, fetch, stats))
+    if texts is not None and not texts:
+        texts[:] = [json_str]
+    return metadata
+
+def iter_formatted_value(value, first_size=RENDER_FIRST_CHARS, chunk_size=RENDER_CHUNK_CHARS):
+    """Yield a decompressed chat value as display text, in pieces.
+
+    JSON is pretty-printed with iterencode, so the first piece (about
+    first_size characters) is ready long before the whole document has been
+    serialized, and later pieces are about chunk_size characters each. Other
+    text is yielded as is, and undecodable bytes as a hex dump of the start.
+    """
+    try:
+        text = value if isinstance(value, str) else value.decode('utf-8')
+    except UnicodeDecodeError:
+        hex_view = ' '.join(f'{b:02x}' for b in value[:1000])
+        text = f"Binary data (showing first 1000 bytes):\n{hex_view}"
+        if len(value) > 1000:
+            text += f"\n... {len(value) - 1000} more bytes ..."
+        yield text
+        return
+    
+    try:
+        data = json.loads(text)
+    except json.JSONDecodeError:
+        for start in range(0, len(text), chunk_size):
+            yield text[start:start + chunk_size]
+        return
+    
+    # ensure_ascii=False keeps non-ASCII text (such as Chinese) readable
+    encoder = json.JSONEncoder(indent=2, ensure_ascii=False)
+    pieces = []
+    pending = 0
+    limit = first_size
+    for piece in encoder.iterencode(data):
+        pieces.append(piece)
+        pending += len(piece)
+        if pending >= limit:
+            yield ''.join(pieces)
+            pieces = []
+            pending = 0
+            limit = chunk_size
+    if pieces:
+        yield ''.join(pieces)
+
+class ChatMessage:
+    """One message of a conversation, built by message_from_item().
+
+    role is "user", "assistant" or the role stored with a legacy message.
+    code_blocks and tool_calls are tuples of CodeBlock and ToolCall; thinking
+    is the assistant's reasoning text when Cursor kept it.
+    """
+    __slots__ = ("role", "text", "timestamp", "code_blocks", "tool_calls", "thinking")
+    
+    def __init__(self, role, text, timestamp=None, code_blocks=(), tool_calls=(), thinking=None):
+        self.role = role
+        self.text = text
+        self.timestamp = timestamp
+        self.code_blocks = code_blocks
+        self.tool_calls = tool_calls
+        self.thinking = thinking
+    
+    def __repr__(self):
+        return f"ChatMessage({self.role!r}, {self.text[:40]!r})"
+    
+    def search_text(self):
+        """The text to index for search: the message and any code not already quoted in it."""
+        parts = [self.text] if self.text else []
+        parts.extend(block.code for block in self.code_blocks if block.code and block.code not in self.text)
+        return '\n'.join(parts)
+
+def _content_text(content):
+    # Legacy content is a string or, in newer records, a list of {"type": "text", "text": ...} parts
+    if isinstance(content, str):
+        return content
+    if isinstance(content, list):
+        return '\n'.join(part['text'] for part in content
+                         if isinstance(part, dict) and isinstance(part.get('text'), str))
+    return None
+
+def _code_block(block):
+    uri = block.get('uri')
+    path = uri.get('path') or uri.get('fsPath') if isinstance(uri, dict) else uri
+    code = block.get('code', block.get('content'))
+    return CodeBlock(block.get('languageId') or block.get('language') or "",
+                     path if isinstance(path, str) else None,
+                     code if isinstance(code, str) else "")
+
+def _tool_call(data):
+    params = data.get('rawArgs', data.get('params'))
+    result = data.get('result')
+    return ToolCall(str(data.get('name') or data.get('tool') or "tool"), data.get('status'),
+                    params if params is None or isinstance(params, str) else json.dumps(params, ensure_ascii=False),
+                    result if result is None or isinstance(result, str) else json.dumps(result, ensure_ascii=False))
+
+def message_from_item(item):
+    """Return the ChatMessage for a legacy message or a composer bubble,
+    or None when item is neither."""
+    if not isinstance(item, dict):
+        return None
+    if 'bubbleId' in item or isinstance(item.get('type'), int):
+        role = BUBBLE_ROLES.get(item.get('type'), "unknown")
+        text = item.get('text')
+    else:
+        role = str(item.get('role') or "unknown")
+        text = _content_text(item.get('content'))
+        if text is None:
+            text = item.get('text')
+    
+    timestamp = item.get('timestamp') or item.get('createdAt')
+    timing = item.get('timingInfo')
+    if not timestamp and isinstance(timing, dict):
+        timestamp = timing.get('clientStartTime')
+    
+    blocks = item.get('codeBlocks')
+    code_blocks = tuple(_code_block(b) for b in blocks if isinstance(b, dict)) if isinstance(blocks, list) else ()
+    tool = item.get('toolFormerData')
+    tool_calls = (_tool_call(tool),) if isinstance(tool, dict) and tool else ()
+    thinking = item.get('thinking')
+    if isinstance(thinking, dict):
+        thinking = thinking.get('text')
+    
+    return ChatMessage(role, text if isinstance(text, str) else "", timestamp, code_blocks, tool_calls,
+                       thinking if isinstance(thinking, str) and thinking else None)
+
+def record_fetcher(db_path):
+    """Return fetch(key), which reads one record of db_path through database_pool."""
+    def fetch(key):
+        with database_pool.connection(db_path) as conn:
+            return fetch_value(conn, key)
+    return fetch
+
+class Conversation:
+    """The messages of a chat, parsed from its stored value by parse_conversation().
+
+    The JSON is decoded once, and each message is built from its item the
+    first time it is read, so showing the start of a long chat, or counting
+    its messages, does not build the rest. Newer composer records hold only
+    bubble headers and keep every bubble under its own bubbleId: key; those
+    are read with fetch as they are reached, or left as headers without one.
+    """
+    __slots__ = ("title", "created_at", "composer_id", "_items", "_messages", "_fetch")
+    
+    def __init__(self, items, title=None, created_at=None, composer_id=None, fetch=None):
+        self.title = title
+        self.created_at = created_at
+        self.composer_id = composer_id
+        self._items = items
+        self._messages = [None] * len(items)
+        self._fetch = fetch
+    
+    def __len__(self):
+        return len(self._items)
+    
+    def __iter__(self):
+        for index in range(len(self._items)):
+            yield self[index]
+    
+    def __getitem__(self, index):
+        message = self._messages[index]
+        if message is None:
+            item = self._items[index]
+            if self._fetch is not None and 'bubbleId' in item and 'text' not in item:
+                item = self._fetch_bubble(item)
+            message = self._messages[index] = message_from_item(item)
+            # The item is not needed again once its message exists
+            self._items[index] = None
+        return message
+    
+    def _fetch_bubble(self, header):
+        try:
+            value = self._fetch(f"{BUBBLE_KEY_PREFIX}{self.composer_id}:{header['bubbleId']}")
+            bubble = json.loads(decompress_value(value))
+        except (KeyError, ValueError, sqlite3.Error):
+            return header
+        if isinstance(bubble, dict):
+            bubble.setdefault('type', header.get('type'))
+            return bubble
+        return header
+
+def parse_conversation(value, fetch=None):
+    """Parse a decompressed chat value into a Conversation.
+
+    Legacy chats keep a "messages" list; composer chats keep "conversation"
+    bubbles or, in newer versions, "fullConversationHeadersOnly" headers whose
+    bubbles are read with fetch(key), such as record_fetcher() of the chat's
+    database. Returns None for values that are not a chat, and raises
+    UnicodeDecodeError for binary values.
+    """
+    text = value if isinstance(value, str) else value.decode('utf-8')
+    try:
+        data = json.loads(text)
+    except json.JSONDecodeError:
+        return None
+    if not isinstance(data, dict):
+        return None
+    items = next((data[f] for f in MESSAGE_FIELDS if isinstance(data.get(f), list)), None)
+    if items is None:
+        return None
+    
+    title = next((data[f] for f in TITLE_FIELDS if data.get(f) and isinstance(data[f], str)), None)
+    created_at = next((data[f] for f in DATE_FIELDS if data.get(f)), None)
+    composer_id = data.get('composerId')
+    return Conversation([item for item in items if isinstance(item, dict)], title, created_at, composer_id,
+                        fetch if isinstance(composer_id, str) else None)
+
+def _message_label(message):
+    label = message.role.upper()
+    timestamp = parse_timestamp(message.timestamp)
+    if timestamp is not None:
+        try:
+            label += f" ({format_timestamp(timestamp, '%Y-%m-%d %H:%M:%S')})"
+        except (ValueError, OverflowError, OSError):
+            pass
+    return f"[{label}]"
+
+def _format_message(message):
+    parts = [_message_label(message)]
+    if message.thinking:
+        parts.append("(thinking) " + message.thinking)
+    if message.text:
+        parts.append(message.text)
+    for block in message.code_blocks:
+        # Code Cursor already quoted in the message text is not repeated
+        if block.code and block.code not in message.text:
+            parts.append(f"```{block.language}{' ' + block.path if block.path else ''}\n{block.code}\n```")
+    for call in message.tool_calls:
+        line = f"-> {call.name}" + (f" ({call.status})" if call.status else "")
+        if call.params:
+            line += ": " + (call.params if len(call.params) <= 200 else call.params[:200] + "...")
+        parts.append(line)
+    return '\n'.join(parts) + "\n\n\n"
+
+def iter_chat_text(conversation, first_size=RENDER_FIRST_CHARS, chunk_size=RENDER_CHUNK_CHARS):
+    """Yield a Conversation as a readable transcript, in pieces sized like
+    those of iter_formatted_value(). Messages are built as they are reached."""
+    pieces = [f"Title: {conversation.title}\n\n"] if conversation.title else []
+    pending = sum(map(len, pieces))
+    limit = first_size
+    for message in conversation:
+        if not (message.text or message.code_blocks or message.tool_calls or message.thinking):
+            continue
+        piece = _format_message(message)
+        pieces.append(piece)
+        pending += len(piece)
+        if pending >= limit:
+            yield ''.join(pieces)
+            pieces = []
+            pending = 0
+            limit = chunk_size
+    if pieces:
+        yield ''.join(pieces)
+
+def cursor_user_dir():
+    """Return Cursor's per-user data directory, which holds globalStorage and
+    workspaceStorage."""
+    if sys.platform == "darwin":
+        base = os.path.expanduser("~/Library/Application Support")
+    elif sys.platform == "win32":
+        base = os.environ.get("APPDATA") or os.path.expanduser("~/AppData/Roaming")
+    else:
+        base = os.environ.get("XDG_CONFIG_HOME") or os.path.expanduser("~/.config")
+    return os.path.join(base, "Cursor", "User")
+
+# Where Cursor keeps its global state database
+DEFAULT_DB_PATH = os.path.join(cursor_user_dir(), "globalStorage", "state.vscdb")
+
+def user_cache_dir():
+    """Return the per-user cache directory for this tool."""
+    override = os.environ.get("CURSOR_CHAT_VIEWER_CACHE")
+    if override:
+        return override
+    if sys.platform == "darwin":
+        base = os.path.expanduser("~/Library/Caches")
+    elif sys.platform == "win32":
+        base = os.environ.get("LOCALAPPDATA") or os.path.expanduser("~/AppData/Local")
+    else:
+        base = os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache")
+    return os.path.join(base, "cursor-chat-viewer")
+
+def fts5_available(conn):
+    try:
+        conn.execute("CREATE VIRTUAL TABLE temp.fts5_probe USING fts5(x)")
+        conn.execute("DROP TABLE temp.fts5_probe")
+        return True
+    except sqlite3.OperationalError:
+        return False
+
+def quote_fts_query(query):
+    """Turn free text into an FTS5 query that matches every word literally."""
+    return " ".join('"' + word.replace('"', '""') + '"' for word in query.split())
+
+class MetadataCache:
+    """Sidecar SQLite store of the metadata extracted from each chat record.
+
+    Entries are keyed on the database file and the record key, and carry the
+    record's version (see ChatMeta) and stored length. Cursor rewrites a record by
+    replacing its row, so a changed record gets a new rowid and its cached
+    entry no longer matches.
+    
+    When SQLite has FTS5, the key, title and message text of every cached
+    record are also indexed for full-text search. The index is updated along
+    with the metadata, so it stays in sync with cursorDiskKV.
+    """
+    
+    # Bump when the extracted fields change so old entries are rebuilt
+    SCHEMA_VERSION = 6
+    
+    def __init__(self, path=None):
+        if path is None:
+            cache_dir = user_cache_dir()
+            os.makedirs(cache_dir, exist_ok=True)
+            path = os.path.join(cache_dir, "metadata.sqlite3")
+        self.path = path
+        # Several databases may be scanned at once, each updating the cache from its own thread
+        self.conn = sqlite3.connect(path, timeout=30)
+        self.conn.execute("PRAGMA journal_mode = WAL")
+        self.has_fts = fts5_available(self.conn)
+        if self.conn.execute("PRAGMA user_version").fetchone()[0] != self.SCHEMA_VERSION:
+            self.conn.execute("DROP TABLE IF EXISTS chat_meta")
+            if self.has_fts:
+                self.conn.execute("DROP TABLE IF EXISTS chat_fts")
+            self.conn.execute(f"PRAGMA user_version = {self.SCHEMA_VERSION}")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS chat_meta (
+                id INTEGER PRIMARY KEY,
+                db TEXT NOT NULL,
+                key TEXT NOT NULL,
+                version NOT NULL,
+                size INTEGER NOT NULL,
+                compressed INTEGER NOT NULL,
+                date TEXT NOT NULL,
+                timestamp REAL,
+                title TEXT NOT NULL,
+                message_count INTEGER NOT NULL,
+                UNIQUE (db, key)
+            )""")
+        if self.has_fts:
+            # Rows share their rowid with the chat_meta id
+            self.conn.execute("CREATE VIRTUAL TABLE IF NOT EXISTS chat_fts USING fts5(key, title, body)")
+        self.conn.commit()
+    
+    @staticmethod
+    def db_identity(db_path):
+        return os.path.realpath(db_path)
+    
+    def load(self, db_path, key_prefix):
+        """Return {key: ChatMeta} for the cached records of db_path that start
+        with key_prefix."""
+        where, params = key_range_clause(key_prefix)
+        rows = self.conn.execute(
+            f"SELECT key, version, size, compressed, date, timestamp, title, message_count FROM chat_meta "
+            f"WHERE db = ? AND {where}", (self.db_identity(db_path),) + params)
+        return {key: ChatMeta(key[len(key_prefix):], date_str, key, title, size, bool(compressed), message_count, version,
+                              db_path, timestamp)
+                for key, version, size, compressed, date_str, timestamp, title, message_count in rows}
+    
+    def update(self, db_path, entries, removed_keys=()):
+        """Store (key, version, size, compressed, date, timestamp, title, message_count,
+        text) entries and forget the keys that no longer exist in the database."""
+        db = self.db_identity(db_path)
+        with self.conn:
+            for key, version, size, compressed, date, timestamp, title, message_count, text in entries:
+                row = self.conn.execute("SELECT id FROM chat_meta WHERE db = ? AND key = ?", (db, key)).fetchone()
+                if row is None:
+                    entry_id = self.conn.execute(
+                        "INSERT INTO chat_meta (db, key, version, size, compressed, date, timestamp, title, message_count) "
+                        "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                        (db, key, version, size, compressed, date, timestamp, title, message_count)).lastrowid
+                else:
+                    entry_id = row[0]
+                    self.conn.execute(
+                        "UPDATE chat_meta SET version = ?, size = ?, compressed = ?, date = ?, timestamp = ?, title = ?, "
+                        "message_count = ? WHERE id = ?",
+                        (version, size, compressed, date, timestamp, title, message_count, entry_id))
+                    if self.has_fts:
+                        self.conn.execute("DELETE FROM chat_fts WHERE rowid = ?", (entry_id,))
+                if self.has_fts:
+                    self.conn.execute("INSERT INTO chat_fts (rowid, key, title, body) VALUES (?, ?, ?, ?)",
+                                      (entry_id, key, title, text))
+            for key in removed_keys:
+                row = self.conn.execute("SELECT id FROM chat_meta WHERE db = ? AND key = ?", (db, key)).fetchone()
+                if row is not None:
+                    self.conn.execute("DELETE FROM chat_meta WHERE id = ?", row)
+                    if self.has_fts:
+                        self.conn.execute("DELETE FROM chat_fts WHERE rowid = ?", row)
+    
+    def search(self, db_path, key_prefix, query, limit=SEARCH_LIMIT):
+        """Run a full-text query over the records of db_path whose key starts
+        with key_prefix and return [(key, snippet), ...], best match first.
+        db_path may also be a list of databases to search together; a key
+        found in several of them is returned once, for its best match.
+        
+        The query uses FTS5 syntax, so "exact phrases", prefix* terms and
+        title: or body: field filters all work. Input that isn't valid FTS5
+        is searched as plain words instead.
+        """
+        dbs = tuple(self.db_identity(path) for path in as_db_paths(db_path))
+        where, params = key_range_clause(key_prefix, column="chat_meta.key")
+        sql = (f"SELECT chat_meta.key, snippet(chat_fts, -1, '[', ']', '...', 12) "
+               f"FROM chat_fts JOIN chat_meta ON chat_meta.id = chat_fts.rowid "
+               f"WHERE chat_fts MATCH ? AND chat_meta.db IN ({', '.join('?' * len(dbs))}) AND {where} "
+               f"ORDER BY bm25(chat_fts, 5.0, 10.0, 1.0)")
+        try:
+            rows = self.conn.execute(sql, (query,) + dbs + params)
+        except sqlite3.OperationalError:
+            rows = self.conn.execute(sql, (quote_fts_query(query),) + dbs + params)
+        results = {}
+        for key, snippet in rows:
+            results.setdefault(key, snippet)
+            if len(results) >= limit:
+                break
+        return list(results.items())
+    
+    def close(self):
+        self.conn.close()
+
+def default_worker_count():
+    """Number of decode worker processes, from CURSOR_CHAT_VIEWER_WORKERS or the CPU count."""
+    try:
+        return max(1, int(os.environ["CURSOR_CHAT_VIEWER_WORKERS"]))
+    except (KeyError, ValueError):
+        return os.cpu_count() or 1
+
+def worker_pool(workers):
+    """Start a pool of worker processes for decoding and formatting chats.
+    Workers open databases the way database_pool does here, so immutable
+    snapshots are read without locking in them too."""
+    # Imported here to keep the module light for callers that never need a pool
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor
+    # Spawn rather than fork: the GUI calls this from a background thread
+    return ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"),
+                               initializer=_init_worker, initargs=(database_pool.immutable,))
+
+def _init_worker(immutable):
+    database_pool.immutable = immutable
+
+def _bubble_versions(conn):
+    """Return {composer id: (highest rowid, count)} for the bubble records of a
+    database. Cursor rewrites a record by replacing its row, so this changes
+    whenever one of a chat's bubbles is added, changed or removed."""
+    start = len(BUBBLE_KEY_PREFIX) + 1
+    where, params = key_range_clause(BUBBLE_KEY_PREFIX)
+    rows = conn.execute(f"SELECT substr(key, {start}, instr(substr(key, {start}), ':') - 1), max(rowid), count(*) "
+                        f"FROM cursorDiskKV WHERE {where} GROUP BY 1", params)
+    return {composer_id: (max_rowid, count) for composer_id, max_rowid, count in rows}
+
+def _decode_batch(values, with_text=False, db_path=None):
+    """Worker process entry point: extract metadata, and the text to index if
+    with_text is set, for a batch of raw values of db_path. Returns the
+    results and the batch's Stats as a dict."""
+    stats = Stats()
+    results = []
+    # Bubbles kept apart from their chat are read from the same database for the index
+    fetch = record_fetcher(db_path) if with_text and db_path is not None else None
+    with stats.timer("decode"):
+        for value in values:
+            if with_text:
+                metadata, text = extract_record(value, stats=stats, fetch=fetch)
+            else:
+                metadata, text = extract_metadata(value, stats=stats), ""
+            results.append((is_compressed(value), metadata, text))
+    stats.add("records_decoded", len(values))
+    return results, stats.as_dict(spans=True)
+
+def scan_chats(db_path, key_prefix, use_cache=True, workers=None, known=None, stats=NO_STATS, shared_pool=None):
+    """Yield a ChatMeta for every record of db_path whose key starts with key_prefix.
+
+    Records are first listed by (rowid, key, length) only. Values are then
+    read and decoded just for records that are new or changed since the
+    metadata cache last saw them. When there are many of those, decoding is
+    spread over a pool of worker processes in batches, and results are still
+    yielded in key order. The cache is updated when the generator finishes or
+    is closed early.
+    
+    Callers that already hold a listing can pass it as known. It then stands
+    in for the cache, and records that are unchanged are yielded as the very
+    same ChatMeta objects. shared_pool is a worker_pool() to decode on, as
+    scan_sources() shares between databases, instead of one of its own.
+    
+    Time spent listing ("sqlite.list"), reading values ("sqlite.read"),
+    decoding them and in the cache is recorded in stats, with counts of
+    rows, cache hits and bytes read.
+    """
+    if workers is None:
+        workers = default_worker_count()
+    conn = database_pool.acquire(db_path)
+    
+    # Metadata extracted on earlier runs; without the cache every record is decoded
+    cache, cached = None, {}
+    if use_cache:
+        try:
+            with stats.timer("cache.load"):
+                cache = MetadataCache()
+                if known is None:
+                    cached = cache.load(db_path, key_prefix)
+        except (OSError, sqlite3.Error) as e:
+            stats.warn(f"Metadata cache unavailable: {str(e)}")
+    if known is not None:
+        cached = {chat.key: chat for chat in known}
+    
+    new_entries = []
+    removed_keys = ()
+    pool = None
+    try:
+        # List the matching records; entry is None for records that need decoding
+        listing = []
+        stale = []
+        stale_bytes = 0
+        size_sql, compressed_sql = _value_sql(db_path)
+        # Archives hand out values already decompressed but keep the flag of the original;
+        # elsewhere it is found while decoding, as reading it here would read every value
+        columns = f"rowid, key, {size_sql}, {compressed_sql if is_archive(db_path) else 'NULL'}"
+        with stats.timer("sqlite.list"):
+            # The index holds the text of bubbles kept apart, so their chats are reread when they change
+            bubbles = _bubble_versions(conn) if cache is not None and key_prefix else {}
+            for rowid, key, size, stored_compressed in iter_prefixed_rows(conn, key_prefix, columns=columns):
+                size = size or 0
+                if stored_compressed is not None:
+                    stored_compressed = bool(stored_compressed)
+                version = rowid
+                bubble_version = bubbles.get(key[len(key_prefix):]) if bubbles else None
+                if bubble_version is not None:
+                    version = f"{rowid}:{bubble_version[0]}:{bubble_version[1]}"
+                entry = cached.pop(key, None)
+                if (entry is None or entry.version != version or entry.size != size
+                        or stored_compressed not in (None, entry.compressed)):
+                    entry = None
+                    stale.append(len(listing))
+                    stale_bytes += size
+                listing.append((key, version, size, stored_compressed, entry))
+        # Whatever is left over in cached no longer exists in the database
+        removed_keys = list(cached)
+        stats.add("rows_listed", len(listing))
+        stats.add("cache_hits", len(listing) - len(stale))
+        
+        if workers > 1 and stale_bytes >= DECODE_PARALLEL_MIN_BYTES:
+            pool = shared_pool or worker_pool(workers)
+        batches = deque(stale[i:i + DECODE_BATCH_SIZE] for i in range(0, len(stale), DECODE_BATCH_SIZE))
+        in_flight = deque()
+        decoded = {}
+        
+        def decode_next_batch():
+            positions = batches.popleft()
+            values = []
+            with stats.timer("sqlite.read"):
+                for position in positions:
+                    try:
+                        values.append(fetch_value(conn, listing[position][0]))
+                    except KeyError:
+                        values.append(None)  # Deleted since it was listed
+            stats.add("bytes_read", sum(len(value) for value in values if value is not None))
+            if pool is None:
+                add_decoded(positions, _decode_batch(values, cache is not None, db_path))
+            else:
+                in_flight.append((positions, pool.submit(_decode_batch, values, cache is not None, db_path)))
+        
+        def add_decoded(positions, result):
+            results, batch_stats = result
+            decoded.update(zip(positions, results))
+            stats.merge(batch_stats)
+        
+        for position, (key, version, size, stored_compressed, entry) in enumerate(listing):
+            if entry is not None:
+                yield entry
+            else:
+                if pool is None:
+                    while position not in decoded:
+                        decode_next_batch()
+                else:
+                    # Keep the pool busy ahead of the record we are waiting for
+                    while batches and len(in_flight) < workers * 2:
+                        decode_next_batch()
+                    while position not in decoded:
+                        positions, future = in_flight.popleft()
+                        with stats.timer("wait.workers"):
+                            result = future.result()
+                        add_decoded(positions, result)
+                compressed, (date_str, title, message_count, _, timestamp), text = decoded.pop(position)
+                if stored_compressed is not None:
+                    compressed = stored_compressed
+                if cache is not None:
+                    new_entries.append((key, version, size, compressed, date_str, timestamp, title, message_count, text))
+                    if len(new_entries) >= CACHE_FLUSH_SIZE:
+                        try:
+                            with stats.timer("cache.update"):
+                                cache.update(db_path, new_entries)
+                        except sqlite3.Error as e:
+                            stats.warn(f"Failed to update metadata cache: {str(e)}")
+                        new_entries = []
+                # Remove prefix from chat_id if it exists
+                chat_id = key[len(key_prefix):] if key_prefix else key
+                yield ChatMeta(chat_id, date_str, key, title, size, compressed, message_count, version, db_path, timestamp)
+    finally:
+        if pool is not None and pool is not shared_pool:
+            pool.shutdown(wait=False, cancel_futures=True)
+        database_pool.release(db_path, conn)
+        if cache is not None:
+            try:
+                with stats.timer("cache.update"):
+                    cache.update(db_path, new_entries, removed_keys)
+            except sqlite3.Error as e:
+                stats.warn(f"Failed to update metadata cache: {str(e)}")
+            cache.close()
+
+def db_signature(db_path):
+    """Cheap fingerprint of a database's files that changes whenever it is written to.
+    With WAL journaling, writes land in the -wal file first."""
+    signature = []
+    for path in (db_path, db_path + "-wal"):
+        try:
+            stat = os.stat(path)
+            signature.append((stat.st_mtime_ns, stat.st_size))
+        except OSError:
+            signature.append(None)
+    return tuple(signature)
+
+def as_db_paths(db_path):
+    """Return db_path as a tuple of paths, whether it is one path or several."""
+    return (db_path,) if isinstance(db_path, str) else tuple(db_path)
+
+def discover_databases(paths):
+    """Expand database files and directories into a list of database paths.
+
+    Directories are searched recursively for files named like DB_FILE_SUFFIXES,
+    which covers Cursor's User directory (globalStorage and every
+    workspaceStorage folder) as well as folders of backups, and for chat
+    archives. Files are kept as
+    given and paths that do not exist are left out. Each database is listed
+    once however it was reached.
+    """
+    found = []
+    seen = set()
+    for path in paths:
+        if os.path.isdir(path):
+            candidates = []
+            for dirpath, dirnames, filenames in os.walk(path):
+                dirnames.sort()
+                candidates.extend(os.path.join(dirpath, name) for name in sorted(filenames)
+                                  if name.endswith(DB_FILE_SUFFIXES + (ARCHIVE_SUFFIX,)))
+            # Backups and archives go last, so merge_chats() prefers live copies of a chat
+            candidates.sort(key=lambda candidate: candidate.endswith((".backup", ARCHIVE_SUFFIX)))
+        elif os.path.isfile(path):
+            candidates = [path]
+        else:
+            continue
+        for candidate in candidates:
+            identity = os.path.realpath(candidate)
+            if identity not in seen:
+                seen.add(identity)
+                found.append(candidate)
+    return found
+
+def scan_sources(db_paths, key_prefix, use_cache=True, workers=None, known=None, stats=NO_STATS):
+    """Scan several databases at once and yield (db_path, [ChatMeta, ...]) for
+    each as it finishes.
+
+    Up to SOURCE_SCAN_THREADS databases are listed concurrently with
+    scan_chats(). Those with enough to decode share one pool of worker
+    processes, so a large globalStorage database still decodes in parallel
+    while small workspace databases are handled in their threads. known
+    maps a db_path to its previous listing, as for scan_chats(). All of them
+    record into stats. Databases that cannot be read are reported with
+    stats.warn() and skipped.
+    """
+    from concurrent.futures import ThreadPoolExecutor, as_completed
+    db_paths = list(db_paths)
+    if known is None:
+        known = {}
+    if workers is None:
+        workers = default_worker_count()
+    # Worker processes only start once a database submits work to the pool
+    shared_pool = worker_pool(workers) if workers > 1 and len(db_paths) > 1 else None
+    
+    def scan(path):
+        return list(scan_chats(path, key_prefix, use_cache=use_cache, workers=workers, known=known.get(path),
+                               stats=stats, shared_pool=shared_pool))
+    
+    executor = ThreadPoolExecutor(max_workers=max(1, min(SOURCE_SCAN_THREADS, len(db_paths))))
+    try:
+        futures = {executor.submit(scan, path): path for path in db_paths}
+        for future in as_completed(futures):
+            path = futures[future]
+            try:
+                chats = future.result()
+            except (OSError, sqlite3.Error) as e:
+                stats.warn(f"Skipping {path}: {str(e)}")
+                continue
+            yield path, chats
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+        if shared_pool is not None:
+            shared_pool.shutdown(wait=False, cancel_futures=True)
+
+def refresh_sources(locations, key_prefix, listings=None, signatures=None, use_cache=True, stats=NO_STATS):
+    """Discover the databases at locations and bring their listings up to date.
+    
+    listings and signatures come from an earlier call and map each db_path
+    to its [ChatMeta, ...] and its db_signature(). Only databases that are
+    new or have changed since are scanned again, with their earlier listing
+    as known, so unchanged records come back as the very same objects.
+    A database that could not be scanned keeps its signature without a
+    listing, and is only tried again once it changes.
+    Returns (sources, listings, signatures) to pass to the next call.
+    """
+    listings = listings or {}
+    signatures = signatures or {}
+    sources = discover_databases(locations)
+    new_signatures = {path: db_signature(path) for path in sources}
+    stale = [path for path in sources if new_signatures[path] != signatures.get(path)]
+    fresh = {path: listings[path] for path in sources if path in listings}
+    fresh.update(scan_sources(stale, key_prefix, use_cache=use_cache, known=fresh, stats=stats))
+    return sources, fresh, new_signatures
+
+def merge_chats(chat_lists):
+    """Merge the listings of several databases into one, keeping a single
+    ChatMeta per chat id (the composer id for composerData records).
+    
+    Of several copies of a chat, as found in backups and in more than one
+    machine's database, the one with the most messages, then the largest,
+    wins. On a tie the copy from the earlier listing is kept.
+    """
+    best = {}
+    for chats in chat_lists:
+        for chat in chats:
+            current = best.get(chat.chat_id)
+            if current is None or (chat.message_count, chat.size) > (current.message_count, current.size):
+                best[chat.chat_id] = chat
+    return list(best.values())
+
+def chat_sort_value(chat, column):
+    """The value chats are ordered by in one of SORT_COLUMNS. Chats without a
+    readable date sort before the oldest, and titles ignore case."""
+    if column == "date":
+        return chat.timestamp if chat.timestamp is not None else float("-inf")
+    if column == "title":
+        return chat.title.casefold()
+    if column == "size":
+        return chat.size
+    if column == "messages":
+        return chat.message_count
+    if column == "source":
+        return chat.source
+    if column == "key":
+        return chat.key
+    raise ValueError(f"Unknown sort column {column!r}; expected one of {', '.join(SORT_COLUMNS)}")
+
+def parse_time(text, now=None):
+    """Read a point in time for a date filter and return it in seconds since
+    the epoch. Accepts what parse_timestamp() does, such as 2024-05-01 or
+    2024-05-01T09:30, and ages counted back from now like 30m, 12h, 7d or 2w."""
+    match = re.fullmatch(r"(\d+(?:\.\d+)?)([mhdw])", text.strip())
+    if match:
+        return (time.time() if now is None else now) - float(match[1]) * _AGE_UNITS[match[2]]
+    timestamp = parse_timestamp(text)
+    if timestamp is None:
+        raise ValueError(f"Cannot read {text!r} as a date, a timestamp or an age like 7d")
+    return timestamp
+
+_AGE_UNITS = {"m": 60, "h": 3600, "d": 86400, "w": 7 * 86400}
+
+class SortIndex:
+    """A list of chats kept in order by every column of SORT_COLUMNS, so
+    that sorting and range filters are binary searches rather than sorts.
+    
+    The order of a column is built the first time it is needed and kept as
+    positions in chats with their keys, (value, chat key) pairs, alongside.
+    A SortIndex does not follow changes to chats; make a new one instead.
+    """
+    
+    def __init__(self, chats):
+        self.chats = chats
+        self._orders = {}
+        self._ranks = {}
+    
+    def order(self, column):
+        """Return (positions, keys) for column, ascending."""
+        order = self._orders.get(column)
+        if order is None:
+            keyed = sorted((chat_sort_value(chat, column), chat.key, position) for position, chat in enumerate(self.chats))
+            order = self._orders[column] = ([position for _, _, position in keyed], [(value, key) for value, key, _ in keyed])
+        return order
+    
+    def rank(self, column):
+        """Return each chat's place in the order of column, by position in chats."""
+        ranks = self._ranks.get(column)
+        if ranks is None:
+            ranks = self._ranks[column] = [0] * len(self.chats)
+            for rank, position in enumerate(self.order(column)[0]):
+                ranks[position] = rank
+        return ranks
+    
+    def _span(self, column, low, high):
+        # Values from low up to but not including high; (value,) sorts before every (value, key)
+        _, keys = self.order(column)
+        start = 0 if low is None else bisect_left(keys, (low,))
+        end = len(keys) if high is None else bisect_left(keys, (high,))
+        return start, max(start, end)
+    
+    def query(self, sort="date", reverse=False, after=None, limit=None,
+              since=None, until=None, title=None, min_size=None, max_size=None):
+        """Return the positions in chats of the chats matching every filter,
+        ordered by the sort column, descending with reverse.
+        
+        since and until bound the date in seconds since the epoch, until
+        excluded, and leave out chats without a date. title keeps titles
+        starting with it, ignoring case, and min_size and max_size bound the
+        stored size in bytes, both included. after is the key of the last
+        chat of a previous page, as from sort_key(), and limit is the most
+        positions returned.
+        
+        Each filter is a range of its column's order. The results come from
+        walking the sort column's range, or, when another filter matches far
+        fewer chats, from that filter's range ordered by rank.
+        """
+        if limit is not None and limit <= 0:
+            return []
+        ranges = {}
+        if since is not None or until is not None:
+            # Chats without a date sort as -inf, below the lowest real timestamp
+            ranges["date"] = (since if since is not None else -sys.float_info.max, until)
+        if title:
+            ranges["title"] = prefix_range(title.casefold())
+        if min_size is not None or max_size is not None:
+            ranges["size"] = (min_size, max_size + 1 if max_size is not None else None)
+        spans = {column: self._span(column, low, high) for column, (low, high) in ranges.items()}
+        
+        def matches(position, skip):
+            chat = self.chats[position]
+            for column, (low, high) in ranges.items():
+                if column != skip:
+                    value = chat_sort_value(chat, column)
+                    if (low is not None and value < low) or (high is not None and value >= high):
+                        return False
+            return True
+        
+        start, end = spans.get(sort, (0, len(self.chats)))
+        narrowest = min(spans, key=lambda column: spans[column][1] - spans[column][0], default=sort)
+        narrow_start, narrow_end = spans.get(narrowest, (start, end))
+        if narrowest != sort and (narrow_end - narrow_start) * SORT_INDEX_WALK_RATIO < end - start:
+            positions = [position for position in self.order(narrowest)[0][narrow_start:narrow_end]
+                         if matches(position, narrowest)]
+            ranks = self.rank(sort)
+            positions.sort(key=ranks.__getitem__, reverse=reverse)
+            if after is not None:
+                keys = self.order(sort)[1]
+                after = tuple(after)
+                positions = [position for position in positions
+                             if (keys[ranks[position]] < after if reverse else keys[ranks[position]] > after)]
+            return positions[:limit]
+        
+        order, keys = self.order(sort)
+        if after is not None:
+            if reverse:
+                end = min(end, bisect_left(keys, tuple(after)))
+            else:
+                start = max(start, bisect_right(keys, tuple(after)))
+        steps = range(end - 1, start - 1, -1) if reverse else range(start, end)
+        results = []
+        for step in steps:
+            if matches(order[step], sort):
+                results.append(order[step])
+                if limit is not None and len(results) >= limit:
+                    break
+        return results
+    
+    def sort_key(self, position, column):
+        """The key of the chat at position in column, to pass back as after."""
+        return self.order(column)[1][self.rank(column)[position]]
+
+def source_label(db_path):
+    """Short name for the database a chat came from: the folder holding it,
+    plus the file name when that isn't the usual state.vscdb."""
+    folder, name = os.path.split(os.path.normpath(db_path))
+    label = os.path.basename(folder) or folder
+    return label if name == "state.vscdb" else f"{label}/{name}"
+
+class SourceConnections:
+    """Connections to the source databases of a set of chats, taken from
+    database_pool as they are first needed and handed back by close()."""
+    
+    def __init__(self):
+        self._connections = {}
+    
+    def get(self, db_path):
+        conn = self._connections.get(db_path)
+        if conn is None:
+            conn = self._connections[db_path] = database_pool.acquire(db_path)
+        return conn
+    
+    def close(self):
+        for db_path, conn in self._connections.items():
+            database_pool.release(db_path, conn)
+        self._connections.clear()
+
+# Groups keys on everything up to and including the first colon, like "composerData:"
+_PREFIX_SQL = "CASE WHEN instr(key, ':') > 0 THEN substr(key, 1, instr(key, ':')) ELSE '(no prefix)' END"
+
+def _query_materialized(conn, sql):
+    """Run sql, whose CTE is declared AS MATERIALIZED, dropping the hint on
+    SQLite versions older than 3.35 that do not know it."""
+    try:
+        return conn.execute(sql).fetchall()
+    except sqlite3.OperationalError:
+        if " MATERIALIZED" not in sql:
+            raise
+        return conn.execute(sql.replace(" MATERIALIZED", "")).fetchall()
+
+def analyze_prefixes(db_path, sample_every=None, largest=ANALYZE_LARGEST_KEYS, stats=NO_STATS):
+    """Break the records of db_path down by key prefix and return a DatabaseAnalysis.
+    
+    Everything is aggregated in SQL. Counts, value sizes and the largest
+    records only need each record's header and are exact. Telling compressed
+    values apart means reading the start of every value, so with sample_every
+    N only every Nth record (by rowid) is checked. By default databases over
+    ANALYZE_SAMPLE_MIN_BYTES are sampled every ANALYZE_SAMPLE_EVERY records.
+    Sizes are SQLite's length(value), which is bytes for BLOBs and characters
+    for text; chat archives report each record as it was stored in Cursor.
+    
+    db_path may also be a list of databases to analyze together, in which
+    case any that cannot be read are skipped. The queries are timed in stats.
+    """
+    paths = as_db_paths(db_path)
+    if sample_every is None:
+        db_bytes = sum(os.path.getsize(path) for path in paths if os.path.isfile(path))
+        sample_every = ANALYZE_SAMPLE_EVERY if db_bytes > ANALYZE_SAMPLE_MIN_BYTES else 1
+    sample_every = max(1, int(sample_every))
+    sample_where = f"WHERE rowid % {sample_every} = 0" if sample_every > 1 else ""
+    
+    counts = {}
+    sizes = {}
+    checked = {}
+    compressed = {}
+    biggest = []
+    for path in paths:
+        size_sql, compressed_sql = _value_sql(path)
+        try:
+            with database_pool.connection(path) as conn, stats.timer("sqlite.analyze"):
+                # Computing the per-record values in a materialized CTE keeps SQLite from
+                # copying whole values into the GROUP BY sorter
+                for prefix, count, size in _query_materialized(conn, (
+                        f"WITH records AS MATERIALIZED (SELECT {_PREFIX_SQL} AS prefix, {size_sql} AS size FROM cursorDiskKV) "
+                        f"SELECT prefix, count(*), total(size) FROM records GROUP BY prefix")):
+                    counts[prefix] = counts.get(prefix, 0) + count
+                    sizes[prefix] = sizes.get(prefix, 0) + int(size)
+                for prefix, count, zipped in _query_materialized(conn, (
+                        f"WITH records AS MATERIALIZED (SELECT {_PREFIX_SQL} AS prefix, "
+                        f"{compressed_sql} AS zipped FROM cursorDiskKV {sample_where}) "
+                        f"SELECT prefix, count(*), total(zipped) FROM records GROUP BY prefix")):
+                    checked[prefix] = checked.get(prefix, 0) + count
+                    compressed[prefix] = compressed.get(prefix, 0) + int(zipped)
+                biggest.extend((key, size, path) for key, size in conn.execute(
+                    f"SELECT key, {size_sql} AS size FROM cursorDiskKV ORDER BY size DESC LIMIT ?", (largest,)))
+        except sqlite3.DatabaseError as e:
+            # One unreadable database shouldn't spoil the analysis of the rest
+            if len(paths) == 1:
+                raise
+            stats.warn(f"Skipping {path}: {str(e)}")
+    
+    prefixes = [PrefixStats(prefix, count, sizes[prefix],
+                            compressed[prefix] / checked[prefix] if checked.get(prefix) else None)
+                for prefix, count in counts.items()]
+    # Where the space goes: biggest prefixes first
+    prefixes.sort(key=lambda stats: (stats.total_bytes, stats.count), reverse=True)
+    biggest.sort(key=lambda item: item[1] or 0, reverse=True)
+    return DatabaseAnalysis(sum(counts.values()), sum(sizes.values()), prefixes, biggest[:largest], sample_every)
+
+def format_size(size):
+    """Format a byte count for people, like 1.5 MB."""
+    for unit in ("bytes", "KB", "MB", "GB"):
+        if size < 1024 or unit == "GB":
+            return f"{size} {unit}" if unit == "bytes" else f"{size:.1f} {unit}"
+        size /= 1024
+
+def find_chats(db_path, key_prefix, query, chats, limit=SEARCH_LIMIT, cancelled=None, stats=NO_STATS):
+    """Return [(key, snippet), ...] for the chats matching query, best match first.
+    db_path may also be a list of databases to search together.
+
+    The full-text index kept alongside the metadata cache is used when there
+    is one, so chats should have been listed with scan_chats() first. Without
+    it, every chat in chats is checked for the query as a plain substring.
+    cancelled, if given, is polled during that scan and ends it early.
+    Either search is timed in stats.
+    """
+    try:
+        cache = MetadataCache()
+        try:
+            if cache.has_fts:
+                with stats.timer("search.index"):
+                    return cache.search(db_path, key_prefix, query, limit)
+        finally:
+            cache.close()
+    except (OSError, sqlite3.Error) as e:
+        stats.warn(f"Search index unavailable: {str(e)}")
+    
+    # Otherwise look for the search term in every chat
+    search_term = query.lower()
+    matches = []
+    connections = SourceConnections()
+    try:
+        for chat in chats:
+            if cancelled is not None and cancelled():
+                return []
+            # Try to get content as text
+            try:
+                if (search_term in chat.chat_id.lower() or
+                    search_term in chat.title.lower()):
+                    found = True
+                else:
+                    with stats.timer("search.scan"):
+                        value = decompress_value(fetch_value(connections.get(chat.source), chat.key))
+                        if isinstance(value, bytes):
+                            value = value.decode('utf-8', errors='ignore')
+                        found = search_term in value.lower()
+                
+                if found:
+                    matches.append((chat.key, ""))
+                    if len(matches) >= limit:
+                        break
+            except Exception:
+                continue
+    finally:
+        connections.close()
+    return matches
+
+def format_chat_text(value, fetch=None):
+    """Return a decompressed chat value as readable text.
+
+    Chats become a transcript of role-labelled messages under the title, with
+    code blocks and tool calls; bubbles kept as records of their own are read
+    with fetch, as in parse_conversation(). Anything else is returned as
+    decoded text. Raises UnicodeDecodeError for binary values.
+    """
+    text = value if isinstance(value, str) else value.decode('utf-8')
+    conversation = parse_conversation(text, fetch)
+    if conversation is None:
+        return text
+    return ''.join(iter_chat_text(conversation))
+
+def chat_record(chat):
+    """JSON-ready listing fields of a ChatMeta."""
+    return {
+        "key": chat.key,
+        "chat_id": chat.chat_id,
+        "date": chat.date_str,
+        "timestamp": chat.timestamp,
+        "title": chat.title,
+        "size": chat.size,
+        "compressed": chat.compressed,
+        "message_count": chat.message_count,
+        "source": chat.source,
+    }
+
+def chat_export_record(chat, value):
+    """chat_record() plus the decompressed value: parsed as "data" when it is
+    JSON, as "text" when it is other text, and as "base64" when it is binary."""
+    record = chat_record(chat)
+    try:
+        text = value if isinstance(value, str) else value.decode('utf-8')
+    except UnicodeDecodeError:
+        record["base64"] = base64.b64encode(value).decode('ascii')
+        return record
+    try:
+        record["data"] = json.loads(text)
+    except json.JSONDecodeError:
+        record["text"] = text
+    return record
+
+def export_file_name(chat, extension):
+    # Chat ids come from record keys and may hold characters that are not safe in paths
+    return "cursor_chat_" + re.sub(r'[^\w.-]', '_', chat.chat_id) + extension
+
+def _format_export_batch(items, content, lines):
+    """Worker process entry point: format (chat, raw value) pairs for export.
+
+    Returns (name, bytes) pairs. With lines set, each is one JSON Lines
+    record; otherwise it is a file in the requested content format, "json"
+    or "text", and binary values are passed through as .bin files.
+    """
+    results = []
+    for chat, value in items:
+        value = decompress_value(value)
+        if lines:
+            line = json.dumps(chat_export_record(chat, value), ensure_ascii=False) + "\n"
+            results.append((None, line.encode('utf-8')))
+            continue
+        try:
+            text = value if isinstance(value, str) else value.decode('utf-8')
+        except UnicodeDecodeError:
+            results.append((export_file_name(chat, ".bin"), value))
+            continue
+        if content == "text":
+            data, extension = format_chat_text(text, record_fetcher(chat.source)), ".txt"
+        else:
+            data, extension = ''.join(iter_formatted_value(text)), ".json"
+        results.append((export_file_name(chat, extension), data.encode('utf-8')))
+    return results
+
+class _DirectoryWriter:
+    lines = False
+    
+    def __init__(self, path):
+        os.makedirs(path, exist_ok=True)
+        self.path = path
+    
+    def write(self, name, data):
+        with open(os.path.join(self.path, name), 'wb') as f:
+            f.write(data)
+    
+    def close(self):
+        pass
+
+class _JsonlWriter:
+    lines = True
+    
+    def __init__(self, path_or_file):
+        if isinstance(path_or_file, str):
+            self.file = open(path_or_file, 'wb')
+            self.owned = True
+        else:
+            self.file = path_or_file
+            self.owned = False
+    
+    def write(self, name, data):
+        self.file.write(data)
+    
+    def close(self):
+        if self.owned:
+            self.file.close()
+        else:
+            self.file.flush()
+
+class _TarWriter:
+    lines = False
+    
+    def __init__(self, path):
+        import tarfile
+        self.tarfile = tarfile
+        mode = "w:gz" if path.endswith((".tar.gz", ".tgz")) else "w"
+        self.archive = tarfile.open(path, mode)
+        self.mtime = time.time()
+    
+    def write(self, name, data):
+        info = self.tarfile.TarInfo(name)
+        info.size = len(data)
+        info.mtime = self.mtime
+        self.archive.addfile(info, io.BytesIO(data))
+    
+    def close(self):
+        self.archive.close()
+
+class _ZipWriter:
+    lines = False
+    
+    def __init__(self, path):
+        import zipfile
+        self.archive = zipfile.ZipFile(path, "w", compression=zipfile.ZIP_DEFLATED)
+    
+    def write(self, name, data):
+        self.archive.writestr(name, data)
+    
+    def close(self):
+        self.archive.close()
+
+def export_format_for_path(path):
+    """Guess the bulk export format from a destination path: .jsonl files,
+    .tar, .tar.gz or .tgz archives, .zip archives, and directories otherwise."""
+    lower = path.lower()
+    if lower.endswith((".jsonl", ".ndjson")):
+        return "jsonl"
+    if lower.endswith((".tar", ".tar.gz", ".tgz")):
+        return "tar"
+    if lower.endswith(".zip"):
+        return "zip"
+    return "dir"
+
+def open_export_writer(destination, fmt=None):
+    """Open a bulk export destination for export_chats().
+
+    destination is a path, or a binary file object for JSON Lines output.
+    fmt is one of EXPORT_FORMATS and defaults to export_format_for_path().
+    """
+    if not isinstance(destination, str):
+        return _JsonlWriter(destination)
+    if fmt is None:
+        fmt = export_format_for_path(destination)
+    writers = {"dir": _DirectoryWriter, "jsonl": _JsonlWriter, "tar": _TarWriter, "zip": _ZipWriter}
+    if fmt not in writers:
+        raise ValueError(f"Unknown export format {fmt!r}; expected one of {', '.join(EXPORT_FORMATS)}")
+    return writers[fmt](destination)
+
+def export_chats(chats, writer, content="json", workers=None, progress=None, cancelled=None, stats=NO_STATS):
+    """Write every chat in chats, read from its source database, to writer
+    (see open_export_writer) and return the number written.
+
+    Values are read in small batches and formatted on a pool of worker
+    processes when there is enough data to be worth it. Results are written
+    in the order of chats as soon as they are ready, and only a few batches
+    per worker are read ahead, so memory use does not grow with the number of
+    chats. progress(count) is called after each batch, and cancelled() is
+    polled between batches to stop early. The writer is not closed. Reading,
+    formatting (or waiting for the workers to) and writing are timed in stats.
+    """
+    chats = list(chats)
+    if workers is None:
+        workers = default_worker_count()
+    
+    # Split into batches bounded by both record count and stored size
+    batches = deque()
+    batch, batch_bytes = [], 0
+    for chat in chats:
+        if batch and (len(batch) >= EXPORT_BATCH_SIZE or batch_bytes + chat.size > EXPORT_BATCH_BYTES):
+            batches.append(batch)
+            batch, batch_bytes = [], 0
+        batch.append(chat)
+        batch_bytes += chat.size
+    if batch:
+        batches.append(batch)
+    
+    connections = SourceConnections()
+    pool = None
+    in_flight = deque()
+    written = 0
+    try:
+        if workers > 1 and sum(chat.size for chat in chats) >= DECODE_PARALLEL_MIN_BYTES:
+            pool = worker_pool(workers)
+        
+        def read_batch(batch):
+            items = []
+            with stats.timer("sqlite.read"):
+                for chat in batch:
+                    try:
+                        items.append((chat, fetch_value(connections.get(chat.source), chat.key)))
+                    except KeyError:
+                        pass  # Deleted since it was listed
+            stats.add("bytes_read", sum(len(value) for _, value in items))
+            return items
+        
+        while batches or in_flight:
+            if cancelled is not None and cancelled():
+                break
+            if pool is None:
+                items = read_batch(batches.popleft())
+                with stats.timer("format"):
+                    results = _format_export_batch(items, content, writer.lines)
+            else:
+                while batches and len(in_flight) < workers * EXPORT_IN_FLIGHT:
+                    in_flight.append(pool.submit(_format_export_batch, read_batch(batches.popleft()), content, writer.lines))
+                with stats.timer("wait.workers"):
+                    results = in_flight.popleft().result()
+            with stats.timer("write"):
+                for name, data in results:
+                    writer.write(name, data)
+            stats.add("bytes_written", sum(len(data) for _, data in results))
+            written += len(results)
+            if progress is not None:
+                progress(written)
+    finally:
+        if pool is not None:
+            pool.shutdown(wait=False, cancel_futures=True)
+        connections.close()
+    return written
+
+# A JSON string, quotes included; used to split archived values at long strings
+_JSON_STRING = re.compile(rb'"[^"\\]*(?:\\.[^"\\]*)*"', re.S)
+
+def _archive_hash(data):
+    return hashlib.blake2b(data, digest_size=_ARCHIVE_HASH_SIZE).digest()
+
+def split_chunks(value):
+    """Split a decompressed value into the chunks an archive stores it as.
+    
+    In JSON values every string of ARCHIVE_SPLIT_MIN bytes or more becomes a
+    chunk of its own, so the same message text or code stored in several
+    records, or in several versions of one, dedupes however the JSON around
+    it changed. Whatever lies between such strings, longer strings and
+    values that aren't JSON are cut into chunks of ARCHIVE_CHUNK_MAX bytes.
+    Joining the chunks gives back the value.
+    """
+    chunks = []
+    
+    def add(start, end):
+        for pos in range(start, end, ARCHIVE_CHUNK_MAX):
+            chunks.append(value[pos:min(end, pos + ARCHIVE_CHUNK_MAX)])
+    
+    pos = 0
+    if value[:1] in (b"{", b"["):
+        for match in _JSON_STRING.finditer(value):
+            start, end = match.span()
+            if end - start >= ARCHIVE_SPLIT_MIN:
+                add(pos, start)
+                add(start, end)
+                pos = end
+    add(pos, len(value))
+    return chunks
+
+def train_dictionary(values, size=ARCHIVE_DICT_SIZE):
+    """Build a zlib dictionary of at most size bytes from sample values.
+    
+    It holds the short JSON strings, mostly keys and enum-like values, found
+    in more than one of the values, chosen by how many bytes they would
+    save. The commonest go last, where zlib reaches them with the shortest
+    distances.
+    """
+    counts = Counter()
+    for value in values:
+        counts.update({match.group() for match in _JSON_STRING.finditer(value)
+                       if match.end() - match.start() < ARCHIVE_SPLIT_MIN})
+    common = sorted((string for string, count in counts.items() if count > 1),
+                    key=lambda string: counts[string] * len(string), reverse=True)
+    picked, total = [], 0
+    for string in common:
+        if total + len(string) <= size:
+            picked.append(string)
+            total += len(string)
+    picked.sort(key=counts.get)
+    return b"".join(picked)
+
+class ArchiveWriter:
+    """Adds records to a chat archive, creating it if needed.
+    
+    An archive is a SQLite file. Each record is kept decompressed as a list
+    of content-addressed chunks (see split_chunks), and a chunk already in
+    the archive is never stored again. A record whose content hasn't changed
+    since it was last archived is skipped; when it has, the new version is
+    added next to the old ones. The cursorDiskKV view shows the latest
+    version of every key, so ConnectionPool opens an archive like any
+    Cursor database.
+    
+    Chunks are zlib-compressed with a dictionary trained on the first
+    ARCHIVE_DICT_SAMPLE records added to the archive, which are held in
+    memory until then. Nothing is saved until commit() or close().
+    """
+    
+    def __init__(self, path, stats=NO_STATS):
+        if not is_archive(path):
+            raise ValueError(f"Archive file names must end in {ARCHIVE_SUFFIX}: {path}")
+        self.path = path
+        self.stats = stats
+        self.conn = sqlite3.connect(path)
+        try:
+            application_id = self.conn.execute("PRAGMA application_id").fetchone()[0]
+            if application_id != _ARCHIVE_APPLICATION_ID and self.conn.execute(
+                    "SELECT count(*) FROM sqlite_master").fetchone()[0]:
+                raise ValueError(f"{path} is not a chat archive")
+            self.conn.executescript(_ARCHIVE_SCHEMA)
+            self.conn.execute(f"PRAGMA application_id = {_ARCHIVE_APPLICATION_ID}")
+            self.conn.commit()
+            self._dictionary = self.conn.execute(
+                "SELECT id, data FROM dictionaries ORDER BY id DESC LIMIT 1").fetchone()
+        except (ValueError, sqlite3.Error):
+            self.conn.close()
+            raise
+        self._trained = self._dictionary is not None
+        self._pending = []
+        self._pending_chunks = {}
+        self.added = self.unchanged = self.chunks = self.stored_bytes = 0
+    
+    def add(self, key, value, size, compressed):
+        """Archive the decompressed value of key, which Cursor stored as size
+        bytes, zlib-compressed or not. Returns False when the archive already
+        holds this content for key."""
+        if isinstance(value, str):
+            value = value.encode("utf-8")
+        start = time.perf_counter()
+        chunks = split_chunks(value)
+        hashes = [_archive_hash(chunk) for chunk in chunks]
+        self.stats.add_time("archive.chunk", time.perf_counter() - start)
+        # The list of chunk hashes doubles as a digest of the whole value
+        digest = b"".join(hashes)
+        latest = self._pending_chunks.get(key)
+        if latest is None:
+            row = self.conn.execute(
+                "SELECT records.chunks FROM latest JOIN records ON records.id = latest.record "
+                "WHERE latest.key = ?", (key,)).fetchone()
+            latest = row[0] if row else None
+        if latest == digest:
+            self.unchanged += 1
+            return False
+        self.added += 1
+        record = (key, size, compressed, chunks, hashes)
+        if self._trained:
+            self._store(*record)
+        else:
+            self._pending.append(record)
+            self._pending_chunks[key] = digest
+            if len(self._pending) >= ARCHIVE_DICT_SAMPLE:
+                self._store_pending()
+        return True
+    
+    def _store_pending(self):
+        start = time.perf_counter()
+        data = train_dictionary(b"".join(record[3]) for record in self._pending)
+        if data:
+            cursor = self.conn.execute("INSERT INTO dictionaries (data) VALUES (?)", (data,))
+            self._dictionary = (cursor.lastrowid, data)
+        self._trained = True
+        self.stats.add_time("archive.train", time.perf_counter() - start)
+        pending, self._pending, self._pending_chunks = self._pending, [], {}
+        for record in pending:
+            self._store(*record)
+    
+    def _compress(self, chunk):
+        if self._dictionary is None:
+            compressor = zlib.compressobj()
+            dictionary_id = None
+        else:
+            dictionary_id, data = self._dictionary
+            compressor = zlib.compressobj(zdict=data)
+        data = compressor.compress(chunk) + compressor.flush()
+        if len(data) >= len(chunk):
+            return 0, None, chunk
+        return 1, dictionary_id, data
+    
+    def _store(self, key, size, compressed, chunks, hashes):
+        for chunk_hash, chunk in zip(hashes, chunks):
+            if self.conn.execute("SELECT 1 FROM chunks WHERE hash = ?", (chunk_hash,)).fetchone():
+                continue
+            start = time.perf_counter()
+            codec, dictionary_id, data = self._compress(chunk)
+            self.stats.add_time("zlib", time.perf_counter() - start)
+            self.conn.execute("INSERT INTO chunks (hash, codec, dictionary, data) VALUES (?, ?, ?, ?)",
+                              (chunk_hash, codec, dictionary_id, data))
+            self.chunks += 1
+            self.stored_bytes += len(data)
+        cursor = self.conn.execute(
+            "INSERT INTO records (key, size, compressed, chunks, archived_at) VALUES (?, ?, ?, ?, ?)",
+            (key, size, int(bool(compressed)), b"".join(hashes), time.time()))
+        self.conn.execute("INSERT OR REPLACE INTO latest VALUES (?, ?)", (key, cursor.lastrowid))
+    
+    def commit(self):
+        if self._pending:
+            self._store_pending()
+        with self.stats.timer("archive.commit"):
+            self.conn.commit()
+    
+    def close(self):
+        try:
+            self.commit()
+        finally:
+            self.conn.close()
+    
+    def summary(self):
+        return ArchiveSummary(self.added, self.unchanged, self.chunks, self.stored_bytes)
+
+def archive_chats(db_paths, archive_path, prefixes=ARCHIVE_PREFIXES, progress=None, cancelled=None, stats=NO_STATS):
+    """Copy every record of db_paths whose key starts with one of prefixes
+    into the chat archive at archive_path (see ArchiveWriter), and return
+    an ArchiveSummary.
+    
+    Archiving the same databases again only adds what changed in between.
+    A key found in several sources is archived from the first of them only,
+    so with discover_databases() the live copy wins over backups, as in
+    merge_chats(), rather than the copies replacing each other in turn.
+    Sources may themselves be archives, but never the one being written.
+    progress(count) is called with the number of records read so far, every
+    CACHE_FLUSH_SIZE records, and cancelled() is polled as often to stop
+    early; what was archived until then is kept. With several sources, any
+    that cannot be read are reported with stats.warn() and skipped. Reading,
+    chunking, compressing and committing are timed in stats.
+    """
+    paths = as_db_paths(db_paths)
+    writer = ArchiveWriter(archive_path, stats)
+    count = 0
+    # Keys taken from earlier sources; only needed when there are several
+    seen = set() if len(paths) > 1 else None
+    try:
+        for path in paths:
+            if os.path.realpath(path) == os.path.realpath(archive_path):
+                continue
+            size_sql, compressed_sql = _value_sql(path)
+            try:
+                with database_pool.connection(path) as conn:
+                    for prefix in prefixes:
+                        for key, value, size, compressed in iter_prefixed_rows(
+                                conn, prefix, f"key, value, {size_sql}, {compressed_sql}"):
+                            if seen is not None:
+                                if key in seen:
+                                    stats.add("records_duplicate", 1)
+                                    value = None
+                                else:
+                                    seen.add(key)
+                            if value is not None:
+                                stats.add("bytes_read", len(value))
+                                writer.add(key, decompress_value(value), size or 0, compressed)
+                            count += 1
+                            if count % CACHE_FLUSH_SIZE == 0:
+                                if progress is not None:
+                                    progress(count)
+                                if cancelled is not None and cancelled():
+                                    return writer.summary()
+            except sqlite3.DatabaseError as e:
+                if len(paths) == 1:
+                    raise
+                stats.warn(f"Skipping {path}: {str(e)}")
+            writer.commit()
+    finally:
+        writer.close()
+        stats.add("records_archived", writer.added)
+        stats.add("records_unchanged", writer.unchanged)
+        stats.add("chunks_written", writer.chunks)
+        stats.add("bytes_stored", writer.stored_bytes)
+    return writer.summary()
@@ -0,0 +1,456 @@
+#!/usr/bin/env python3
+"""Local HTTP/JSON server over Cursor chat history, for dashboards and scripts.
+
+Chats are listed once at startup, kept in memory and answered from there.
+Databases are checked for changes at most every REFRESH_SECONDS, and only
+the ones that changed are rescanned, in the background, using the same
+metadata cache and full-text index as the viewer:
+
+    python cursor_chat_server.py [--db PATH ...] [--host 127.0.0.1] [--port 8765]
+
+Every endpoint takes GET and answers JSON:
+
+    /chats?limit=N&cursor=C    chats, newest first; pass next_cursor back for the next page
+                               filters: since, until (a date or an age like 7d), title (a prefix),
+                               min_size, max_size; order: sort=date|title|size|..., order=asc|desc
+    /chats/<chat id or key>    one chat with its content; ?format=text for a transcript
+    /search?q=QUERY&limit=N    full-text search, best match first, with snippets
+    /export[?q=QUERY]          every chat (or every match) with its content, streamed as JSON Lines
+    /status                    the databases served, the number of chats and when they were last scanned
+
+Errors come back as {"error": message} with a 4xx or 5xx status. Only the
+headless core and command line modules are imported, so no display or
+tkinter is needed.
+"""
+import os
+import sys
+import json
+import time
+import base64
+import asyncio
+import sqlite3
+import argparse
+import threading
+from collections import OrderedDict
+from urllib.parse import urlsplit, parse_qs, unquote
+
+from cursor_chat_core import (
+    DEFAULT_DB_PATH, SEARCH_LIMIT, database_pool, fetch_value, decompress_value,
+    refresh_sources, merge_chats, find_chats, chat_record, chat_export_record, format_chat_text,
+    record_fetcher, export_chats, Stats, SORT_COLUMNS, SortIndex, chat_sort_value, parse_time,
+)
+from cursor_chat_cli import add_database_arguments
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8765
+
+# Pages of /chats hold PAGE_SIZE chats unless ?limit asks for another number, up to PAGE_MAX
+PAGE_SIZE = 100
+PAGE_MAX = 1000
+
+# The databases are checked for changes at most this often, when a request comes in
+REFRESH_SECONDS = 2.0
+
+# Export lines waiting to be sent to a slow client before the export pauses
+EXPORT_QUEUE_LINES = 256
+
+# Search responses kept per listing, for dashboards that repeat the same queries
+SEARCH_CACHE_ITEMS = 256
+
+# Longest request line and headers accepted
+MAX_REQUEST_BYTES = 64 * 1024
+
+REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed", 500: "Internal Server Error"}
+
+class HttpError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+# What a cursor's value may be for each sort column
+_CURSOR_TYPES = {"date": (int, float), "title": str, "size": int, "messages": int, "source": str, "key": str}
+
+def encode_cursor(sort, reverse, sort_key):
+    # The order is part of the cursor so that it can't be used to page through another
+    return base64.urlsafe_b64encode(json.dumps([sort, reverse] + list(sort_key)).encode('utf-8')).decode('ascii')
+
+def decode_cursor(cursor, sort, reverse):
+    try:
+        cursor_sort, cursor_reverse, value, key = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+    except (ValueError, TypeError):
+        raise HttpError(400, f"Invalid cursor {cursor!r}")
+    if (cursor_sort, cursor_reverse) != (sort, reverse):
+        raise HttpError(400, "The cursor is for another sort order")
+    # The value is compared with the sort column's, so it must be of the same type
+    if isinstance(value, bool) or not isinstance(value, _CURSOR_TYPES[sort]) or not isinstance(key, str):
+        raise HttpError(400, f"Invalid cursor {cursor!r}")
+    return value, key
+
+class _Listing:
+    """A snapshot of the merged chat list, oldest first, with a SortIndex
+    over it for pages in any order and with filters. Search responses are
+    cached with it, and so go stale with it."""
+    
+    def __init__(self, sources, listings, signatures):
+        self.sources = sources
+        self.listings = listings
+        self.signatures = signatures
+        self.chats = merge_chats(listings[path] for path in sources if path in listings)
+        self.chats.sort(key=lambda chat: (chat_sort_value(chat, "date"), chat.key))
+        self.index = SortIndex(self.chats)
+        # Other orders are built when first asked for; this one is the default
+        self.index.order("date")
+        self.by_key = {chat.key: chat for chat in self.chats}
+        self.by_id = {chat.chat_id: chat for chat in self.chats}
+        self.scanned_at = time.time()
+        self.searches = OrderedDict()
+        self.searches_lock = threading.Lock()
+
+class ChatIndex:
+    """The chats of a set of databases, kept current in the background.
+    
+    Requests read whichever snapshot is current; a refresh builds a new one
+    and swaps it in, so readers never wait for a scan.
+    """
+    
+    def __init__(self, locations, key_prefix, use_cache=True):
+        self.locations = locations
+        self.key_prefix = key_prefix
+        self.use_cache = use_cache
+        self.listing = None
+        self.stats = None
+        self._refreshing = threading.Lock()
+        self._checked = 0.0
+    
+    def refresh(self):
+        """Rescan whatever changed since the last refresh. Blocks, so it runs off the event loop.
+        
+        Nothing awaits a background refresh, so failures are logged here
+        and the listing is left as it was until the next try, REFRESH_SECONDS
+        later. Databases that fail to scan are only retried once they change.
+        """
+        if not self._refreshing.acquire(blocking=False):
+            return
+        try:
+            stats = Stats("Refresh" if self.listing else "Load")
+            previous = self.listing
+            with stats.timer("refresh"):
+                sources, listings, signatures = refresh_sources(
+                    self.locations, self.key_prefix,
+                    previous.listings if previous else None, previous.signatures if previous else None,
+                    use_cache=self.use_cache, stats=stats)
+                if previous is None or sources != previous.sources or signatures != previous.signatures:
+                    self.listing = _Listing(sources, listings, signatures)
+            stats.finish()
+            self.stats = stats
+        except Exception as e:
+            print(f"Refresh failed: {type(e).__name__}: {str(e)}", file=sys.stderr)
+        finally:
+            self._checked = time.monotonic()
+            self._refreshing.release()
+    
+    def refresh_due(self):
+        return time.monotonic() - self._checked >= REFRESH_SECONDS and not self._refreshing.locked()
+    
+    def page(self, cursor, limit, sort="date", reverse=True, **filters):
+        """Return (chats, next cursor or None): up to limit chats matching
+        filters, as for SortIndex.query(), ordered by sort and starting after
+        the chat cursor points at."""
+        listing = self.listing
+        after = decode_cursor(cursor, sort, reverse) if cursor else None
+        # One more than asked for tells whether there is a next page
+        positions = listing.index.query(sort, reverse, after=after, limit=limit + 1, **filters)
+        chats = [listing.chats[position] for position in positions[:limit]]
+        if len(positions) <= limit:
+            return chats, None
+        return chats, encode_cursor(sort, reverse, listing.index.sort_key(positions[limit - 1], sort))
+    
+    def get(self, ident):
+        listing = self.listing
+        chat = listing.by_key.get(ident) or listing.by_id.get(ident)
+        if chat is None:
+            raise HttpError(404, f"No chat {ident!r}")
+        return chat
+
+def _int_param(query, name, default, maximum):
+    try:
+        value = int(query.get(name, [default])[0])
+    except ValueError:
+        raise HttpError(400, f"{name} must be a number")
+    if value < 1:
+        raise HttpError(400, f"{name} must be at least 1")
+    return min(value, maximum)
+
+def _filter_params(query):
+    """Read the sort order and filters of /chats as keyword arguments for ChatIndex.page()."""
+    params = {}
+    for name in ("since", "until"):
+        if name in query:
+            try:
+                params[name] = parse_time(query[name][0])
+            except ValueError as e:
+                raise HttpError(400, str(e))
+    for name in ("min_size", "max_size"):
+        if name in query:
+            try:
+                params[name] = int(query[name][0])
+            except ValueError:
+                raise HttpError(400, f"{name} must be a number")
+    if "title" in query:
+        params["title"] = query["title"][0]
+    sort = params["sort"] = query.get("sort", ["date"])[0]
+    if sort not in SORT_COLUMNS:
+        raise HttpError(400, f"sort must be one of {', '.join(SORT_COLUMNS)}")
+    order = query.get("order", ["desc" if sort == "date" else "asc"])[0]
+    if order not in ("asc", "desc"):
+        raise HttpError(400, "order must be asc or desc")
+    params["reverse"] = order == "desc"
+    return params
+
+def _json_body(data):
+    return "application/json", (json.dumps(data, ensure_ascii=False) + "\n").encode('utf-8')
+
+class ChatServer:
+    """Answers the HTTP requests in the module docstring from a ChatIndex.
+    
+    Requests are handled on the asyncio event loop, and anything that reads
+    a database, the cache or builds a large response runs on the loop's
+    thread pool, so slow requests don't hold up the others. Connections are
+    kept alive between HTTP/1.1 requests.
+    """
+    
+    def __init__(self, index):
+        self.index = index
+        self.loop = None
+    
+    async def serve(self, host, port):
+        self.loop = asyncio.get_running_loop()
+        server = await asyncio.start_server(self.handle_connection, host, port, limit=MAX_REQUEST_BYTES)
+        async with server:
+            await server.serve_forever()
+    
+    def run_blocking(self, function, *args):
+        return self.loop.run_in_executor(None, function, *args)
+    
+    async def handle_connection(self, reader, writer):
+        try:
+            while True:
+                try:
+                    head = await reader.readuntil(b"\r\n\r\n")
+                except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError):
+                    break
+                lines = head.decode('latin-1').split("\r\n")
+                try:
+                    method, target, version = lines[0].split(" ")
+                except ValueError:
+                    await self.send(writer, 400, *_json_body({"error": "Malformed request line"}), keep_alive=False)
+                    break
+                headers = {}
+                for line in lines[1:]:
+                    name, _, value = line.partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                keep_alive = version == "HTTP/1.1" and headers.get("connection", "").lower() != "close"
+                if headers.get("content-length", "0") != "0":
+                    # No endpoint takes a body; read past it to reach the next request
+                    await reader.readexactly(int(headers["content-length"]))
+                await self.respond(method, target, version, writer, keep_alive)
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass
+        finally:
+            writer.close()
+    
+    async def respond(self, method, target, version, writer, keep_alive):
+        if self.index.refresh_due():
+            # Refresh in the background; this request is answered from the current listing
+            self.run_blocking(self.index.refresh)
+        try:
+            if method != "GET":
+                raise HttpError(405, f"Method {method} not allowed")
+            url = urlsplit(target)
+            path = unquote(url.path).rstrip("/")
+            query = parse_qs(url.query)
+            if path == "/export":
+                await self.stream_export(query, version, writer, keep_alive)
+                return
+            if path == "/chats":
+                content_type, body = self.list_chats(query)
+            elif path.startswith("/chats/"):
+                content_type, body = await self.run_blocking(self.show_chat, path[len("/chats/"):], query)
+            elif path == "/search":
+                content_type, body = await self.run_blocking(self.search, query)
+            elif path == "/status":
+                content_type, body = self.status()
+            else:
+                raise HttpError(404, f"No endpoint {path or '/'}")
+            status = 200
+        except HttpError as e:
+            status, (content_type, body) = e.status, _json_body({"error": str(e)})
+        except ConnectionError:
+            raise
+        except (sqlite3.Error, OSError, UnicodeDecodeError) as e:
+            status, (content_type, body) = 500, _json_body({"error": str(e)})
+        except Exception as e:
+            # Anything unexpected still gets an answer rather than a dropped connection
+            status, (content_type, body) = 500, _json_body({"error": f"{type(e).__name__}: {str(e)}"})
+        await self.send(writer, status, content_type, body, keep_alive)
+    
+    async def send(self, writer, status, content_type, body, keep_alive):
+        writer.write((f"HTTP/1.1 {status} {REASONS[status]}\r\n"
+                      f"Content-Type: {content_type}; charset=utf-8\r\n"
+                      f"Content-Length: {len(body)}\r\n"
+                      f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n").encode('latin-1') + body)
+        await writer.drain()
+    
+    def list_chats(self, query):
+        # Served straight from memory, so it runs on the event loop
+        chats, next_cursor = self.index.page(query.get("cursor", [None])[0], _int_param(query, "limit", PAGE_SIZE, PAGE_MAX),
+                                             **_filter_params(query))
+        return _json_body({"chats": [chat_record(chat) for chat in chats], "next_cursor": next_cursor,
+                           "total": len(self.index.listing.chats)})
+    
+    def show_chat(self, ident, query):
+        chat = self.index.get(ident)
+        try:
+            with database_pool.connection(chat.source) as conn:
+                value = decompress_value(fetch_value(conn, chat.key))
+        except KeyError:
+            raise HttpError(404, f"Chat {ident!r} was deleted")
+        if query.get("format", ["json"])[0] == "text":
+            # Newer chats keep their messages in records of their own in the same database
+            return "text/plain", format_chat_text(value, record_fetcher(chat.source)).encode('utf-8')
+        return _json_body(chat_export_record(chat, value))
+    
+    def _matches(self, listing, query, limit):
+        terms = query.get("q", [""])[0]
+        if not terms:
+            raise HttpError(400, "Missing search query q")
+        matches = find_chats(listing.sources, self.index.key_prefix, terms, listing.chats, limit=limit)
+        return [(listing.by_key[key], snippet) for key, snippet in matches if key in listing.by_key]
+    
+    def search(self, query):
+        listing = self.index.listing
+        limit = _int_param(query, "limit", SEARCH_LIMIT, SEARCH_LIMIT)
+        cache_key = (query.get("q", [""])[0], limit)
+        with listing.searches_lock:
+            response = listing.searches.get(cache_key)
+            if response is not None:
+                listing.searches.move_to_end(cache_key)
+                return response
+        results = []
+        for chat, snippet in self._matches(listing, query, limit):
+            record = chat_record(chat)
+            record["snippet"] = snippet
+            results.append(record)
+        response = _json_body({"results": results})
+        with listing.searches_lock:
+            listing.searches[cache_key] = response
+            if len(listing.searches) > SEARCH_CACHE_ITEMS:
+                listing.searches.popitem(last=False)
+        return response
+    
+    def status(self):
+        listing = self.index.listing
+        stats = self.index.stats
+        return _json_body({
+            "sources": listing.sources,
+            "chats": len(listing.chats),
+            "key_prefix": self.index.key_prefix,
+            "scanned_at": listing.scanned_at,
+            "last_refresh": stats.as_dict() if stats else None,
+        })
+    
+    async def stream_export(self, query, version, writer, keep_alive):
+        """Send chats with their content as JSON Lines while export_chats()
+        writes them on a worker thread. A bounded queue keeps a slow client
+        from piling the whole export up in memory."""
+        listing = self.index.listing
+        if "q" in query:
+            chats = [chat for chat, _ in await self.run_blocking(self._matches, listing, query, len(listing.chats))]
+        else:
+            chats = listing.chats
+        queue = asyncio.Queue(EXPORT_QUEUE_LINES)
+        done = object()
+        stop = threading.Event()
+        
+        class QueueWriter:
+            lines = True
+            
+            def write(writer_self, name, data):
+                asyncio.run_coroutine_threadsafe(queue.put(data), self.loop).result()
+            
+            def close(writer_self):
+                pass
+        
+        def work():
+            try:
+                export_chats(chats, QueueWriter(), cancelled=stop.is_set)
+            finally:
+                asyncio.run_coroutine_threadsafe(queue.put(done), self.loop).result()
+        
+        # Without chunked encoding, HTTP/1.0 clients learn the export ended when the connection closes
+        chunked = version == "HTTP/1.1"
+        writer.write(("HTTP/1.1 200 OK\r\nContent-Type: application/x-ndjson; charset=utf-8\r\n"
+                      + ("Transfer-Encoding: chunked\r\n" if chunked else "")
+                      + f"Connection: {'keep-alive' if chunked and keep_alive else 'close'}\r\n\r\n").encode('latin-1'))
+        task = self.run_blocking(work)
+        try:
+            try:
+                while True:
+                    data = await queue.get()
+                    if data is done:
+                        break
+                    writer.write(b"%x\r\n%s\r\n" % (len(data), data) if chunked else data)
+                    await writer.drain()
+            finally:
+                stop.set()
+                # Let a blocked export finish its last write so the thread can end
+                while not task.done():
+                    while not queue.empty():
+                        queue.get_nowait()
+                    await asyncio.sleep(0.01)
+            await task
+        except ConnectionError:
+            raise
+        except Exception as e:
+            # The status line is long gone, so respond() must not answer with another;
+            # ending the response early is the only way to tell the client
+            print(f"Export failed: {type(e).__name__}: {str(e)}", file=sys.stderr)
+            raise ConnectionAbortedError(str(e)) from e
+        if chunked:
+            writer.write(b"0\r\n\r\n")
+            await writer.drain()
+        else:
+            raise ConnectionAbortedError("HTTP/1.0 export sent")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    add_database_arguments(parser)
+    parser.add_argument("--host", default=DEFAULT_HOST, help="address to listen on (default: %(default)s)")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT, help="port to listen on (default: %(default)s)")
+    args = parser.parse_args(argv)
+    locations = args.db or [DEFAULT_DB_PATH]
+    missing = [path for path in locations if not os.path.exists(path)]
+    if missing:
+        print(f"No database at {', '.join(missing)}", file=sys.stderr)
+        return 1
+    database_pool.immutable = args.immutable
+    
+    index = ChatIndex(locations, args.prefix, use_cache=not args.no_cache)
+    index.refresh()
+    if index.listing is None:
+        return 1
+    if not index.listing.sources:
+        print(f"No databases found in {', '.join(locations)}", file=sys.stderr)
+        return 1
+    print(f"Serving {len(index.listing.chats)} chats from {len(index.listing.sources)} databases "
+          f"on http://{args.host}:{args.port}", file=sys.stderr)
+    try:
+        asyncio.run(ChatServer(index).serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
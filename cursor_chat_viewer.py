@@ -1,13 +1,364 @@
 #!/usr/bin/env python3
 import os
-import sys
-import sqlite3
 import json
 import tkinter as tk
 from tkinter import ttk, messagebox, scrolledtext, filedialog
-from datetime import datetime
-import zlib
-import re
+import time
+import queue
+import threading
+from array import array
+from collections import OrderedDict
+
+from cursor_chat_core import (
+    DEFAULT_DB_PATH, DEFAULT_KEY_PREFIX, decompress_value, fetch_value,
+    scan_chats, db_signature, analyze_prefixes, format_size, find_chats, iter_formatted_value,
+    format_chat_text, open_export_writer, export_chats, discover_databases, scan_sources,
+    merge_chats, refresh_sources, source_label, database_pool, parse_conversation, iter_chat_text, record_fetcher,
+    Stats, write_stats_json, write_stats_trace, ARCHIVE_SUFFIX, ARCHIVE_PREFIXES, archive_chats,
+    SortIndex, chat_sort_value, parse_time,
+)
+
+# Background loads hand rows to the UI in chunks of this size, or sooner when decoding is slow
+LOAD_CHUNK_SIZE = 200
+LOAD_CHUNK_SECONDS = 0.05
+
+# How often the database files are checked for changes while auto-refresh is on
+AUTO_REFRESH_MS = 2000
+
+# How often the UI picks up results from background tasks, and how long it may spend doing so
+TASK_POLL_MS = 20
+TASK_POLL_BUDGET = 0.03
+
+# Rows materialized in the chat list beyond those in view, and the number assumed
+# to be in view before the list has been drawn
+LIST_RENDER_BUFFER = 5
+LIST_DEFAULT_ROWS = 30
+
+# Bounds for the in-memory cache of recently decoded chat values
+VALUE_CACHE_ITEMS = 32
+VALUE_CACHE_BYTES = 64 * 1024 * 1024
+
+# Bounds for the cache of formatted chats kept so that reselecting one is instant
+RENDER_CACHE_ITEMS = 16
+RENDER_CACHE_BYTES = 64 * 1024 * 1024
+
+# How often an open stats window shows the latest numbers
+STATS_REFRESH_MS = 500
+
+# Choices of the date filter above the chat list, with the age each keeps
+DATE_FILTERS = OrderedDict([
+    ("Any time", None),
+    ("Last 24 hours", "1d"),
+    ("Last 7 days", "7d"),
+    ("Last 30 days", "30d"),
+    ("Last year", "365d"),
+])
+
+class LRUCache:
+    """A small cache bounded by item count and total size that evicts the
+    least recently used entries first."""
+    
+    def __init__(self, max_items=VALUE_CACHE_ITEMS, max_bytes=VALUE_CACHE_BYTES):
+        self.max_items = max_items
+        self.max_bytes = max_bytes
+        self.total_bytes = 0
+        self._items = OrderedDict()
+    
+    def get(self, key):
+        item = self._items.get(key)
+        if item is None:
+            return None
+        self._items.move_to_end(key)
+        return item[0]
+    
+    def put(self, key, value):
+        size = len(value)
+        if size > self.max_bytes:
+            return
+        self.discard(key)
+        self._items[key] = (value, size)
+        self.total_bytes += size
+        while len(self._items) > self.max_items or self.total_bytes > self.max_bytes:
+            _, (_, old_size) = self._items.popitem(last=False)
+            self.total_bytes -= old_size
+    
+    def discard(self, key):
+        item = self._items.pop(key, None)
+        if item is not None:
+            self.total_bytes -= item[1]
+    
+    def clear(self):
+        self._items.clear()
+        self.total_bytes = 0
+
+def read_chat_value(chat):
+    """Read a chat's value from its source database, with zlib compression
+    removed. Safe to call from any thread."""
+    with database_pool.connection(chat.source) as conn:
+        return decompress_value(fetch_value(conn, chat.key))
+
+class BackgroundTask:
+    """Runs work(task) on a daemon thread so the Tk mainloop never blocks.
+    
+    The worker never touches widgets itself. It hands results back with
+    task.post(callback, *args), and the callbacks run on the Tk thread, picked
+    up from a queue by root.after polling. Once cancel() is called, nothing
+    else the worker posts is delivered, and the worker should stop at its next
+    check of task.cancelled.
+    """
+    
+    def __init__(self, root, work, on_error=None):
+        self.root = root
+        self.on_error = on_error
+        self._queue = queue.Queue()
+        self._cancelled = threading.Event()
+        self._thread = threading.Thread(target=self._run, args=(work,), daemon=True)
+    
+    @property
+    def cancelled(self):
+        return self._cancelled.is_set()
+    
+    def start(self):
+        self._thread.start()
+        self.root.after(TASK_POLL_MS, self._poll)
+        return self
+    
+    def cancel(self):
+        self._cancelled.set()
+    
+    def post(self, callback, *args):
+        if not self.cancelled:
+            self._queue.put((callback, args))
+    
+    def _run(self, work):
+        try:
+            work(self)
+        except Exception as e:
+            if self.on_error is not None:
+                self.post(self.on_error, e)
+        finally:
+            self._queue.put(None)
+    
+    def _poll(self):
+        deadline = time.monotonic() + TASK_POLL_BUDGET
+        while time.monotonic() < deadline:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is None:
+                return  # The worker is done
+            if not self.cancelled:
+                callback, args = item
+                callback(*args)
+        self.root.after(TASK_POLL_MS, self._poll)
+
+class VirtualChatList:
+    """A Treeview that only materializes the rows in view.
+    
+    The display order is a compact array of chat_data indices, and only the
+    window of rows the scrollbar points at (plus a small buffer) exists as
+    Treeview items, so scrolling and sorting stay interactive however many
+    chats there are. Items use their chat_data index as iid, and selection(),
+    selection_set(), selection_remove() and see() behave like the Treeview
+    methods of the same name.
+    
+    Column names are columns of SortIndex, and sorting takes its order from
+    the SortIndex that sort_index() returns for the current chat_data, so
+    the list sorts the same way as the command line and the server.
+    """
+    
+    def __init__(self, parent, columns, row_values, sort_index, on_select, default_sort=("date", True)):
+        self.row_values = row_values
+        self.sort_index = sort_index
+        self.on_select = on_select
+        # The order chat_data is kept in, used for filters while no column is sorted
+        self.default_sort = default_sort
+        self.labels = {name: text for name, text, _ in columns}
+        
+        self.tree = ttk.Treeview(parent, columns=list(self.labels), show="headings", selectmode="browse")
+        for name, text, width in columns:
+            self.tree.heading(name, text=text, command=lambda column=name: self.sort_by(column))
+            self.tree.column(name, width=width)
+        self.tree.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+        
+        self.scrollbar = ttk.Scrollbar(parent, orient=tk.VERTICAL, command=self._on_scrollbar)
+        self.scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+        
+        self.rows = array('l')
+        self.offset = 0
+        self.selected = None
+        self.showing_all = True
+        self.filters = None
+        self.sort_column = None
+        self.sort_reverse = False
+        
+        self.tree.bind("<<TreeviewSelect>>", self._on_tree_select)
+        self.tree.bind("<Configure>", lambda e: self._render())
+        for sequence in ("<MouseWheel>", "<Button-4>", "<Button-5>"):
+            self.tree.bind(sequence, self._on_wheel)
+        for sequence in ("<Up>", "<Down>", "<Prior>", "<Next>", "<Home>", "<End>"):
+            self.tree.bind(sequence, self._on_key)
+    
+    def show_all(self, count):
+        """Show every one of count chats, in the current sort order."""
+        self.showing_all = True
+        self.filters = None
+        self.rows = self._sorted_rows(array('l', range(count)))
+        self._render()
+    
+    def append_rows(self, indices):
+        """Add rows at the end while data is still loading."""
+        self.rows.extend(indices)
+        self._render()
+    
+    def set_rows(self, indices):
+        """Show just the given chats (for example search results), in the
+        current sort order, or in the order given while no column is sorted."""
+        self.showing_all = False
+        self.filters = None
+        self.rows = self._sorted_rows(array('l', indices))
+        self.offset = 0
+        self._render()
+    
+    def show_matching(self, **filters):
+        """Show the chats matching filters, as for SortIndex.query(), in the current sort order."""
+        self.showing_all = False
+        self.filters = filters
+        self.rows = self._sorted_rows(None)
+        self.offset = 0
+        self._render()
+    
+    def sort_by(self, column):
+        """Sort by column, or toggle its direction when it is already sorted
+        by. None goes back to the order rows were given in."""
+        if column is not None and column == self.sort_column:
+            self.sort_reverse = not self.sort_reverse
+        else:
+            self.sort_column, self.sort_reverse = column, False
+        for name, text in self.labels.items():
+            arrow = (" \u25bc" if self.sort_reverse else " \u25b2") if name == column else ""
+            self.tree.heading(name, text=text + arrow)
+        if column is None:
+            return
+        self.rows = self._sorted_rows(self.rows)
+        if self.selected is not None:
+            self._scroll_to(self._position(self.selected))
+        self._render()
+    
+    def _sorted_rows(self, rows):
+        # Every order comes from the index: whole columns, ranges of them, or ranks for other subsets
+        column, reverse = (self.sort_column, self.sort_reverse) if self.sort_column else self.default_sort
+        if self.filters is not None:
+            return array('l', self.sort_index().query(column, reverse, **self.filters))
+        if self.sort_column is None:
+            return rows
+        if self.showing_all:
+            ascending = self.sort_index().order(column)[0]
+            return array('l', reversed(ascending) if reverse else ascending)
+        return array('l', sorted(rows, key=self.sort_index().rank(column).__getitem__, reverse=reverse))
+    
+    # Treeview-compatible selection interface
+    
+    def selection(self):
+        return () if self.selected is None else (str(self.selected),)
+    
+    def selection_set(self, iid):
+        self.selected = int(iid)
+        self._render()
+    
+    def selection_remove(self, *items):
+        self.selected = None
+        self.tree.selection_remove(self.tree.selection())
+    
+    def see(self, iid):
+        self._scroll_to(self._position(int(iid)))
+        self._render()
+    
+    # Rendering and scrolling
+    
+    def _position(self, index):
+        try:
+            return self.rows.index(index)
+        except ValueError:
+            return None
+    
+    def _visible_count(self):
+        height = self.tree.winfo_height()
+        children = self.tree.get_children()
+        box = self.tree.bbox(children[0]) if children else None
+        if height <= 1 or not box:
+            return LIST_DEFAULT_ROWS
+        top, row_height = box[1], box[3]
+        return max(1, (height - top) // max(1, row_height))
+    
+    def _scroll_to(self, position):
+        if position is None:
+            return
+        visible = self._visible_count()
+        if position < self.offset:
+            self.offset = position
+        elif position >= self.offset + visible:
+            self.offset = position - visible + 1
+    
+    def _render(self):
+        visible = self._visible_count()
+        total = len(self.rows)
+        self.offset = max(0, min(self.offset, total - visible))
+        window = self.rows[self.offset:self.offset + visible + LIST_RENDER_BUFFER]
+        
+        self.tree.delete(*self.tree.get_children())
+        for index in window:
+            self.tree.insert("", tk.END, iid=str(index), values=self.row_values(index))
+        if self.selected is not None and self.selected in window:
+            self.tree.selection_set(str(self.selected))
+        self.tree.yview_moveto(0)
+        
+        if total:
+            self.scrollbar.set(self.offset / total, min(1.0, (self.offset + visible) / total))
+        else:
+            self.scrollbar.set(0.0, 1.0)
+    
+    def _scroll(self, rows):
+        self.offset += rows
+        self._render()
+    
+    def _on_scrollbar(self, action, amount, unit=None):
+        if action == "moveto":
+            self.offset = int(float(amount) * len(self.rows))
+            self._render()
+        elif action == "scroll":
+            step = self._visible_count() if unit == "pages" else 1
+            self._scroll(int(amount) * step)
+    
+    def _on_wheel(self, event):
+        if event.num == 4 or getattr(event, "delta", 0) > 0:
+            self._scroll(-3)
+        else:
+            self._scroll(3)
+        return "break"
+    
+    def _on_key(self, event):
+        if not self.rows:
+            return "break"
+        position = self._position(self.selected) if self.selected is not None else None
+        if position is None:
+            position = self.offset - 1
+        page = self._visible_count()
+        steps = {"Up": -1, "Down": 1, "Prior": -page, "Next": page, "Home": -len(self.rows), "End": len(self.rows)}
+        position = max(0, min(len(self.rows) - 1, position + steps[event.keysym]))
+        self.selected = self.rows[position]
+        self._scroll_to(position)
+        self._render()
+        self.on_select(event)
+        return "break"
+    
+    def _on_tree_select(self, event):
+        items = self.tree.selection()
+        if not items or int(items[0]) == self.selected:
+            return  # Just the selection being redrawn
+        self.selected = int(items[0])
+        self.on_select(event)
 
 class CursorChatViewer:
     def __init__(self, root):
@@ -17,12 +368,37 @@ class CursorChatViewer:
         self.root.minsize(800, 600)
         
         # Set the default database path
-        self.default_path = os.path.expanduser("~/Library/Application Support/Cursor/User/globalStorage/state.vscdb")
+        self.default_path = DEFAULT_DB_PATH
         
         self.db_path = tk.StringVar(value=self.default_path)
-        self.key_prefix = tk.StringVar(value="composerData:")
+        self.key_prefix = tk.StringVar(value=DEFAULT_KEY_PREFIX)
+        self.auto_refresh = tk.BooleanVar(value=True)
+        self.chat_view = tk.BooleanVar(value=False)
         self.setup_ui()
         self.chat_data = []
+        self.loaded_db_path = None
+        self.value_cache = LRUCache()
+        self.render_cache = LRUCache(RENDER_CACHE_ITEMS, RENDER_CACHE_BYTES)
+        self.render_task = None
+        self.load_task = None
+        self.search_task = None
+        self.loaded_prefix = ""
+        self.loaded_sources = []
+        self.source_chats = {}
+        self.loaded_signature = {}
+        self.refresh_task = None
+        self.search_snippets = {}
+        # Built from chat_data when a date filter first needs it
+        self.sort_index = None
+        # Stats of the latest operation of each kind, most recent last
+        self.stats = OrderedDict()
+        self.stats_dialog = None
+        
+        # Changing the prefix makes a load that is still running pointless
+        self.key_prefix.trace_add("write", lambda *args: self.cancel_load())
+        
+        # Pick up chats Cursor writes while we are open
+        self.root.after(AUTO_REFRESH_MS, self._poll_db_changes)
         
     def setup_ui(self):
         # Main frame 
@@ -36,7 +412,10 @@ class CursorChatViewer:
         ttk.Label(path_frame, text="Database Path:").pack(side=tk.LEFT, padx=(0, 5))
         ttk.Entry(path_frame, textvariable=self.db_path, width=50).pack(side=tk.LEFT, fill=tk.X, expand=True)
         ttk.Button(path_frame, text="Browse", command=self.browse_db).pack(side=tk.LEFT, padx=5)
+        ttk.Button(path_frame, text="Folder", command=self.browse_folder).pack(side=tk.LEFT)
         ttk.Button(path_frame, text="Connect", command=self.load_chats).pack(side=tk.LEFT, padx=5)
+        ttk.Button(path_frame, text="Refresh", command=self.refresh_chats).pack(side=tk.LEFT, padx=5)
+        ttk.Checkbutton(path_frame, text="Auto-refresh", variable=self.auto_refresh).pack(side=tk.LEFT, padx=5)
         
         # Key prefix frame
         prefix_frame = ttk.Frame(main_frame)
@@ -48,6 +427,8 @@ class CursorChatViewer:
         prefix_combo.pack(side=tk.LEFT)
         ttk.Label(prefix_frame, text="(Leave empty to show all keys)").pack(side=tk.LEFT, padx=(5, 0))
         ttk.Button(prefix_frame, text="Analyze DB", command=self.analyze_db).pack(side=tk.LEFT, padx=10)
+        ttk.Button(prefix_frame, text="Archive", command=self.archive_db).pack(side=tk.LEFT, padx=(0, 10))
+        ttk.Button(prefix_frame, text="Stats", command=self.show_stats).pack(side=tk.LEFT)
         
         # Split view with a panedwindow
         paned = ttk.PanedWindow(main_frame, orient=tk.HORIZONTAL)
@@ -71,24 +452,23 @@ class CursorChatViewer:
         
         ttk.Button(list_control_frame, text="🔍", width=3, command=self.search_chats).pack(side=tk.LEFT, padx=5)
         
+        self.date_filter = tk.StringVar(value=next(iter(DATE_FILTERS)))
+        date_combo = ttk.Combobox(list_control_frame, textvariable=self.date_filter, values=list(DATE_FILTERS),
+                                  state="readonly", width=13)
+        date_combo.pack(side=tk.LEFT)
+        date_combo.bind("<<ComboboxSelected>>", lambda e: self.apply_date_filter())
+        
         # Chat list with scrollbar
         list_frame = ttk.Frame(left_frame)
         list_frame.pack(fill=tk.BOTH, expand=True)
         
-        self.chat_list = ttk.Treeview(list_frame, columns=("id", "date", "title"), show="headings")
-        self.chat_list.heading("id", text="ID")
-        self.chat_list.heading("date", text="Date")
-        self.chat_list.heading("title", text="Title")
-        self.chat_list.column("id", width=50)
-        self.chat_list.column("date", width=120)
-        self.chat_list.column("title", width=200)
-        self.chat_list.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
-        
-        scrollbar = ttk.Scrollbar(list_frame, orient=tk.VERTICAL, command=self.chat_list.yview)
-        scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
-        self.chat_list.configure(yscrollcommand=scrollbar.set)
-        
-        self.chat_list.bind("<<TreeviewSelect>>", self.on_chat_select)
+        # Only the rows in view are materialized, so this stays fast with any number of chats
+        self.chat_list = VirtualChatList(
+            list_frame,
+            columns=[("key", "ID", 50), ("date", "Date", 120), ("title", "Title", 200), ("source", "Source", 80)],
+            row_values=self.chat_row_values,
+            sort_index=self._sort_index,
+            on_select=self.on_chat_select)
         
         # Right frame - Chat content
         right_frame = ttk.Frame(paned, padding="5")
@@ -100,6 +480,9 @@ class CursorChatViewer:
         
         ttk.Button(content_control_frame, text="Export JSON", command=self.export_json).pack(side=tk.LEFT, padx=5)
         ttk.Button(content_control_frame, text="Export Text", command=self.export_text).pack(side=tk.LEFT, padx=5)
+        ttk.Button(content_control_frame, text="Export All", command=self.export_all).pack(side=tk.LEFT, padx=5)
+        ttk.Checkbutton(content_control_frame, text="Format as Chat", variable=self.chat_view,
+                        command=lambda: self.on_chat_select(None)).pack(side=tk.RIGHT, padx=5)
         
         # Text area with scrollbar
         self.content_text = scrolledtext.ScrolledText(right_frame, wrap=tk.WORD, font=("Courier New", 11))
@@ -117,163 +500,336 @@ class CursorChatViewer:
     def browse_db(self):
         db_path = filedialog.askopenfilename(
             title="Select Cursor Database",
-            filetypes=[("SQLite Database", "*.vscdb"), ("All Files", "*.*")],
+            filetypes=[("SQLite Database", "*.vscdb"), ("Chat Archive", f"*{ARCHIVE_SUFFIX}"), ("All Files", "*.*")],
             initialdir=os.path.dirname(self.db_path.get())
         )
         if db_path:
             self.db_path.set(db_path)
     
+    def browse_folder(self):
+        """Pick a folder to load every database in, such as Cursor's User
+        folder (all workspaces) or a folder of backups."""
+        folder = filedialog.askdirectory(
+            title="Select a Folder of Cursor Databases",
+            initialdir=os.path.dirname(self.db_path.get())
+        )
+        if folder:
+            self.db_path.set(folder)
+    
     def search_chats(self):
-        search_term = self.search_var.get().lower()
-        if not search_term or search_term == "search...":
+        query = self.search_var.get().strip()
+        if query == "Search...":
+            query = ""
+        
+        if self.search_task is not None:
+            self.search_task.cancel()
+        if not query:
+            # An empty search shows every chat again
+            if self.search_snippets:
+                self.search_snippets = {}
+                self.apply_date_filter()
             return
         
         # Clear current selection
         self.chat_list.selection_remove(self.chat_list.selection())
         
-        for i, (chat_id, date_str, key, value, title) in enumerate(self.chat_data):
-            # Try to get content as text
+        chats = list(self.chat_data)
+        sources = list(self.loaded_sources)
+        key_prefix = self.loaded_prefix
+        stats = self._start_stats("Search")
+        
+        def work(task):
             try:
-                if value[:2] == b'x\x9c':
-                    text_content = zlib.decompress(value).decode('utf-8', errors='ignore')
-                else:
-                    text_content = value.decode('utf-8', errors='ignore')
-                
-                if (search_term in text_content.lower() or 
-                    search_term in chat_id.lower() or 
-                    search_term in title.lower()):
-                    self.chat_list.see(str(i))
-                    self.chat_list.selection_set(str(i))
-                    # Show the content
-                    self.on_chat_select(None)
-                    return  # Stop at first match
-            except Exception:
-                continue
-        
-        messagebox.showinfo("Search", "No matches found.")
-    
-    def extract_date_from_json(self, json_str):
-        try:
-            data = json.loads(json_str)
-            # Look for timestamp or date fields
-            if isinstance(data, dict):
-                for key in ['createdAt', 'timestamp', 'date', 'time']:
-                    if key in data and data[key]:
-                        try:
-                            # Try to parse as timestamp (seconds or milliseconds)
-                            timestamp = int(data[key])
-                            if timestamp > 1000000000000:  # milliseconds
-                                timestamp /= 1000
-                            return datetime.fromtimestamp(timestamp).strftime("%Y-%m-%d %H:%M")
-                        except:
-                            # Try to parse as string
-                            if isinstance(data[key], str) and len(data[key]) > 5:
-                                return data[key]
-            
-            # Try to find any messages with timestamps
-            if isinstance(data, dict) and 'messages' in data and isinstance(data['messages'], list) and data['messages']:
-                first_msg = data['messages'][0]
-                if isinstance(first_msg, dict) and 'timestamp' in first_msg:
-                    timestamp = int(first_msg['timestamp'])
-                    if timestamp > 1000000000000:  # milliseconds
-                        timestamp /= 1000
-                    return datetime.fromtimestamp(timestamp).strftime("%Y-%m-%d %H:%M")
-        except:
-            pass
-        return "Unknown"
-    
-    def extract_title_from_json(self, json_str):
-        try:
-            data = json.loads(json_str)
-            # Look for title fields
-            if isinstance(data, dict):
-                for key in ['title', 'name', 'subject']:
-                    if key in data and data[key] and isinstance(data[key], str):
-                        return data[key][:40]  # Truncate long titles
-                
-                # Try to extract from first message
-                if 'messages' in data and isinstance(data['messages'], list) and data['messages']:
-                    first_msg = data['messages'][0]
-                    if isinstance(first_msg, dict) and 'content' in first_msg and isinstance(first_msg['content'], str):
-                        # Extract first line or first N characters
-                        content = first_msg['content']
-                        first_line = content.split('\n')[0]
-                        return first_line[:40] + ('...' if len(first_line) > 40 else '')
-        except:
-            pass
-        return ""
+                results = find_chats(sources, key_prefix, query, chats, cancelled=lambda: task.cancelled, stats=stats)
+            finally:
+                stats.finish()
+            task.post(self._show_search_results, query, results)
+        
+        self.status_var.set("Searching...")
+        self.search_task = BackgroundTask(
+            self.root, work, on_error=lambda e: self.status_var.set(f"Error: {str(e)}")).start()
+    
+    def _show_search_results(self, query, results):
+        positions = {chat.key: i for i, chat in enumerate(self.chat_data)}
+        since = self._date_filter_since()
+        indices = [positions[key] for key, _ in results if key in positions and self._is_since(positions[key], since)]
+        if not indices:
+            self.status_var.set("No matches found.")
+            messagebox.showinfo("Search", "No matches found.")
+            return
+        
+        # List only the matches, best first, and show the best one
+        self.search_snippets = dict(results)
+        self.chat_list.sort_by(None)
+        self.chat_list.set_rows(indices)
+        self.chat_list.see(str(indices[0]))
+        self.chat_list.selection_set(str(indices[0]))
+        self.on_chat_select(None)
+        matches = "match" if len(indices) == 1 else "matches"
+        self.status_var.set(f"{len(indices)} {matches} for {query!r} (search for nothing to show all chats)")
+    
+    def _date_filter_since(self):
+        age = DATE_FILTERS.get(self.date_filter.get())
+        return parse_time(age) if age else None
+    
+    def _is_since(self, index, since):
+        return since is None or chat_sort_value(self.chat_data[index], "date") >= since
+    
+    def _sort_index(self):
+        if self.sort_index is None:
+            self.sort_index = SortIndex(self.chat_data)
+        return self.sort_index
+    
+    def apply_date_filter(self):
+        """Show the chats from the period picked in the date filter, or just
+        the search results from it while a search is shown."""
+        since = self._date_filter_since()
+        if self.search_snippets:
+            positions = {chat.key: i for i, chat in enumerate(self.chat_data)}
+            indices = [positions[key] for key in self.search_snippets
+                       if key in positions and self._is_since(positions[key], since)]
+            self.chat_list.set_rows(indices)
+            matches = "match" if len(indices) == 1 else "matches"
+            self.status_var.set(f"{len(indices)} {matches} from {self.date_filter.get().lower()}")
+        elif since is None:
+            self.chat_list.show_all(len(self.chat_data))
+            self.status_var.set(f"Showing all {len(self.chat_data)} chat records")
+        else:
+            # A range of the date order, sorted by whichever column is
+            self.chat_list.show_matching(since=since)
+            self.status_var.set(f"Showing {len(self.chat_list.rows)} of {len(self.chat_data)} chat records "
+                                f"from {self.date_filter.get().lower()}")
+    
+    def get_chat_value(self, chat):
+        """Return the chat's value with zlib compression removed, reading it
+        from its source database unless it was used recently."""
+        value = self.value_cache.get(chat.key)
+        if value is None:
+            value = read_chat_value(chat)
+            self.value_cache.put(chat.key, value)
+        return value
     
     def load_chats(self):
-        try:
-            # Clear existing data
-            self.chat_list.delete(*self.chat_list.get_children())
-            self.content_text.delete(1.0, tk.END)
-            self.chat_data = []
-            
-            # Connect to the database
-            conn = sqlite3.connect(self.db_path.get())
-            cursor = conn.cursor()
-            
-            # Query all chat records
-            cursor.execute("SELECT key, value FROM cursorDiskKV")
-            rows = cursor.fetchall()
-            
-            # Get the key prefix to filter by
-            key_prefix = self.key_prefix.get()
-            
-            # Filter and process chat records
-            chat_rows = []
-            for key, value in rows:
-                # Only include items that match the prefix (or all if prefix is empty)
-                if not key_prefix or key.startswith(key_prefix):
-                    try:
-                        # Remove prefix from chat_id if it exists
-                        if key_prefix and key.startswith(key_prefix):
-                            chat_id = key.replace(key_prefix, '')
-                        else:
-                            chat_id = key
-                        
-                        # Try to decompress and extract metadata
-                        try:
-                            # Check if value is a string already
-                            if isinstance(value, str):
-                                json_str = value
-                                date_str = self.extract_date_from_json(json_str)
-                                title = self.extract_title_from_json(json_str)
-                            else:
-                                if value[:2] == b'x\x9c':  # zlib magic number
-                                    decompressed = zlib.decompress(value)
-                                    json_str = decompressed.decode('utf-8', errors='ignore')
-                                    date_str = self.extract_date_from_json(json_str)
-                                    title = self.extract_title_from_json(json_str)
-                                else:
-                                    json_str = value.decode('utf-8', errors='ignore')
-                                    date_str = self.extract_date_from_json(json_str)
-                                    title = self.extract_title_from_json(json_str)
-                        except:
-                            date_str = "Unknown"
-                            title = ""
-                        
-                        chat_rows.append((chat_id, date_str, key, value, title))
-                    except Exception as e:
-                        # Skip records that can't be processed
-                        print(f"Error processing record {key}: {str(e)}")
-                        pass
-            
-            # Sort by date (most recent first) if date is available
-            chat_rows.sort(key=lambda x: x[1] if x[1] != "Unknown" else "", reverse=True)
-            self.chat_data = chat_rows
-            
-            # Add to treeview
-            for i, (chat_id, date_str, key, _, title) in enumerate(chat_rows):
-                self.chat_list.insert("", tk.END, values=(chat_id, date_str, title), iid=str(i))
-            
-            self.status_var.set(f"Loaded {len(chat_rows)} chat records")
-            
-            conn.close()
-        except Exception as e:
-            self.status_var.set(f"Error: {str(e)}")
-            messagebox.showerror("Error", f"Failed to load chat records: {str(e)}")
+        # Stop whatever the previous Connect, refresh or search was still doing
+        self.cancel_load()
+        for task in (self.search_task, self.refresh_task):
+            if task is not None:
+                task.cancel()
+        self.refresh_task = None
+        
+        # Clear existing data
+        self.chat_list.selection_remove()
+        self.clear_content()
+        self.chat_data = []
+        self.sort_index = None
+        self.chat_list.show_all(0)
+        self.value_cache.clear()
+        self.render_cache.clear()
+        self.search_snippets = {}
+        
+        # The path may name several databases or folders, separated like PATH entries
+        db_path = self.db_path.get()
+        key_prefix = self.key_prefix.get()
+        self.loaded_db_path = db_path
+        self.loaded_prefix = key_prefix
+        self.loaded_sources = []
+        self.source_chats = {}
+        self.loaded_signature = {}
+        self.status_var.set("Loading chat records...")
+        stats = self._start_stats("Load")
+        self.load_task = BackgroundTask(
+            self.root, lambda task: self._load_chats_worker(task, db_path, key_prefix, stats),
+            on_error=self._load_failed).start()
+    
+    def cancel_load(self):
+        if self.load_task is not None and not self.load_task.cancelled:
+            self.load_task.cancel()
+            self.stats["Load"].finish()
+            self.status_var.set(f"Loading cancelled after {len(self.chat_data)} chat records")
+        # A cancelled worker posts nothing more, so it would never clear this itself
+        self.load_task = None
+    
+    def _load_chats_worker(self, task, db_path, key_prefix, stats):
+        locations = db_path.split(os.pathsep)
+        missing = [path for path in locations if not os.path.exists(path)]
+        if missing:
+            raise FileNotFoundError(f"No database at {', '.join(missing)}")
+        with stats.timer("discover"):
+            sources = discover_databases(locations)
+            if not sources:
+                raise FileNotFoundError(f"No databases found in {db_path}")
+            signatures = {path: db_signature(path) for path in sources}
+        
+        if len(sources) == 1:
+            chats = []
+            chunk = []
+            last_post = time.monotonic()
+            scanner = scan_chats(sources[0], key_prefix, stats=stats)
+            try:
+                for chat in scanner:
+                    if task.cancelled:
+                        return
+                    chats.append(chat)
+                    chunk.append(chat)
+                    # Hand rows over as they are decoded so the first chats show up right away
+                    if len(chunk) >= LOAD_CHUNK_SIZE or time.monotonic() - last_post >= LOAD_CHUNK_SECONDS:
+                        task.post(self._add_chat_rows, chunk, stats)
+                        chunk = []
+                        last_post = time.monotonic()
+            finally:
+                scanner.close()
+            task.post(self._add_chat_rows, chunk, stats)
+            listings = {sources[0]: chats}
+        else:
+            # Chats are merged across databases, so rows are shown once all are scanned
+            listings = {}
+            scanner = scan_sources(sources, key_prefix, stats=stats)
+            try:
+                for path, chats in scanner:
+                    if task.cancelled:
+                        return
+                    listings[path] = chats
+                    task.post(self.status_var.set, f"Loading... scanned {len(listings)} of {len(sources)} databases")
+            finally:
+                scanner.close()
+            with stats.timer("merge"):
+                merged = merge_chats(listings[path] for path in sources if path in listings)
+            task.post(self._add_chat_rows, merged, stats)
+        task.post(self._finish_load, sources, listings, signatures, stats)
+    
+    def _add_chat_rows(self, rows, stats):
+        # Time spent on the Tk thread, including the Treeview updates
+        with stats.timer("ui.rows"):
+            start = len(self.chat_data)
+            self.chat_data.extend(rows)
+            self.sort_index = None
+            self.chat_list.append_rows(range(start, len(self.chat_data)))
+            self.status_var.set(f"Loading... {len(self.chat_data)} chat records")
+    
+    def _finish_load(self, sources, listings, signatures, stats):
+        self.loaded_sources = sources
+        self.source_chats = listings
+        self.loaded_signature = signatures
+        self.search_snippets = {}
+        with stats.timer("ui.sort"):
+            self._show_sorted_chats(self._selected_key())
+        stats.finish()
+        if len(sources) == 1:
+            self.status_var.set(f"Loaded {len(self.chat_data)} chat records")
+        else:
+            self.status_var.set(f"Loaded {len(self.chat_data)} chat records from {len(listings)} databases")
+        self.load_task = None
+    
+    def _selected_key(self):
+        selected = self.chat_list.selection()
+        return self.chat_data[int(selected[0])].key if selected else None
+    
+    def _show_sorted_chats(self, selected_key):
+        """Re-sort chat_data after it changed and show it, keeping the
+        selection and any search results."""
+        # Most recent first, chats without a date last
+        self.chat_data.sort(key=lambda x: (chat_sort_value(x, "date"), x.key), reverse=True)
+        self.sort_index = None
+        positions = {chat.key: i for i, chat in enumerate(self.chat_data)}
+        
+        self.chat_list.selection_remove()
+        self.chat_list.show_all(len(self.chat_data))
+        since = self._date_filter_since()
+        if self.search_snippets:
+            # Keep showing just the search results, best match first
+            self.chat_list.set_rows([positions[key] for key in self.search_snippets
+                                     if key in positions and self._is_since(positions[key], since)])
+        elif since is not None:
+            self.chat_list.show_matching(since=since)
+        if selected_key in positions:
+            self.chat_list.selection_set(str(positions[selected_key]))
+            self.chat_list.see(str(positions[selected_key]))
+    
+    def refresh_chats(self):
+        """Patch the chat list with records added, changed or removed since the last load."""
+        if not self.loaded_db_path:
+            self.load_chats()
+            return
+        if self.load_task is not None or self.refresh_task is not None:
+            return
+        
+        db_path = self.loaded_db_path
+        key_prefix = self.loaded_prefix
+        known = list(self.chat_data)
+        listings = dict(self.source_chats)
+        signatures = dict(self.loaded_signature)
+        stats = self._start_stats("Refresh")
+        
+        def work(task):
+            try:
+                result = self._refresh_worker(db_path, key_prefix, known, listings, signatures, stats)
+            finally:
+                stats.finish()
+            task.post(self._apply_refresh, *result)
+        
+        self.refresh_task = BackgroundTask(self.root, work, on_error=self._refresh_failed).start()
+    
+    def _refresh_worker(self, db_path, key_prefix, known, listings, signatures, stats):
+        """Rescan the databases that changed since signatures were taken, and
+        any that have appeared, and return (new or changed ChatMeta, removed
+        keys) relative to known, along with the new sources, per-database
+        listings and signatures."""
+        # Unchanged records come back as the same objects, so rescanning costs one listing query
+        sources, listings, new_signatures = refresh_sources(
+            db_path.split(os.pathsep), key_prefix, listings, signatures, stats=stats)
+        
+        previous = {chat.key: chat for chat in known}
+        merged = merge_chats(listings[path] for path in sources if path in listings)
+        changed = [chat for chat in merged if previous.get(chat.key) is not chat]
+        seen = {chat.key for chat in merged}
+        removed = [key for key in previous if key not in seen]
+        return changed, removed, sources, listings, new_signatures
+    
+    def _apply_refresh(self, changed, removed, sources, listings, signatures):
+        self.refresh_task = None
+        self.loaded_sources = sources
+        self.source_chats = listings
+        self.loaded_signature = signatures
+        if not changed and not removed:
+            return
+        
+        existing = {chat.key for chat in self.chat_data}
+        dropped = {chat.key for chat in changed} | set(removed)
+        added = sum(1 for chat in changed if chat.key not in existing)
+        for key in dropped:
+            self.value_cache.discard(key)
+            self.render_cache.discard((key, False))
+            self.render_cache.discard((key, True))
+        
+        selected_key = self._selected_key()
+        self.chat_data = [chat for chat in self.chat_data if chat.key not in dropped] + changed
+        self._show_sorted_chats(selected_key)
+        if selected_key in removed:
+            self.clear_content()
+        elif selected_key in dropped:
+            # Show the new content of the chat being viewed
+            self.on_chat_select(None)
+        self.status_var.set(f"Refreshed: {added} new, {len(changed) - added} updated, {len(removed)} removed")
+    
+    def _refresh_failed(self, e):
+        self.refresh_task = None
+        self.status_var.set(f"Refresh failed: {str(e)}")
+    
+    def _poll_db_changes(self):
+        if (self.auto_refresh.get() and self.loaded_signature and self.load_task is None and self.refresh_task is None
+                and any(db_signature(path) != signature for path, signature in self.loaded_signature.items())):
+            self.refresh_chats()
+        self.root.after(AUTO_REFRESH_MS, self._poll_db_changes)
+    
+    def chat_row_values(self, index):
+        chat = self.chat_data[index]
+        return (chat.chat_id, chat.date_str, chat.title, source_label(chat.source))
+    
+    def _load_failed(self, e):
+        self.load_task = None
+        self.stats["Load"].finish()
+        self.status_var.set(f"Error: {str(e)}")
+        messagebox.showerror("Error", f"Failed to load chat records: {str(e)}")
     
     def on_chat_select(self, event):
         selected_items = self.chat_list.selection()
@@ -282,50 +838,73 @@ class CursorChatViewer:
         
         try:
             index = int(selected_items[0])
-            _, _, key, value, _ = self.chat_data[index]
+            chat = self.chat_data[index]
+            key = chat.key
             
-            self.content_text.delete(1.0, tk.END)
+            self.clear_content()
             
-            # Try to decode the BLOB data
-            try:
-                # Check if value is already a string
-                if isinstance(value, str):
-                    text = value
-                else:
-                    # First try to decompress with zlib if it looks compressed
+            snippet = self.search_snippets.get(key)
+            if snippet:
+                self.status_var.set(f"Viewing chat: {key} | {' '.join(snippet.split())}")
+            else:
+                self.status_var.set(f"Viewing chat: {key}")
+            
+            # Rendered text is cached per view, as JSON or as a chat transcript
+            render_key = (key, self.chat_view.get())
+            text = self.render_cache.get(render_key)
+            if text is not None:
+                self.content_text.insert(tk.END, text)
+                return
+            
+            # Fetch the value, decompressed if it looks compressed, and format it
+            # in the background, showing it as it comes in
+            value = self.value_cache.get(key)
+            pieces = []
+            
+            def work(task):
+                nonlocal value
+                if value is None:
+                    value = read_chat_value(chat)
+                    # The cache belongs to the Tk thread, so it is filled from there
+                    task.post(self.value_cache.put, key, value)
+                conversation = None
+                if render_key[1]:
                     try:
-                        if value[:2] == b'x\x9c':  # zlib magic number
-                            value = zlib.decompress(value)
-                    except Exception:
+                        conversation = parse_conversation(value, record_fetcher(chat.source))
+                    except UnicodeDecodeError:
                         pass
-                    
-                    # Try to decode as UTF-8 text
-                    text = value.decode('utf-8')
-                
-                # Check if it's JSON and format it
-                try:
-                    json_data = json.loads(text)
-                    # 添加ensure_ascii=False确保中文直接显示
-                    text = json.dumps(json_data, indent=2, ensure_ascii=False)
-                except json.JSONDecodeError:
-                    pass
-                
-                self.content_text.insert(tk.END, text)
-            except UnicodeDecodeError:
-                # If UTF-8 decoding fails, show hex representation
-                if isinstance(value, bytes):
-                    hex_view = ' '.join(f'{b:02x}' for b in value[:1000])
-                    self.content_text.insert(tk.END, f"Binary data (showing first 1000 bytes):\n{hex_view}")
-                    if len(value) > 1000:
-                        self.content_text.insert(tk.END, f"\n... {len(value) - 1000} more bytes ...")
-                else:
-                    self.content_text.insert(tk.END, f"Unable to display content: {type(value)}")
+                # Values that are not a chat are shown as they are
+                formatted = iter_chat_text(conversation) if conversation is not None else iter_formatted_value(value)
+                for piece in formatted:
+                    if task.cancelled:
+                        return
+                    task.post(self._append_content, pieces, piece)
+                task.post(self._finish_render, render_key, pieces)
             
-            self.status_var.set(f"Viewing chat: {key}")
+            self.render_task = BackgroundTask(self.root, work, self._render_failed).start()
         except Exception as e:
             self.status_var.set(f"Error: {str(e)}")
             messagebox.showerror("Error", f"Failed to display chat content: {str(e)}")
     
+    def clear_content(self):
+        """Empty the content pane and stop any chat still being rendered into it."""
+        if self.render_task is not None:
+            self.render_task.cancel()
+            self.render_task = None
+        self.content_text.delete(1.0, tk.END)
+    
+    def _append_content(self, pieces, piece):
+        pieces.append(piece)
+        self.content_text.insert(tk.END, piece)
+    
+    def _finish_render(self, render_key, pieces):
+        self.render_task = None
+        self.render_cache.put(render_key, ''.join(pieces))
+    
+    def _render_failed(self, e):
+        self.render_task = None
+        self.status_var.set(f"Error: {str(e)}")
+    
     def export_json(self):
         selected_items = self.chat_list.selection()
         if not selected_items:
@@ -334,7 +913,8 @@ class CursorChatViewer:
         
         try:
             index = int(selected_items[0])
-            chat_id, _, key, value, _ = self.chat_data[index]
+            chat = self.chat_data[index]
+            chat_id = chat.chat_id
             
             # Get save path
             file_path = filedialog.asksaveasfilename(
@@ -348,10 +928,9 @@ class CursorChatViewer:
                 return
             
             # Process data
+            value = self.get_chat_value(chat)
             try:
                 if isinstance(value, bytes):
-                    if value[:2] == b'x\x9c':
-                        value = zlib.decompress(value)
                     text = value.decode('utf-8')
                 else:
                     text = value  # Already a string
@@ -385,7 +964,8 @@ class CursorChatViewer:
         
         try:
             index = int(selected_items[0])
-            chat_id, _, key, value, _ = self.chat_data[index]
+            chat = self.chat_data[index]
+            chat_id = chat.chat_id
             
             # Get save path
             file_path = filedialog.asksaveasfilename(
@@ -399,50 +979,9 @@ class CursorChatViewer:
                 return
             
             # Process data
+            value = self.get_chat_value(chat)
             try:
-                if isinstance(value, bytes):
-                    if value[:2] == b'x\x9c':
-                        value = zlib.decompress(value)
-                    text = value.decode('utf-8')
-                else:
-                    text = value  # Already a string
-                
-                # If it's JSON, try to extract meaningful content
-                try:
-                    json_data = json.loads(text)
-                    
-                    # Process chat data into readable format if possible
-                    if isinstance(json_data, dict) and 'messages' in json_data and isinstance(json_data['messages'], list):
-                        messages = json_data['messages']
-                        readable_text = []
-                        
-                        if 'title' in json_data and json_data['title']:
-                            readable_text.append(f"Title: {json_data['title']}\n")
-                        
-                        for msg in messages:
-                            if isinstance(msg, dict) and 'role' in msg and 'content' in msg:
-                                role = msg['role'].upper()
-                                content = msg['content']
-                                
-                                # Add timestamp if available
-                                timestamp_str = ""
-                                if 'timestamp' in msg:
-                                    try:
-                                        timestamp = int(msg['timestamp'])
-                                        if timestamp > 1000000000000:  # milliseconds
-                                            timestamp /= 1000
-                                        time_str = datetime.fromtimestamp(timestamp).strftime("%Y-%m-%d %H:%M:%S")
-                                        timestamp_str = f" ({time_str})"
-                                    except:
-                                        pass
-                                
-                                readable_text.append(f"[{role}{timestamp_str}]\n{content}\n\n")
-                        
-                        text = '\n'.join(readable_text)
-                except json.JSONDecodeError:
-                    # Not JSON, keep as is
-                    pass
-                
+                text = format_chat_text(value, record_fetcher(chat.source))
                 with open(file_path, 'w', encoding='utf-8') as f:
                     f.write(text)
                 
@@ -459,70 +998,205 @@ class CursorChatViewer:
             self.status_var.set(f"Error exporting: {str(e)}")
             messagebox.showerror("Export Error", str(e))
     
+    def export_all(self):
+        """Export every chat in the list, or just the search results while a
+        search is shown, to one archive or JSON Lines file."""
+        chats = [self.chat_data[index] for index in self.chat_list.rows]
+        if not chats:
+            messagebox.showinfo("Export", "There are no chats to export")
+            return
+        
+        file_path = filedialog.asksaveasfilename(
+            title="Export All Chats",
+            defaultextension=".zip",
+            filetypes=[("Zip archives", "*.zip"), ("Gzipped tar archives", "*.tar.gz"),
+                       ("JSON Lines files", "*.jsonl"), ("All files", "*.*")],
+            initialfile="cursor_chats.zip"
+        )
+        if not file_path:
+            return
+        
+        total = len(chats)
+        stats = self._start_stats("Export")
+        
+        def work(task):
+            writer = open_export_writer(file_path)
+            try:
+                count = export_chats(
+                    chats, writer, stats=stats,
+                    progress=lambda n: task.post(self.status_var.set, f"Exporting... {n} of {total} chats"))
+            finally:
+                writer.close()
+                stats.finish()
+            task.post(self.status_var.set, f"Exported {count} chats to {file_path}")
+        
+        self.status_var.set(f"Exporting {total} chats...")
+        BackgroundTask(
+            self.root, work,
+            on_error=lambda e: messagebox.showerror("Export Error", str(e))).start()
+    
     def analyze_db(self):
         """Analyze the database to identify all key prefixes and their count."""
+        db_path = self.db_path.get()
+        stats = self._start_stats("Analyze")
+        
+        def work(task):
+            try:
+                sources = discover_databases(db_path.split(os.pathsep))
+                if not sources:
+                    raise FileNotFoundError(f"No database at {db_path}")
+                analysis = analyze_prefixes(sources, stats=stats)
+            finally:
+                stats.finish()
+            task.post(self._show_analysis, analysis, len(sources))
+        
+        self.status_var.set("Analyzing database...")
+        BackgroundTask(
+            self.root, work,
+            on_error=lambda e: messagebox.showerror("Analysis Error", f"Failed to analyze database: {str(e)}")).start()
+    
+    def archive_db(self):
+        """Add the chats of the databases being viewed, and the bubbles of newer
+        chats, to a chat archive, which Browse can open later like a database."""
+        db_path = self.db_path.get()
+        file_path = filedialog.asksaveasfilename(
+            title="Archive Chats",
+            defaultextension=ARCHIVE_SUFFIX,
+            filetypes=[("Chat Archive", f"*{ARCHIVE_SUFFIX}"), ("All files", "*.*")],
+            initialfile=f"cursor_chats{ARCHIVE_SUFFIX}",
+            # An existing archive is updated, not replaced
+            confirmoverwrite=False
+        )
+        if not file_path:
+            return
+        prefixes = tuple(dict.fromkeys(ARCHIVE_PREFIXES + (self.key_prefix.get(),)))
+        stats = self._start_stats("Archive")
+        
+        def work(task):
+            try:
+                sources = discover_databases(db_path.split(os.pathsep))
+                if not sources:
+                    raise FileNotFoundError(f"No database at {db_path}")
+                summary = archive_chats(
+                    sources, file_path, prefixes, stats=stats,
+                    progress=lambda n: task.post(self.status_var.set, f"Archiving... {n} records read"))
+            finally:
+                stats.finish()
+            task.post(self.status_var.set,
+                      f"Archived {summary.added} new or changed records to {file_path} "
+                      f"({summary.unchanged} unchanged, {format_size(os.path.getsize(file_path))})")
+        
+        self.status_var.set("Archiving chats...")
+        BackgroundTask(
+            self.root, work,
+            on_error=lambda e: messagebox.showerror("Archive Error", str(e))).start()
+    
+    def _show_analysis(self, analysis, source_count):
+        self.status_var.set(f"Analyzed {analysis.total} keys")
+        # Create a report
+        report = "Database Key Analysis:\n\n"
+        report += f"Total keys: {analysis.total}\n"
+        report += f"Total value size: {format_size(analysis.total_bytes)}\n"
+        if analysis.sample_every > 1:
+            report += f"(Compressed shares estimated from every {analysis.sample_every}th record)\n"
+        report += "\nKey prefixes found, largest first:\n"
+        for stats in analysis.prefixes:
+            average = format_size(stats.total_bytes // stats.count) if stats.count else "-"
+            compressed = f"{stats.compressed_share:.0%}" if stats.compressed_share is not None else "?"
+            report += (f"- {stats.prefix}: {stats.count} keys, {format_size(stats.total_bytes)} "
+                       f"(avg {average}, {compressed} compressed)\n")
+        
+        report += "\nLargest keys:\n"
+        for key, size, path in analysis.largest:
+            source = f" [{source_label(path)}]" if source_count > 1 else ""
+            report += f"- {key}: {format_size(size or 0)}{source}\n"
+        
+        sorted_prefixes = [(stats.prefix, stats.count) for stats in analysis.prefixes]
+        
+        # Show in dialog
+        dialog = tk.Toplevel(self.root)
+        dialog.title("Database Analysis")
+        dialog.geometry("640x480")
+        
+        text = scrolledtext.ScrolledText(dialog, wrap=tk.WORD)
+        text.pack(fill=tk.BOTH, expand=True, padx=10, pady=10)
+        text.insert(tk.END, report)
+        
+        # Add buttons to set prefix
+        button_frame = ttk.Frame(dialog)
+        button_frame.pack(fill=tk.X, padx=10, pady=(0, 10))
+        
+        ttk.Label(button_frame, text="Select a prefix:").pack(side=tk.LEFT)
+        
+        prefix_var = tk.StringVar()
+        prefix_combo = ttk.Combobox(button_frame, textvariable=prefix_var, 
+                                   values=[p[0] for p in sorted_prefixes if p[0] != "(no prefix)"])
+        prefix_combo.pack(side=tk.LEFT, padx=5)
+        
+        def set_prefix():
+            self.key_prefix.set(prefix_var.get())
+            dialog.destroy()
+            self.load_chats()
+        
+        ttk.Button(button_frame, text="Use This Prefix", command=set_prefix).pack(side=tk.LEFT, padx=5)
+        ttk.Button(button_frame, text="Close", command=dialog.destroy).pack(side=tk.RIGHT)
+    
+    def _start_stats(self, name):
+        """Return new Stats for an operation, replacing those of the previous one of its kind."""
+        stats = Stats(name)
+        self.stats.pop(name, None)
+        self.stats[name] = stats
+        return stats
+    
+    def show_stats(self):
+        """Show where the time of the latest load, refresh, search, export and
+        analysis went, updated live while any of them is still running."""
+        if self.stats_dialog is not None and self.stats_dialog.winfo_exists():
+            self.stats_dialog.lift()
+            return
+        dialog = self.stats_dialog = tk.Toplevel(self.root)
+        dialog.title("Performance Stats")
+        dialog.geometry("560x480")
+        
+        text = scrolledtext.ScrolledText(dialog, wrap=tk.NONE, font=("Courier New", 10))
+        text.pack(fill=tk.BOTH, expand=True, padx=10, pady=10)
+        
+        button_frame = ttk.Frame(dialog)
+        button_frame.pack(fill=tk.X, padx=10, pady=(0, 10))
+        ttk.Button(button_frame, text="Save JSON", command=lambda: self.save_stats(write_stats_json, ".json")).pack(side=tk.LEFT)
+        ttk.Button(button_frame, text="Save Trace", command=lambda: self.save_stats(write_stats_trace, ".trace.json")).pack(side=tk.LEFT, padx=5)
+        ttk.Button(button_frame, text="Close", command=dialog.destroy).pack(side=tk.RIGHT)
+        
+        def update():
+            if not dialog.winfo_exists():
+                return
+            report = "\n\n".join(stats.format() for stats in reversed(self.stats.values()))
+            top = text.yview()[0]
+            text.delete(1.0, tk.END)
+            text.insert(tk.END, report or "Nothing measured yet. Connect to a database, search or export first.")
+            text.yview_moveto(top)
+            dialog.after(STATS_REFRESH_MS, update)
+        
+        update()
+    
+    def save_stats(self, write, extension):
+        if not self.stats:
+            messagebox.showinfo("Stats", "Nothing measured yet")
+            return
+        file_path = filedialog.asksaveasfilename(
+            title="Save Stats",
+            defaultextension=extension,
+            filetypes=[("JSON files", "*.json"), ("All files", "*.*")],
+            initialfile="cursor_chat_stats" + extension,
+            parent=self.stats_dialog
+        )
+        if not file_path:
+            return
         try:
-            # Connect to the database
-            conn = sqlite3.connect(self.db_path.get())
-            cursor = conn.cursor()
-            
-            # Query all keys
-            cursor.execute("SELECT key FROM cursorDiskKV")
-            keys = [row[0] for row in cursor.fetchall()]
-            
-            # Analyze prefixes
-            prefixes = {}
-            for key in keys:
-                # Extract prefix (everything before the first colon)
-                parts = key.split(':', 1)
-                if len(parts) > 1:
-                    prefix = parts[0] + ':'
-                else:
-                    prefix = "(no prefix)"
-                
-                prefixes[prefix] = prefixes.get(prefix, 0) + 1
-            
-            # Sort by count (descending)
-            sorted_prefixes = sorted(prefixes.items(), key=lambda x: x[1], reverse=True)
-            
-            # Create a report
-            report = "Database Key Analysis:\n\n"
-            report += f"Total keys: {len(keys)}\n\n"
-            report += "Key prefixes found:\n"
-            for prefix, count in sorted_prefixes:
-                report += f"- {prefix}: {count} keys\n"
-            
-            # Show in dialog
-            dialog = tk.Toplevel(self.root)
-            dialog.title("Database Analysis")
-            dialog.geometry("400x400")
-            
-            text = scrolledtext.ScrolledText(dialog, wrap=tk.WORD)
-            text.pack(fill=tk.BOTH, expand=True, padx=10, pady=10)
-            text.insert(tk.END, report)
-            
-            # Add buttons to set prefix
-            button_frame = ttk.Frame(dialog)
-            button_frame.pack(fill=tk.X, padx=10, pady=(0, 10))
-            
-            ttk.Label(button_frame, text="Select a prefix:").pack(side=tk.LEFT)
-            
-            prefix_var = tk.StringVar()
-            prefix_combo = ttk.Combobox(button_frame, textvariable=prefix_var, 
-                                       values=[p[0] for p in sorted_prefixes if p[0] != "(no prefix)"])
-            prefix_combo.pack(side=tk.LEFT, padx=5)
-            
-            def set_prefix():
-                self.key_prefix.set(prefix_var.get())
-                dialog.destroy()
-                self.load_chats()
-            
-            ttk.Button(button_frame, text="Use This Prefix", command=set_prefix).pack(side=tk.LEFT, padx=5)
-            ttk.Button(button_frame, text="Close", command=dialog.destroy).pack(side=tk.RIGHT)
-            
-            conn.close()
-        except Exception as e:
-            messagebox.showerror("Analysis Error", f"Failed to analyze database: {str(e)}")
+            write(file_path, list(self.stats.values()))
+            self.status_var.set(f"Saved stats to {file_path}")
+        except OSError as e:
+            messagebox.showerror("Stats", f"Failed to save stats: {str(e)}")
 
 def main():
     root = tk.Tk()
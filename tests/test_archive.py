@@ -0,0 +1,55 @@
+import os
+import sys
+import json
+import sqlite3
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from cursor_chat_core import database_pool, archive_chats, discover_databases, fetch_value, decompress_value
+
+def make_database(path, records):
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE cursorDiskKV (key TEXT UNIQUE ON CONFLICT REPLACE, value BLOB)")
+    conn.executemany("INSERT INTO cursorDiskKV VALUES (?, ?)", records.items())
+    conn.commit()
+    conn.close()
+
+def chat_value(chat_id, messages):
+    return json.dumps({"composerId": chat_id, "name": f"Chat {chat_id}", "createdAt": 1700000000000,
+                       "conversation": [{"type": 1, "text": f"Message {i} " + "text " * 80} for i in range(messages)]})
+
+class ArchiveTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.dir.cleanup)
+        self.addCleanup(database_pool.close_all)
+        folder = os.path.join(self.dir.name, "User")
+        os.makedirs(folder)
+        # The backup is an older copy: every chat has fewer messages than the live one
+        self.live = {f"composerData:{i:04d}": chat_value(f"{i:04d}", 3) for i in range(30)}
+        backup = {f"composerData:{i:04d}": chat_value(f"{i:04d}", 2) for i in range(30)}
+        backup["composerData:only-in-backup"] = chat_value("only-in-backup", 1)
+        make_database(os.path.join(folder, "state.vscdb"), self.live)
+        make_database(os.path.join(folder, "state.vscdb.backup"), backup)
+        self.sources = discover_databases([folder])
+        self.archive = os.path.join(self.dir.name, "history.ccarchive")
+
+    def test_archiving_unchanged_sources_again_adds_nothing(self):
+        first = archive_chats(self.sources, self.archive)
+        self.assertEqual(first.added, 31)
+        for _ in range(2):
+            summary = archive_chats(self.sources, self.archive)
+            self.assertEqual(summary.added, 0)
+            self.assertEqual(summary.unchanged, 31)
+
+        with database_pool.connection(self.archive) as conn:
+            for key, value in self.live.items():
+                self.assertEqual(decompress_value(fetch_value(conn, key)), value.encode("utf-8"))
+            self.assertIsNotNone(fetch_value(conn, "composerData:only-in-backup"))
+            versions = conn.execute("SELECT max(n) FROM (SELECT count(*) AS n FROM records GROUP BY key)").fetchone()[0]
+        self.assertEqual(versions, 1)
+
+if __name__ == "__main__":
+    unittest.main()
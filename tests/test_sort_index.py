@@ -0,0 +1,80 @@
+import os
+import sys
+import random
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from cursor_chat_core import ChatMeta, SortIndex, SORT_COLUMNS, chat_sort_value
+
+def make_chat(key, timestamp=None, title="", size=0, message_count=0, source="state.vscdb"):
+    return ChatMeta(key, "Unknown" if timestamp is None else str(timestamp), key, title, size, False,
+                    message_count, 0, source, timestamp)
+
+class SortIndexTest(unittest.TestCase):
+
+    def setUp(self):
+        self.chats = [make_chat("a"), make_chat("b", 200), make_chat("c", 300), make_chat("d"), make_chat("e", 100)]
+        self.index = SortIndex(self.chats)
+
+    def keys(self, positions):
+        return [self.chats[position].key for position in positions]
+
+    def test_until_leaves_out_chats_without_a_date(self):
+        self.assertEqual(self.keys(self.index.query("date", until=250)), ["e", "b"])
+        self.assertEqual(self.keys(self.index.query("key", until=250)), ["b", "e"])
+
+    def test_since_leaves_out_chats_without_a_date(self):
+        self.assertEqual(self.keys(self.index.query("date", reverse=True, since=150)), ["c", "b"])
+
+    def test_chats_without_a_date_sort_first(self):
+        self.assertEqual(self.keys(self.index.query("date")), ["a", "d", "e", "b", "c"])
+
+    def test_limit_below_one_returns_nothing(self):
+        self.assertEqual(self.index.query("date", limit=0), [])
+        self.assertEqual(self.index.query("title", limit=-1, since=150), [])
+    
+    def test_matches_filtering_and_sorting_every_chat(self):
+        rng = random.Random(1)
+        titles = ["Fix bug", "fix tests", "Refactor", "Ünïcode", "", "FIX all"]
+        chats = [make_chat(f"k{i:03d}", rng.choice([None, rng.uniform(0, 1000)]), rng.choice(titles),
+                           rng.randrange(1000), rng.randrange(5), rng.choice(["x", "y"])) for i in range(300)]
+        index = SortIndex(chats)
+        for _ in range(300):
+            sort = rng.choice(SORT_COLUMNS)
+            reverse = rng.random() < 0.5
+            filters = {
+                "since": rng.choice([None, rng.uniform(0, 1000)]),
+                "until": rng.choice([None, rng.uniform(0, 1000)]),
+                "title": rng.choice([None, "fix", "FI", "ü", "zzz"]),
+                "min_size": rng.choice([None, rng.randrange(1000)]),
+                "max_size": rng.choice([None, rng.randrange(1000)]),
+            }
+
+            def wanted(chat):
+                if filters["since"] is not None and (chat.timestamp is None or chat.timestamp < filters["since"]):
+                    return False
+                if filters["until"] is not None and (chat.timestamp is None or chat.timestamp >= filters["until"]):
+                    return False
+                if filters["title"] and not chat.title.casefold().startswith(filters["title"].casefold()):
+                    return False
+                if filters["min_size"] is not None and chat.size < filters["min_size"]:
+                    return False
+                return filters["max_size"] is None or chat.size <= filters["max_size"]
+
+            expected = sorted((chat for chat in chats if wanted(chat)),
+                              key=lambda chat: (chat_sort_value(chat, sort), chat.key), reverse=reverse)
+            expected = [chat.key for chat in expected]
+            self.assertEqual([chats[p].key for p in index.query(sort, reverse, **filters)], expected)
+
+            # Paging with after visits the same chats
+            pages, after = [], None
+            while True:
+                page = index.query(sort, reverse, after=after, limit=7, **filters)
+                pages += [chats[p].key for p in page]
+                if len(page) < 7:
+                    break
+                after = index.sort_key(page[-1], sort)
+            self.assertEqual(pages, expected)
+
+if __name__ == "__main__":
+    unittest.main()